@@ -0,0 +1,312 @@
+"""
+Аналитика результатов скрапинга: частота постов, распределения просмотров и пересылок,
+вовлечённость, реакции, типы медиа, частые слова и хэштеги.
+Считается векторно по колонкам MessageBuffer (NumPy поверх array без копирования)
+или по колонкам Parquet-датасета потоковой выгрузки — без dict на сообщение.
+"""
+import re
+from collections import Counter
+
+from export import partition_parts
+from message_buffer import MEDIA_TYPES, NULL, iso_from_unixtime
+
+# Сколько строк в топах реакций, слов и хэштегов
+TOP_N = 20
+# Текст разбирается пачками: память под токены не растёт с размером результата
+TEXT_CHUNK_SIZE = 50_000
+# Частые слова считаются по равномерной выборке не больше стольких сообщений (хэштеги — по всем)
+WORD_SAMPLE_SIZE = 200_000
+# Периоды графика частоты постов: правило resample pandas → подпись
+FREQUENCIES = {"D": "По дням", "W": "По неделям", "MS": "По месяцам"}
+# Границы корзин для распределений просмотров и пересылок
+HISTOGRAM_EDGES = (0, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+WORD_PATTERN = re.compile(r"[^\W\d_]{3,}")
+HASHTAG_PATTERN = re.compile(r"#\w*[^\W\d_]\w*")
+# Обрезается с краёв токена; регистр и пунктуация нормализуются по словарю токенов, а не по всему тексту
+PUNCTUATION = "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~«»—–…“”„‘’·•"
+STOPWORDS = frozenset(
+    """
+    the and for are but not you all any can had her was one our out has have this that with from they will
+    your what when more about which their there been into than then them these some just like also only
+    http https www com
+    что как это так все его для она они уже или чем если был была были быть есть нет ещё еще при
+    которые который которая которое этот эта эти того тем там тут где кто вот даже только можно нужно
+    очень когда после чтобы свой своих себя меня мне нас вас них ним под над без про будет
+    """.split()
+)
+
+
+def buffer_columns(messages):
+    """Колонки MessageBuffer как массивы NumPy (без копирования) и списки текстов/эмодзи."""
+    import numpy as np
+
+    return {
+        "ids": np.frombuffer(messages.ids, dtype=np.int64),
+        "date": np.frombuffer(messages.date_unixtime, dtype=np.int64),
+        "views": np.frombuffer(messages.views, dtype=np.int64),
+        "forwards": np.frombuffer(messages.forwards, dtype=np.int64),
+        "media": np.frombuffer(messages.media, dtype=np.uint8),
+        "reaction_offsets": np.frombuffer(messages.reaction_offsets, dtype=np.uint64).astype(np.int64),
+        "reaction_emoji": np.frombuffer(messages.reaction_emoji, dtype=np.uint16),
+        "reaction_counts": np.frombuffer(messages.reaction_counts, dtype=np.int64),
+        "emoji_table": messages.emoji_table,
+        "texts": messages.texts,
+    }
+
+
+def parquet_columns(path):
+    """
+    Те же колонки, что buffer_columns, из файла Parquet-выгрузки (схема export.parquet_schema).
+    path — файл или список файлов канала (part-N.parquet после дозаписи), читаются подряд.
+    """
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    filters = None
+    paths = path if isinstance(path, list) else [path]
+    if "post_id" in pq.read_schema(paths[0]).names:
+        # Комментарии лежат в файле канала после постов: аналитика — только по постам
+        filters = pc.field("post_id").is_null()
+    table = pq.read_table(
+        paths if len(paths) > 1 else paths[0], columns=["message_id", "date", "text", "views", "forwards", "media_type", "reactions"], filters=filters
+    )
+
+    def int_column(column):
+        return pc.fill_null(column.cast(pa.int64()), NULL).combine_chunks().to_numpy()
+
+    media = table.column("media_type").combine_chunks().cast(pa.string()).to_pandas()
+    reactions = table.column("reactions").combine_chunks()
+    offsets = reactions.offsets.to_numpy().astype(np.int64)
+    flat = reactions.flatten()
+    emoji = flat.field("emoji").dictionary_encode()
+    return {
+        "ids": int_column(table.column("message_id")),
+        # Parquet хранит время в мс: сначала обратно в секунды
+        "date": int_column(table.column("date").cast(pa.timestamp("s", tz="UTC"))),
+        "views": int_column(table.column("views")),
+        "forwards": int_column(table.column("forwards")),
+        "media": pd.Categorical(media, categories=list(MEDIA_TYPES)).codes.clip(0).astype(np.uint8),
+        "reaction_offsets": offsets - offsets[0],
+        "reaction_emoji": emoji.indices.to_numpy(zero_copy_only=False),
+        "reaction_counts": pc.fill_null(flat.field("count"), 0).to_numpy(zero_copy_only=False),
+        "emoji_table": emoji.dictionary.to_pylist(),
+        "texts": table.column("text").to_pylist(),
+    }
+
+
+def channel_labels(results):
+    """Подписи каналов результата: название, а при повторе — название и ссылка."""
+    labels = []
+    for ch in results:
+        label = ch.get("channel_title") or ch.get("channel", "")
+        if label in labels:
+            label = f"{label} ({ch.get('channel', '')})"
+        labels.append(label)
+    return labels
+
+
+def channel_columns(ch, stream_path=None):
+    """
+    Колонки канала результата. При потоковой Parquet-выгрузке они читаются из датасета
+    stream_path, а не из предпросмотра в памяти; None, если файла канала нет.
+    """
+    if not stream_path:
+        return buffer_columns(ch["messages"])
+    parts = partition_parts(stream_path, ch.get("channel", ""))
+    return parquet_columns(parts) if parts else None
+
+
+def result_columns(results, stream_path=None):
+    """(название канала, колонки) для каждого канала результата — см. channel_columns."""
+    channels = []
+    for label, ch in zip(channel_labels(results), results):
+        columns = channel_columns(ch, stream_path)
+        if columns is not None:
+            channels.append((label, columns))
+    return channels
+
+
+def reactions_per_message(columns):
+    """Сумма реакций каждого сообщения (по диапазонам reaction_offsets)."""
+    import numpy as np
+
+    totals = np.concatenate(([0], np.cumsum(columns["reaction_counts"])))
+    offsets = columns["reaction_offsets"]
+    return totals[offsets[1:]] - totals[offsets[:-1]]
+
+
+def histogram(values):
+    """Число сообщений в корзинах HISTOGRAM_EDGES (пустые значения не считаются)."""
+    import numpy as np
+
+    values = values[values != NULL]
+    bins = np.searchsorted(HISTOGRAM_EDGES, values, side="right") - 1
+    return np.bincount(bins, minlength=len(HISTOGRAM_EDGES))
+
+
+def histogram_labels():
+    labels = [f"{lo:,}–{hi - 1:,}" for lo, hi in zip(HISTOGRAM_EDGES, HISTOGRAM_EDGES[1:])]
+    return labels + [f"{HISTOGRAM_EDGES[-1]:,}+"]
+
+
+def channel_summary(label, columns):
+    """Строка сводной таблицы канала: объём, период, просмотры, пересылки, реакции, вовлечённость."""
+    import numpy as np
+
+    dates = columns["date"][columns["date"] != NULL]
+    views = columns["views"]
+    forwards = columns["forwards"]
+    has_views = views != NULL
+    reactions = reactions_per_message(columns)
+    forwards_known = np.where(forwards != NULL, forwards, 0)
+    messages = len(views)
+    days = (dates.max() - dates.min()) / 86400 + 1 if len(dates) else 0
+    views_total = views[has_views].sum()
+    # Вовлечённость: (пересылки + реакции) / просмотры по сообщениям, где просмотры известны
+    engaged = forwards_known[has_views].sum() + reactions[has_views].sum()
+    view_values = views[has_views]
+    return {
+        "Канал": label,
+        "Сообщений": messages,
+        "Первый пост": iso_from_unixtime(int(dates.min()))[:10] if len(dates) else None,
+        "Последний пост": iso_from_unixtime(int(dates.max()))[:10] if len(dates) else None,
+        "Постов в день": round(messages / days, 2) if days else None,
+        "Просмотры, медиана": float(np.median(view_values)) if len(view_values) else None,
+        "Просмотры, среднее": round(float(view_values.mean()), 1) if len(view_values) else None,
+        "Просмотры, p90": float(np.percentile(view_values, 90)) if len(view_values) else None,
+        "Пересылки, среднее": round(float(forwards_known.mean()), 2) if messages else None,
+        "Реакций": int(reactions.sum()),
+        "Вовлечённость, %": round(100 * engaged / views_total, 3) if views_total else None,
+    }
+
+
+def daily_posts(channels):
+    """Постов в день по каналам: строки — дни (UTC), колонки — каналы."""
+    import numpy as np
+    import pandas as pd
+
+    series = {}
+    for label, columns in channels:
+        dates = columns["date"][columns["date"] != NULL]
+        if not len(dates):
+            continue
+        days = dates // 86400
+        first = days.min()
+        counts = np.bincount(days - first)
+        series[label] = pd.Series(counts, index=pd.to_datetime(np.arange(first, first + len(counts)), unit="D"))
+    if not series:
+        return pd.DataFrame()
+    return pd.DataFrame(series).fillna(0).astype(int)
+
+
+def posting_frequency(daily, freq="D"):
+    """daily_posts, сгруппированные по периоду freq (ключ FREQUENCIES); пропущенные периоды — 0."""
+    if daily.empty:
+        return daily
+    return daily.resample(freq).sum()
+
+
+def top_reactions(channels, top=TOP_N):
+    """Самые частые реакции по всем каналам: эмодзи, количество, доля."""
+    import numpy as np
+    import pandas as pd
+
+    totals = Counter()
+    for _, columns in channels:
+        table = columns["emoji_table"]
+        if not table:
+            continue
+        sums = np.bincount(columns["reaction_emoji"], weights=columns["reaction_counts"], minlength=len(table))
+        for emoji, count in zip(table, sums):
+            if count:
+                totals[emoji] += int(count)
+    frame = pd.DataFrame(totals.most_common(top), columns=["Реакция", "Количество"])
+    frame["Доля, %"] = (100 * frame["Количество"] / sum(totals.values())).round(1) if totals else []
+    return frame
+
+
+def media_mix(channels):
+    """Доля типов медиа по каналам, %: строки — каналы, колонки — типы (пустые опущены)."""
+    import numpy as np
+    import pandas as pd
+
+    counts = {
+        label: np.bincount(columns["media"], minlength=len(MEDIA_TYPES))[: len(MEDIA_TYPES)]
+        for label, columns in channels
+    }
+    if not counts:
+        return pd.DataFrame()
+    frame = pd.DataFrame.from_dict(counts, orient="index", columns=list(MEDIA_TYPES))
+    frame = frame.loc[:, frame.sum() > 0]
+    return (100 * frame.div(frame.sum(axis=1).replace(0, 1), axis=0)).round(1)
+
+
+def top_terms(channels, top=TOP_N):
+    """
+    (частые слова, частые хэштеги, размер выборки для слов). Тексты разбираются пачками
+    по TEXT_CHUNK_SIZE; слова — по каждому stride-му сообщению, чтобы уложиться в WORD_SAMPLE_SIZE.
+    """
+    import pandas as pd
+
+    total = sum(len(columns["texts"]) for _, columns in channels)
+    stride = max(1, -(-total // WORD_SAMPLE_SIZE))
+    tokens = Counter()
+    tags = Counter()
+    sampled = 0
+    for _, columns in channels:
+        texts = columns["texts"]
+        for start in range(0, len(texts), TEXT_CHUNK_SIZE):
+            # Одна строка на пачку: разбор идёт в C, без цикла Python по сообщениям
+            chunk = "\n".join(texts[start:start + TEXT_CHUNK_SIZE])
+            tags.update(HASHTAG_PATTERN.findall(chunk))
+            if stride > 1:
+                sample = texts[start:start + TEXT_CHUNK_SIZE:stride]
+                chunk = "\n".join(sample)
+                sampled += len(sample)
+            else:
+                sampled += min(TEXT_CHUNK_SIZE, len(texts) - start)
+            tokens.update(chunk.split())
+    words = Counter()
+    for token, count in tokens.items():
+        word = token.strip(PUNCTUATION).lower()
+        if word not in STOPWORDS and WORD_PATTERN.fullmatch(word):
+            words[word] += count
+    hashtags = Counter()
+    for tag, count in tags.items():
+        hashtags[tag.lower()] += count
+    return (
+        pd.DataFrame(words.most_common(top), columns=["Слово", "Упоминаний"]),
+        pd.DataFrame(hashtags.most_common(top), columns=["Хэштег", "Упоминаний"]),
+        sampled,
+    )
+
+
+def compute_analytics(channels):
+    """
+    Все таблицы панели аналитики для списка (название, колонки) — см. result_columns.
+    Частота постов — по дням; другой период даёт posting_frequency без пересчёта.
+    """
+    import numpy as np
+    import pandas as pd
+
+    labels = histogram_labels()
+    views_hist = {label: histogram(columns["views"]) for label, columns in channels}
+    forwards_hist = {label: histogram(columns["forwards"]) for label, columns in channels}
+    words, hashtags, words_sampled = top_terms(channels)
+    summary = pd.DataFrame([channel_summary(label, columns) for label, columns in channels])
+    return {
+        "summary": summary,
+        "daily": daily_posts(channels),
+        "views": pd.DataFrame(views_hist, index=labels),
+        "forwards": pd.DataFrame(forwards_hist, index=labels),
+        "reactions": top_reactions(channels),
+        "media": media_mix(channels),
+        "words": words,
+        "hashtags": hashtags,
+        "words_sampled": words_sampled,
+        "messages": int(sum(len(columns["views"]) for _, columns in channels)),
+        "reactions_total": int(sum(np.sum(columns["reaction_counts"]) for _, columns in channels)),
+    }
@@ -3,15 +3,23 @@ Telegram Cloud Scraper Pro — многопользовательское при
 Премиальный SaaS-дизайн: карточки, вкладки, индикаторы статуса, валидация, экспорт.
 """
 import streamlit as st
-import asyncio
-import json
-import io
-import re
-from datetime import datetime
-from telethon import TelegramClient
-from telethon.sessions import StringSession
-from telethon.errors import FloodWaitError, SessionPasswordNeededError
+import calendar
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from telethon.errors import SessionPasswordNeededError
 import pandas as pd
+from analytics import FREQUENCIES, compute_analytics, posting_frequency, result_columns
+from client_manager import get_client_manager
+from export import EXPORT_FILES, STREAM_MIME_TYPES, cached_export, export_cache_path, new_stream_path, zip_directory
+from jobs import DEFAULT_WORKER_PROCESSES, JobStore, start_credential_vault, start_worker_pool
+from media import DEFAULT_MEDIA_CONCURRENCY, DOWNLOADABLE_TYPES, MAX_MEDIA_CONCURRENCY
+from message_buffer import MEDIA_TYPES
+from rate_limit import get_scheduler
+from result_store import ResultStore
+from scraper import DEFAULT_CONCURRENCY, MAX_CONCURRENCY, validate_channel_links
+from search_index import COUNT_LIMIT, PAGE_SIZE, SORT_ORDERS, MessageIndex, cached_index, index_path
 
 # ——— Настройка страницы ———
 st.set_page_config(
@@ -91,192 +99,79 @@ if "telegram_session_string" not in st.session_state:
     st.session_state.telegram_session_string = ""
 if "phone_login_pending" not in st.session_state:
     st.session_state.phone_login_pending = None
-if "scrape_results" not in st.session_state:
-    st.session_state.scrape_results = None
-if "scrape_log_lines" not in st.session_state:
-    st.session_state.scrape_log_lines = []
 if "last_export_format" not in st.session_state:
     st.session_state.last_export_format = "JSON"
+if "scrape_stream_path" not in st.session_state:
+    st.session_state.scrape_stream_path = None
+if "owner_id" not in st.session_state:
+    # Владелец задач: хранится в адресе страницы, чтобы после перезагрузки задачи не терялись
+    params = st.experimental_get_query_params()
+    st.session_state.owner_id = params.get("owner", [uuid.uuid4().hex])[0]
+    st.experimental_set_query_params(owner=st.session_state.owner_id)
+if "active_job_id" not in st.session_state:
+    st.session_state.active_job_id = None
+if "loaded_job_id" not in st.session_state:
+    st.session_state.loaded_job_id = None
+if "scrape_metrics" not in st.session_state:
+    st.session_state.scrape_metrics = None
+
+# ——— Фоновые задачи: скрапинг идёт в процессах-воркерах, страница только опрашивает статус ———
+JOB_STATUS_LABELS = {
+    "queued": "⏳ в очереди",
+    "running": "🔄 идёт",
+    "done": "✅ готово",
+    "failed": "❌ ошибка",
+    "cancelled": "⏹ отменена",
+}
+CHANNEL_STATUS_LABELS = {"queued": "⏳ в очереди", "running": "🔄 идёт", "done": "✅ готово", "failed": "❌ ошибка"}
+# Как часто обновлять страницу, пока есть незавершённые задачи
+JOBS_REFRESH_SECONDS = 2
+
+
+@st.cache_resource
+def credential_vault():
+    """Ключи и сессии задач — в памяти отдельного процесса, в базу очереди они не пишутся."""
+    return start_credential_vault()
+
+
+@st.cache_resource
+def job_store():
+    return JobStore(vault=credential_vault())
+
+
+@st.cache_resource
+def job_workers():
+    """Локальные воркеры, один раз на процесс Streamlit. JOBS_EXTERNAL_WORKERS=1 — воркеры запущены отдельно."""
+    # Адрес и ключ хранилища ключей воркеры получают из окружения — оно должно быть готово до их запуска
+    credential_vault()
+    if os.getenv("JOBS_EXTERNAL_WORKERS") == "1":
+        return None
+    return start_worker_pool(int(os.getenv("JOBS_WORKERS", DEFAULT_WORKER_PROCESSES)))
 
-# ——— Валидация ссылок на каналы ———
-def is_valid_channel_link(line: str) -> bool:
-    """Проверяет, похожа ли строка на ссылку/username канала."""
-    s = line.strip()
-    if not s:
-        return False
-    # @channel, t.me/channel, https://t.me/channel, или просто username (латиница/цифры/подчёркивание)
-    if s.startswith("@"):
-        return len(s) > 1 and re.match(r"^@[a-zA-Z0-9_]{5,}$", s)
-    if "t.me/" in s:
-        return True
-    if re.match(r"^[a-zA-Z0-9_]{5,32}$", s):
-        return True
-    return False
-
-
-def validate_channel_links(text: str) -> tuple[list[str], list[str]]:
-    """Возвращает (валидные ссылки, невалидные строки)."""
-    lines = [line.strip() for line in text.strip().split("\n") if line.strip()]
-    valid, invalid = [], []
-    for line in lines:
-        if is_valid_channel_link(line):
-            valid.append(line.strip())
-        else:
-            invalid.append(line)
-    return valid, invalid
-
-
-# ——— Функции скрапинга (должны быть определены до вызова) ———
-def get_media_type(message):
-    if message.photo:
-        return "photo"
-    elif message.video:
-        return "video"
-    elif message.voice:
-        return "voice"
-    elif message.document:
-        return "document"
-    elif message.audio:
-        return "audio"
-    elif message.sticker:
-        return "sticker"
-    elif message.gif:
-        return "gif"
-    elif message.poll:
-        return "poll"
-    return "none"
-
-
-def parse_reactions(message):
-    reactions = []
-    if message.reactions and hasattr(message.reactions, "results") and message.reactions.results:
-        for reaction in message.reactions.results:
-            try:
-                if reaction.reaction:
-                    emoji = getattr(reaction.reaction, "emoticon", None) or str(reaction.reaction)
-                    count = getattr(reaction, "count", 0) or 0
-                    if emoji:
-                        reactions.append({"emoji": emoji, "count": count})
-            except Exception:
-                continue
-    return reactions
 
+@st.cache_resource
+def result_store():
+    """Результаты задач в памяти сервера: общий бюджет на все сессии (RESULTS_MEMORY_MB)."""
+    return ResultStore()
 
-def build_message_url(channel_username: str, message_id: int) -> str:
-    username = channel_username.lstrip("@")
-    return f"https://t.me/{username}/{message_id}"
 
+@st.cache_data(show_spinner="Считаем аналитику…", max_entries=8)
+def cached_analytics(result_id, stream_path, _load_results):
+    """
+    Аналитика результата задачи result_id: на повторных запусках скрипта не пересчитывается.
+    Полный результат загружается (_load_results()) только при подсчёте.
+    """
+    return compute_analytics(result_columns(_load_results(), stream_path))
 
-def normalize_channel_link(link: str) -> str:
-    link = link.strip()
-    if link.startswith("https://t.me/"):
-        link = link[len("https://t.me/"):]
-    elif link.startswith("http://t.me/"):
-        link = link[len("http://t.me/"):]
-    elif link.startswith("t.me/"):
-        link = link[len("t.me/"):]
-    if link.startswith("@"):
-        link = link[1:]
-    return link.strip()
 
+# ——— Вход в Telegram: запросы идут через общий планировщик ———
+# Дольше этого FloodWait при входе не ждём — показываем ошибку
+AUTH_MAX_FLOOD_WAIT = 30
 
-async def scrape_channel(client, channel_link, options):
-    try:
-        channel_link = normalize_channel_link(channel_link)
-        entity = await client.get_entity(channel_link)
-        channel_username = entity.username if hasattr(entity, "username") else channel_link
-        mode = options.get("mode", "by_count")
-        message_limit = options.get("message_limit", 1000)
-        from_date = options.get("from_date")
-        word_limit = options.get("word_limit", 100_000)
-        messages_data = []
-        total_words = 0
-        stop_reason = None
-
-        async for message in client.iter_messages(entity, limit=message_limit):
-            try:
-                message_date = message.date
-                if mode == "by_date" and from_date and message_date:
-                    msg_date = message_date.date() if hasattr(message_date, "date") else message_date
-                    if msg_date < from_date:
-                        stop_reason = "date"
-                        break
-                text = message.text or ""
-                if mode == "by_words":
-                    total_words += len(text.split())
-                    if total_words >= word_limit:
-                        stop_reason = "words"
-                date_iso = message_date.isoformat() if message_date else None
-                date_unixtime = int(message_date.timestamp()) if message_date else None
-                messages_data.append({
-                    "id": message.id,
-                    "date": date_iso,
-                    "date_unixtime": date_unixtime,
-                    "text": text,
-                    "views": getattr(message, "views", None),
-                    "forwards": getattr(message, "forwards", None),
-                    "media_type": get_media_type(message),
-                    "reactions": parse_reactions(message),
-                    "reply_to_msg_id": getattr(message, "reply_to_msg_id", None),
-                    "url": build_message_url(channel_username, message.id),
-                })
-                if mode == "by_words" and stop_reason == "words":
-                    break
-            except FloodWaitError as e:
-                await asyncio.sleep(e.seconds)
-                continue
-            except Exception:
-                continue
 
-        return {
-            "channel": channel_link,
-            "channel_id": entity.id,
-            "channel_title": getattr(entity, "title", None),
-            "messages": messages_data,
-            "total_messages": len(messages_data),
-            "total_words": total_words if mode == "by_words" else None,
-            "stop_reason": stop_reason,
-        }
-    except FloodWaitError as e:
-        await asyncio.sleep(e.seconds)
-        return None
-    except Exception:
-        return None
-
-
-async def run_scraping(api_id, api_hash, session_string, links, options, progress_bar, log_callback):
-    all_results = []
-    client = None
-    try:
-        api_id = int(api_id.strip())
-        client = TelegramClient(
-            StringSession(session_string.strip()),
-            api_id,
-            api_hash.strip(),
-        )
-        await client.connect()
-        if not await client.is_user_authorized():
-            log_callback("❌ Сессия не авторизована.")
-            return None
-        for idx, link in enumerate(links):
-            log_callback(f"🔄 Обработка {idx + 1}/{len(links)}: {link}")
-            progress_bar.progress((idx) / len(links))
-            result = await scrape_channel(client, link, options)
-            if result:
-                all_results.append(result)
-                log_callback(f"✅ {result['total_messages']} сообщений: {link}")
-        progress_bar.progress(1.0)
-        log_callback(f"✅ Готово. Каналов: {len(all_results)}.")
-        return all_results
-    except ValueError:
-        log_callback("❌ API_ID должен быть числом.")
-        return None
-    except Exception as e:
-        log_callback(f"❌ Ошибка: {e}")
-        return None
-    finally:
-        if client:
-            await client.disconnect()
+def auth_scheduler():
+    """Планировщик шагов входа: паузы после FloodWait общие для всех сессий с этим API_ID."""
+    return get_scheduler(f"auth:{api_id_input.strip()}")
 
 
 # ——— Сайдбар: API-ключи и вход ———
@@ -334,15 +229,19 @@ with st.sidebar:
             if pending is None:
                 if st.button("📤 Отправить код в Telegram") and api_ok and phone.strip():
                     async def do_send_code():
-                        client = TelegramClient(StringSession(), int(api_id_input.strip()), api_hash_input.strip())
-                        await client.connect()
-                        sent = await client.send_code_request(phone.strip())
-                        s = client.session.save()
-                        await client.disconnect()
+                        # Клиент остаётся подключённым: шаг «Войти» возьмёт его по строке сессии
+                        clients = get_client_manager()
+                        client = await clients.acquire(api_id_input, api_hash_input)
+                        try:
+                            sent = await auth_scheduler().call(
+                                "auth", client.send_code_request, phone.strip(), max_wait=AUTH_MAX_FLOOD_WAIT
+                            )
+                        finally:
+                            s = clients.release(client)
                         return s, sent.phone_code_hash
 
                     try:
-                        session_str, phone_code_hash = asyncio.run(do_send_code())
+                        session_str, phone_code_hash = get_client_manager().run(do_send_code())
                         st.session_state.phone_login_pending = {
                             "session": session_str,
                             "phone": phone.strip(),
@@ -359,15 +258,18 @@ with st.sidebar:
                     password_2fa = st.text_input("Пароль (2FA)", type="password", placeholder="Пароль", key="password_2fa")
                     if st.button("Войти с паролем") and password_2fa:
                         async def do_sign_in_password():
-                            client = TelegramClient(StringSession(pending["session"]), int(api_id_input.strip()), api_hash_input.strip())
-                            await client.connect()
-                            await client.sign_in(password=password_2fa)
-                            s = client.session.save()
-                            await client.disconnect()
+                            clients = get_client_manager()
+                            client = await clients.acquire(api_id_input, api_hash_input, pending["session"])
+                            try:
+                                await auth_scheduler().call(
+                                    "auth", client.sign_in, password=password_2fa, max_wait=AUTH_MAX_FLOOD_WAIT
+                                )
+                            finally:
+                                s = clients.release(client)
                             return s
 
                         try:
-                            session_str = asyncio.run(do_sign_in_password())
+                            session_str = get_client_manager().run(do_sign_in_password())
                             st.session_state.telegram_session_string = session_str
                             st.session_state.phone_login_pending = None
                             st.success("Вход выполнен.")
@@ -378,24 +280,26 @@ with st.sidebar:
                     code = st.text_input("Код из Telegram", placeholder="12345", key="code")
                     if st.button("Войти") and code.strip():
                         async def do_sign_in():
-                            client = TelegramClient(StringSession(pending["session"]), int(api_id_input.strip()), api_hash_input.strip())
-                            await client.connect()
+                            clients = get_client_manager()
+                            client = await clients.acquire(api_id_input, api_hash_input, pending["session"])
+                            status = "ok"
                             try:
-                                await client.sign_in(
+                                await auth_scheduler().call(
+                                    "auth",
+                                    client.sign_in,
                                     pending["phone"],
                                     code.strip(),
                                     phone_code_hash=pending["phone_code_hash"],
+                                    max_wait=AUTH_MAX_FLOOD_WAIT,
                                 )
-                                s = client.session.save()
-                                await client.disconnect()
-                                return ("ok", s)
                             except SessionPasswordNeededError:
-                                s = client.session.save()
-                                await client.disconnect()
-                                return ("need_password", s)
+                                status = "need_password"
+                            finally:
+                                s = clients.release(client)
+                            return (status, s)
 
                         try:
-                            status, session_str = asyncio.run(do_sign_in())
+                            status, session_str = get_client_manager().run(do_sign_in())
                             if status == "need_password":
                                 st.session_state.phone_login_pending = {
                                     **pending,
@@ -453,11 +357,19 @@ with tab_config:
     st.markdown("<div class='card'><h3>Формат выгрузки</h3></div>", unsafe_allow_html=True)
     export_format = st.radio(
         "Формат выгрузки:",
-        options=["JSON", "CSV", "Excel"],
+        options=["JSON", "CSV", "Excel", "Parquet"],
         horizontal=True,
         key="export_format",
     )
     st.session_state.last_export_format = export_format
+    stream_to_disk = st.checkbox(
+        "Писать на диск во время сбора (для больших выгрузок)",
+        value=False,
+        help="Сообщения сразу сохраняются в файл JSON Lines (для JSON), CSV (для CSV и Excel) "
+             "или Parquet-датасет по каналам (для Parquet), в памяти остаётся только предпросмотр",
+    )
+    if stream_to_disk and export_format == "Excel":
+        st.caption("Excel не пишется потоково — файл будет сохранён в CSV.")
 
     start_button = st.button("🚀 Start Scraping", type="primary", use_container_width=True)
 
@@ -480,8 +392,8 @@ with tab_config:
         options=["by_count", "by_date", "from_start", "by_words"],
         format_func=lambda x: {
             "by_count": "По количеству сообщений (последние N)",
-            "by_date": "По дате (с указанной даты до сейчас)",
-            "from_start": "С самого начала истории канала",
+            "by_date": "По датам (с указанной даты по указанную или до сейчас)",
+            "from_start": "С самого начала истории канала (от старых к новым)",
             "by_words": "По количеству слов (последние N слов)",
         }[x],
         horizontal=False,
@@ -489,12 +401,19 @@ with tab_config:
 
     message_limit = 1000
     from_date_value = None
+    to_date_value = None
     word_limit_value = 100_000
 
     if scrape_mode == "by_count":
         message_limit = st.number_input("Количество последних сообщений:", min_value=1, max_value=50_000_000, value=1000, step=10000)
     elif scrape_mode == "by_date":
         from_date_value = st.date_input("С какой даты выгружать (включительно):", value=None)
+        to_date_value = st.date_input(
+            "По какую дату (включительно):",
+            value=None,
+            help="Пусто — до сегодняшнего дня. Сообщения новее этой даты не скачиваются вовсе: "
+                 "сбор сразу начинается с конца окна",
+        )
         if from_date_value:
             message_limit = 20_000_000
         else:
@@ -505,9 +424,90 @@ with tab_config:
         word_limit_value = st.number_input("Последних слов (примерно):", min_value=1000, max_value=50_000_000, value=100_000, step=10000)
         message_limit = 20_000_000
 
-    # Место под прогресс и лог
-    progress_placeholder = st.empty()
-    log_placeholder = st.empty()
+    concurrency_value = st.number_input(
+        "Каналов одновременно:",
+        min_value=1,
+        max_value=MAX_CONCURRENCY,
+        value=DEFAULT_CONCURRENCY,
+        help="Сколько каналов собирать параллельно на одной сессии",
+    )
+    incremental_value = st.checkbox(
+        "Только новые сообщения (продолжить с прошлого запуска)",
+        value=False,
+        help="Запоминает, до какого сообщения собран канал: повторный запуск скачает только новое, "
+             "а прерванная выгрузка продолжится с места остановки",
+    )
+    raw_history_value = st.checkbox(
+        "⚡ Быстрое чтение истории",
+        value=False,
+        help="Страницы истории читаются напрямую (messages.GetHistory), без объектов Message telethon, "
+             "а следующая страница загружается, пока обрабатывается текущая. Результат тот же, "
+             "меньше нагрузка на CPU на больших каналах",
+    )
+    dedup_value = st.checkbox(
+        "🧬 Искать повторы и репосты",
+        value=False,
+        help="Похожие тексты (в том числе слегка изменённые и из других каналов) собираются в кластеры "
+             "с самым ранним сообщением-источником. Индекс общий для всех запусков аккаунта",
+    )
+    drop_duplicates_value = st.checkbox(
+        "Убрать повторы из выгрузки",
+        value=False,
+        disabled=not dedup_value,
+        help="В выгрузку попадёт только первое сообщение каждого кластера",
+    )
+    comments_value = st.checkbox(
+        "💬 Собирать комментарии",
+        value=False,
+        help="Комментарии из группы обсуждения под постами: треды запрашиваются параллельно, "
+             "тред, где число комментариев не изменилось с прошлого запуска, берётся из кэша без запросов. "
+             "В выгрузке комментарии идут после постов канала, post_id — пост, к которому они относятся",
+    )
+    media_value = st.checkbox(
+        "📥 Скачивать медиа",
+        value=False,
+        help="Фото, видео и файлы качаются в фоне, пока идёт сбор текста. Файлы лежат по хэшу содержимого "
+             "в data/media: одно медиа из разных каналов хранится один раз, у сообщения в выгрузке — путь "
+             "к файлу (media_file). Прерванная загрузка продолжится при следующем запуске",
+    )
+    media_types_value = list(DOWNLOADABLE_TYPES)
+    media_max_mb = 0
+    media_concurrency_value = DEFAULT_MEDIA_CONCURRENCY
+    if media_value:
+        media_types_value = st.multiselect(
+            "Типы медиа", list(DOWNLOADABLE_TYPES), default=list(DOWNLOADABLE_TYPES), key="media_types"
+        )
+        mc1, mc2 = st.columns(2)
+        with mc1:
+            media_max_mb = st.number_input(
+                "Файлы не больше, МБ (0 — любые):", min_value=0, max_value=4000, value=50, step=10
+            )
+        with mc2:
+            media_concurrency_value = st.number_input(
+                "Файлов одновременно:",
+                min_value=1,
+                max_value=MAX_MEDIA_CONCURRENCY,
+                value=DEFAULT_MEDIA_CONCURRENCY,
+            )
+    with st.expander("👥 Пул аккаунтов (несколько сессий)", expanded=False):
+        st.caption(
+            "Дополнительные строки сессий (по одной на строку) с тем же API_ID/API_HASH. "
+            "Каналы распределяются между всеми аккаунтами; сессия с долгим FloodWait "
+            "или без авторизации выводится из ротации, её каналы собирают остальные."
+        )
+        pool_sessions_text = st.text_area(
+            "Сессии пула",
+            placeholder="1BVtsOHwBu5...\n1BVtsOKqAx7...",
+            height=100,
+            key="pool_sessions",
+        )
+        pool_id_value = st.text_input(
+            "Имя пула (необязательно)",
+            help="Контрольные точки и повторы пула хранятся под этим именем и не сбрасываются, "
+            "когда состав сессий меняется. Пусто — общие для API_ID.",
+            key="pool_id",
+        )
+    pool_sessions = [line.strip() for line in pool_sessions_text.splitlines() if line.strip()]
 
     if start_button:
         if not credentials_ok:
@@ -516,128 +516,398 @@ with tab_config:
             st.warning("⚠️ Введите хотя бы одну корректную ссылку на канал.")
         elif scrape_mode == "by_date" and not from_date_value:
             st.warning("⚠️ Выберите дату «с какой выгружать».")
+        elif scrape_mode == "by_date" and to_date_value and to_date_value < from_date_value:
+            st.warning("⚠️ Дата «по какую» раньше даты «с какой».")
         else:
-            st.session_state.scrape_log_lines = []
-            progress_bar = progress_placeholder.progress(0)
-            status_text = log_placeholder.empty()
-
-            def log_line(msg: str):
-                st.session_state.scrape_log_lines.append(msg)
-                status_text.text(msg)
-
             options = {
                 "mode": scrape_mode,
                 "message_limit": message_limit,
                 "from_date": from_date_value,
+                "to_date": to_date_value,
                 "word_limit": word_limit_value,
+                "concurrency": concurrency_value,
+                "incremental": incremental_value,
+                "pool_id": pool_id_value.strip(),
+                "raw_history": raw_history_value,
+                "dedup": dedup_value,
+                "drop_duplicates": dedup_value and drop_duplicates_value,
+                "comments": comments_value,
+                "media": media_value and bool(media_types_value),
+                "media_types": media_types_value,
+                "media_max_size": media_max_mb * 2 ** 20 or None,
+                "media_concurrency": media_concurrency_value,
             }
-
-            with st.spinner("Собираем сообщения..."):
-                async def run_scraping_async():
-                    return await run_scraping(
-                        api_id_input,
-                        api_hash_input,
-                        effective_session,
-                        valid_links,
-                        options,
-                        progress_bar,
-                        log_line,
-                    )
-
-                all_results = asyncio.run(run_scraping_async())
-
-            if all_results:
-                st.session_state.scrape_results = all_results
-                progress_placeholder.progress(1.0)
-                log_placeholder.markdown("\n".join(f"`{line}`" for line in st.session_state.scrape_log_lines[-15:]))
-                st.success(f"✅ Готово! Собрано {sum(r['total_messages'] for r in all_results)} сообщений. Перейдите на вкладку «Результаты и Анализ».")
-                st.rerun()
+            if stream_to_disk:
+                options["stream_format"] = {"JSON": "jsonl", "Parquet": "parquet"}.get(export_format, "csv")
+                options["stream_path"] = new_stream_path(options["stream_format"])
+            job_workers()
+            st.session_state.active_job_id = job_store().submit(
+                st.session_state.owner_id,
+                {
+                    "api_id": api_id_input,
+                    "api_hash": api_hash_input,
+                    "sessions": [effective_session, *pool_sessions],
+                    "links": valid_links,
+                    "options": options,
+                },
+            )
+            st.success(f"✅ Задача {st.session_state.active_job_id} поставлена в очередь. Сбор продолжится, даже если закрыть страницу.")
+
+    # ——— Мои задачи: статус, прогресс и лог из очереди ———
+    st.markdown("<div class='card'><h3>🗂 Мои задачи</h3></div>", unsafe_allow_html=True)
+    job_workers()
+    store = job_store()
+    my_jobs = store.list(st.session_state.owner_id)
+    jobs_pending = any(job["status"] in ("queued", "running") for job in my_jobs)
+    auto_refresh = st.checkbox("Обновлять автоматически", value=True, key="jobs_auto_refresh")
+    if not my_jobs:
+        st.caption("Задач пока нет — нажмите «Start Scraping».")
+    for job in my_jobs:
+        job_id = job["id"]
+        # Завершённую задачу, запущенную с этой страницы, сразу открываем во вкладке результатов
+        if job["status"] == "done" and job_id == st.session_state.active_job_id and st.session_state.loaded_job_id != job_id:
+            st.session_state.scrape_stream_path = job["stream_path"]
+            st.session_state.scrape_metrics = job["metrics"]
+            st.session_state.loaded_job_id = job_id
+        created = datetime.fromtimestamp(job["created_at"]).strftime("%d.%m %H:%M:%S")
+        with st.expander(
+            f"{JOB_STATUS_LABELS.get(job['status'], job['status'])} · задача {job_id} · {created}",
+            expanded=job_id == st.session_state.active_job_id or job["status"] in ("queued", "running"),
+        ):
+            st.progress(min(max(job["progress"], 0.0), 1.0))
+            if job["status"] == "queued":
+                st.caption(f"Задач в очереди перед этой: {store.queue_position(job_id)}")
+            if job["channels"]:
+                st.dataframe(
+                    pd.DataFrame([
+                        {
+                            "Канал": ch["link"],
+                            "Статус": CHANNEL_STATUS_LABELS.get(ch["status"], ch["status"]),
+                            "Сообщений": ch["fetched"],
+                            "Прогресс": f"{ch['fraction']:.0%}" if ch["fraction"] is not None else "—",
+                        }
+                        for ch in job["channels"]
+                    ]),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+            log_lines = store.logs(job_id)
+            if log_lines:
+                st.markdown("\n".join(f"`{line}`" for line in log_lines))
+            if job["status"] == "failed" and job["error"]:
+                st.error(job["error"].strip().splitlines()[-1])
+            if job["status"] in ("queued", "running"):
+                if st.button("⏹ Отменить", key=f"cancel_{job_id}"):
+                    store.request_cancel(job_id)
+                    st.rerun()
+            elif job["status"] == "done" and job["result_path"]:
+                if st.session_state.loaded_job_id == job_id:
+                    st.caption("Результаты открыты на вкладке «Результаты и Анализ».")
+                elif st.button("📂 Открыть результаты", key=f"load_{job_id}"):
+                    st.session_state.scrape_stream_path = job["stream_path"]
+                    st.session_state.scrape_metrics = job["metrics"]
+                    st.session_state.loaded_job_id = job_id
+                    st.rerun()
+    if jobs_pending and not auto_refresh:
+        st.button("🔄 Обновить статус", key="jobs_refresh")
 
 # ——— Вкладка «Результаты и Анализ» ———
 with tab_results:
-    res = st.session_state.scrape_results
+    result_id = st.session_state.loaded_job_id
+    res = None
+    if result_id is not None:
+        # В сессии только id задачи: предпросмотр и полный результат — в общем хранилище с бюджетом памяти
+        loaded_job = job_store().get(result_id)
+        try:
+            if loaded_job and loaded_job["result_path"]:
+                res = result_store().open(result_id, loaded_job["owner"], loaded_job["result_path"])
+        except OSError:
+            pass
+        if res is None:
+            st.warning("Файл результатов не найден на сервере — запустите скрапинг заново.")
     if res is None:
         st.info("Здесь появится предпросмотр после запуска скрапинга на вкладке «Конфигурация».")
     else:
-        st.markdown("<div class='card'><h3>📊 Предпросмотр данных</h3></div>", unsafe_allow_html=True)
-        # Собираем первые 10 сообщений из всех каналов для таблицы
-        rows = []
-        for ch in res:
-            for msg in (ch.get("messages") or [])[:10]:
-                rows.append({
-                    "Канал": ch.get("channel_title") or ch.get("channel", ""),
-                    "ID сообщения": msg.get("id"),
-                    "Дата": msg.get("date", "")[:19] if msg.get("date") else "",
-                    "Текст": (msg.get("text") or "")[:120] + ("…" if len((msg.get("text") or "")) > 120 else ""),
-                    "Просмотры": msg.get("views"),
-                    "Пересылки": msg.get("forwards"),
-                    "Медиа": msg.get("media_type", "none"),
-                    "Ссылка": msg.get("url", ""),
-                })
-        if rows:
-            df_preview = pd.DataFrame(rows)
-            st.dataframe(df_preview, use_container_width=True, height=320)
+        def load_full_results():
+            return result_store().results(result_id)
+
+        stream_path = st.session_state.scrape_stream_path
+        # При потоковой записи в JSON/CSV в памяти только предпросмотр: поиск и аналитика — по Parquet
+        columnar = not stream_path or os.path.isdir(stream_path)
+        search_path = index_path(result_id)
+        st.markdown("<div class='card'><h3>🔎 Сообщения</h3></div>", unsafe_allow_html=True)
+        if columnar and not os.path.exists(search_path):
+            st.caption("Поисковый индекс строится один раз на результат: поиск по тексту, фильтры и сортировка по вовлечённости.")
+            if st.button("🔎 Построить поисковый индекс", key="build_index"):
+                with st.spinner("Индексируем сообщения…"):
+                    cached_index(load_full_results(), result_id, stream_path)
+        if columnar and os.path.exists(search_path):
+            message_index = MessageIndex(search_path)
+            try:
+                s1, s2 = st.columns([3, 1])
+                query = s1.text_input("Поиск по тексту", placeholder="все слова должны встретиться", key="search_query")
+                order = s2.selectbox(
+                    "Сортировка", list(SORT_ORDERS), format_func=lambda key: SORT_ORDERS[key][0], key="search_order"
+                )
+                f1, f2, f3, f4 = st.columns(4)
+                search_channels = f1.multiselect("Каналы", message_index.channels(), key="search_channels")
+                search_media = f2.multiselect("Медиа", list(MEDIA_TYPES), key="search_media")
+                search_dates = f3.date_input("Период", value=(), key="search_dates")
+                min_views = f4.number_input("Просмотров от", min_value=0, step=100, key="search_min_views")
+                filters = {
+                    "channels": search_channels,
+                    "media_types": search_media,
+                    "min_views": int(min_views),
+                    "date_from": None,
+                    "date_to": None,
+                }
+                # Период — дни UTC, последний день включительно
+                if len(search_dates) >= 1:
+                    filters["date_from"] = calendar.timegm(search_dates[0].timetuple())
+                if len(search_dates) == 2:
+                    filters["date_to"] = calendar.timegm((search_dates[1] + timedelta(days=1)).timetuple())
+                matches = message_index.count(query, **filters)
+                pages = max(1, -(-min(matches, COUNT_LIMIT) // PAGE_SIZE))
+                if st.session_state.get("search_page", 1) > pages:
+                    st.session_state.search_page = 1
+                page_frame = message_index.search(
+                    query,
+                    order,
+                    page=st.session_state.get("search_page", 1) - 1,
+                    matches=matches,
+                    **filters,
+                )
+                if matches > COUNT_LIMIT:
+                    st.caption(f"Найдено больше {COUNT_LIMIT:,} сообщений — показаны первые {COUNT_LIMIT:,}".replace(",", " "))
+                else:
+                    st.caption(f"Найдено сообщений: {matches:,}".replace(",", " "))
+                st.dataframe(
+                    page_frame,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={"Ссылка": st.column_config.LinkColumn("Ссылка")},
+                )
+                st.number_input("Страница", min_value=1, max_value=pages, step=1, key="search_page")
+            finally:
+                message_index.close()
         else:
-            st.caption("Нет сообщений для предпросмотра.")
+            # Без индекса — первые 10 сообщений каждого канала
+            preview_frames = []
+            for ch in res:
+                head = ch["messages"].to_frame(stop=10)
+                if head.empty:
+                    continue
+                texts = head["text"].fillna("")
+                preview_frames.append(pd.DataFrame({
+                    "Канал": ch.get("channel_title") or ch.get("channel", ""),
+                    "ID сообщения": head["id"],
+                    "Дата": head["date"].fillna("").str[:19],
+                    "Текст": texts.str[:120] + texts.str.len().gt(120).map({True: "…", False: ""}),
+                    "Просмотры": head["views"],
+                    "Пересылки": head["forwards"],
+                    "Медиа": head["media_type"],
+                    "Ссылка": head["url"],
+                }))
+            if preview_frames:
+                df_preview = pd.concat(preview_frames, ignore_index=True)
+                st.dataframe(df_preview, use_container_width=True, height=320)
+            else:
+                st.caption("Нет сообщений для предпросмотра.")
 
-        st.markdown("<div class='card'><h3>📥 Скачать выгрузку</h3></div>", unsafe_allow_html=True)
-        final_result = {
-            "scraped_at": datetime.now().isoformat(),
-            "total_channels": len(res),
-            "total_messages": sum(r["total_messages"] for r in res),
-            "channels": res,
-        }
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        flat_rows = []
+        duplicate_rows = []
         for ch in res:
-            for msg in (ch.get("messages") or []):
-                flat_rows.append({
-                    "channel": ch.get("channel", ""),
-                    "channel_title": ch.get("channel_title", ""),
-                    "message_id": msg.get("id"),
-                    "date": msg.get("date"),
-                    "text": msg.get("text") or "",
-                    "views": msg.get("views"),
-                    "forwards": msg.get("forwards"),
-                    "media_type": msg.get("media_type", ""),
-                    "url": msg.get("url", ""),
-                })
-        df_export = pd.DataFrame(flat_rows)
-
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            json_string = json.dumps(final_result, ensure_ascii=False, indent=2)
-            st.download_button(
-                label="📥 JSON",
-                data=json_string,
-                file_name=f"telegram_scrape_{ts}.json",
-                mime="application/json",
-                use_container_width=True,
-                key="dl_json",
+            if ch.get("duplicates") is None:
+                continue
+            fetched = ch["total_messages"] + (ch["duplicates"] if ch.get("duplicates_dropped") else 0)
+            sources = sorted(ch["duplicate_sources"].items(), key=lambda item: -item[1])[:3]
+            duplicate_rows.append({
+                "Канал": ch.get("channel_title") or ch["channel"],
+                "Сообщений": fetched,
+                "Повторов": ch["duplicates"],
+                "Доля, %": round(100 * ch["duplicates"] / fetched, 1) if fetched else 0.0,
+                "Откуда повторы": ", ".join(f"{source} ({count})" for source, count in sources),
+            })
+        if duplicate_rows:
+            st.markdown("<div class='card'><h3>🧬 Повторы и репосты</h3></div>", unsafe_allow_html=True)
+            st.dataframe(pd.DataFrame(duplicate_rows), use_container_width=True, hide_index=True)
+
+        st.markdown("<div class='card'><h3>📈 Аналитика</h3></div>", unsafe_allow_html=True)
+        if not columnar:
+            st.info("При потоковой записи в JSON/CSV сообщения не хранятся в памяти — аналитика доступна для Parquet.")
+        else:
+            analytics = cached_analytics(result_id, stream_path, load_full_results)
+            a1, a2, a3 = st.columns(3)
+            a1.metric("Сообщений", f"{analytics['messages']:,}".replace(",", " "))
+            a2.metric("Каналов", len(analytics["summary"]))
+            a3.metric("Реакций", f"{analytics['reactions_total']:,}".replace(",", " "))
+            st.dataframe(analytics["summary"], use_container_width=True, hide_index=True)
+            frequency = st.radio(
+                "Частота постов:",
+                list(FREQUENCIES),
+                format_func=FREQUENCIES.get,
+                horizontal=True,
+                key="analytics_frequency",
             )
-        with col2:
-            buf_csv = io.StringIO()
-            df_export.to_csv(buf_csv, index=False, encoding="utf-8-sig")
-            st.download_button(
-                label="📥 CSV",
-                data=buf_csv.getvalue(),
-                file_name=f"telegram_scrape_{ts}.csv",
-                mime="text/csv",
-                use_container_width=True,
-                key="dl_csv",
+            if not analytics["daily"].empty:
+                st.line_chart(posting_frequency(analytics["daily"], frequency))
+            col_views, col_forwards = st.columns(2)
+            with col_views:
+                st.caption("Просмотры: сообщений в диапазоне")
+                st.bar_chart(analytics["views"])
+            with col_forwards:
+                st.caption("Пересылки: сообщений в диапазоне")
+                st.bar_chart(analytics["forwards"])
+            st.caption("Типы медиа, % сообщений канала")
+            st.dataframe(analytics["media"], use_container_width=True)
+            col_reactions, col_words, col_tags = st.columns(3)
+            with col_reactions:
+                st.caption("Топ реакций")
+                st.dataframe(analytics["reactions"], use_container_width=True, hide_index=True)
+            with col_words:
+                if analytics["words_sampled"] < analytics["messages"]:
+                    st.caption(f"Частые слова (по выборке {analytics['words_sampled']:,} сообщений)".replace(",", " "))
+                else:
+                    st.caption("Частые слова")
+                st.dataframe(analytics["words"], use_container_width=True, hide_index=True)
+            with col_tags:
+                st.caption("Хэштеги")
+                st.dataframe(analytics["hashtags"], use_container_width=True, hide_index=True)
+
+        job_metrics = st.session_state.scrape_metrics
+        if job_metrics:
+            # Куда ушло время задачи: этапы, запросы к API, FloodWait и скорость по каналам
+            with st.expander("⏱ Время и метрики задачи", expanded=False):
+                m1, m2, m3, m4, m5 = st.columns(5)
+                m1.metric("Длительность", f"{job_metrics['duration']:.1f} с")
+                m2.metric("Сообщений/с", f"{job_metrics['messages_per_sec']:.0f}")
+                m3.metric("Запросов к API", sum(job_metrics["api_requests"].values()))
+                m4.metric("FloodWait", f"{sum(job_metrics['flood_wait_seconds'].values())} с")
+                m5.metric("Записано на диск", f"{job_metrics['export_bytes'] / 2 ** 20:.1f} МБ")
+                phase_names = {
+                    "connect": "Подключение",
+                    "resolve": "Разрешение ссылок",
+                    "scrape": "Сбор",
+                    "media": "Докачка медиа",
+                    "export": "Запись",
+                }
+                media_stats = job_metrics.get("media")
+                if media_stats:
+                    st.caption(
+                        f"📥 Медиа: скачано файлов {media_stats['downloaded']} "
+                        f"({media_stats['bytes'] / 2 ** 20:.1f} МБ), уже были {media_stats['reused']}, "
+                        f"пропущено {media_stats['skipped']}, ошибок {media_stats['failed']}"
+                    )
+                st.dataframe(
+                    pd.DataFrame([
+                        {"Этап": phase_names.get(phase, phase), "Секунд": round(seconds, 2)}
+                        for phase, seconds in job_metrics["phase_seconds"].items()
+                    ]),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+                if job_metrics["per_channel"]:
+                    st.dataframe(
+                        pd.DataFrame([
+                            {
+                                "Канал": link,
+                                "Сообщений": ch["messages"],
+                                "Страниц": ch["pages"],
+                                "Секунд": round(ch["seconds"], 2),
+                                "Сообщений/с": round(ch["messages_per_sec"]),
+                                "Запись, с": round(ch["sink_seconds"], 2),
+                            }
+                            for link, ch in job_metrics["per_channel"].items()
+                        ]),
+                        use_container_width=True,
+                        hide_index=True,
+                    )
+
+        # Сколько памяти сервера занимают результаты: по ней подбирается размер инстанса
+        memory = result_store().usage()
+        with st.expander("💾 Память сервера", expanded=False):
+            mine = memory["owners"].get(st.session_state.owner_id, {"bytes": 0})
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Результаты в памяти", f"{memory['bytes'] / 2 ** 20:.1f} из {memory['budget'] / 2 ** 20:.0f} МБ")
+            c2.metric("Ваши результаты", f"{mine['bytes'] / 2 ** 20:.1f} МБ")
+            c3.metric("Подгрузок с диска", memory["loads"])
+            st.caption(
+                "Большие и давно не открывавшиеся результаты выгружаются из памяти в сжатые файлы "
+                "и подгружаются обратно, когда нужны поиску, аналитике или выгрузке."
             )
-        with col3:
-            buf_xlsx = io.BytesIO()
-            with pd.ExcelWriter(buf_xlsx, engine="openpyxl") as w:
-                df_export.to_excel(w, index=False, sheet_name="Messages")
-            st.download_button(
-                label="📥 Excel",
-                data=buf_xlsx.getvalue(),
-                file_name=f"telegram_scrape_{ts}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Пользователь": "вы" if owner == st.session_state.owner_id else owner[:8],
+                        "В памяти, МБ": round(usage["bytes"] / 2 ** 20, 1),
+                        "Результатов в памяти": usage["resident"],
+                        "Выгружено на диск": usage["spilled"],
+                    }
+                    for owner, usage in sorted(memory["owners"].items(), key=lambda item: -item[1]["bytes"])
+                ]),
                 use_container_width=True,
-                key="dl_excel",
+                hide_index=True,
             )
 
+        st.markdown("<div class='card'><h3>📥 Скачать выгрузку</h3></div>", unsafe_allow_html=True)
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if stream_path:
+            # Потоковая выгрузка уже лежит на диске — отдаём файл как есть
+            stream_format = os.path.splitext(stream_path)[1].lstrip(".")
+            if os.path.exists(stream_path):
+                st.caption(f"Сообщения записаны на диск во время сбора: `{os.path.basename(stream_path)}`")
+                download_path = stream_path
+                download_name = f"telegram_scrape_{ts}.{stream_format}"
+                if stream_format == "parquet":
+                    # Parquet-датасет — это каталог: отдаём его одним zip-архивом
+                    download_path = stream_path + ".zip"
+                    download_name += ".zip"
+                    if not os.path.exists(download_path):
+                        with open(download_path, "wb") as zip_file:
+                            zip_directory(stream_path, zip_file)
+                with open(download_path, "rb") as stream_file:
+                    st.download_button(
+                        label=f"📥 {stream_format.upper()}",
+                        data=stream_file,
+                        file_name=download_name,
+                        mime=STREAM_MIME_TYPES[stream_format],
+                        use_container_width=True,
+                        key="dl_stream",
+                    )
+            else:
+                st.warning("Файл выгрузки не найден на сервере — запустите скрапинг заново.")
+        else:
+            # Файл строится только для запрошенного формата и один раз на задачу: дальше он берётся с диска
+            st.caption("Выберите формат — файл подготовится один раз и останется доступен для скачивания.")
+            export_labels = {"json": "JSON", "csv": "CSV", "excel": "Excel", "parquet": "Parquet", "bundle": "Архив"}
+            export_help = {
+                "parquet": "Parquet-датасет, разбитый по каналам (channel=<имя>/part-N.parquet)",
+                "bundle": "Сжатый zip: компактный JSON на канал и manifest.json с числом сообщений и SHA-256 файлов",
+            }
+            export_columns = st.columns(len(EXPORT_FILES))
+            for column, (export_key, (extension, mime)) in zip(export_columns, EXPORT_FILES.items()):
+                label = export_labels[export_key]
+                export_path = export_cache_path(result_id, export_key)
+                with column:
+                    if not os.path.exists(export_path):
+                        if not st.button(f"⚙️ Подготовить {label}", use_container_width=True, key=f"prepare_{export_key}"):
+                            continue
+                        with st.spinner(f"Готовим {label}…"):
+                            cached_export(load_full_results(), export_key, result_id)
+                    with open(export_path, "rb") as export_file:
+                        st.download_button(
+                            label=f"📥 {label}",
+                            data=export_file,
+                            file_name=f"telegram_scrape_{ts}.{extension}",
+                            mime=mime,
+                            use_container_width=True,
+                            key=f"dl_{export_key}",
+                            help=export_help.get(export_key),
+                        )
+
 st.markdown("---")
 st.caption("**Telegram Cloud Scraper Pro** — Streamlit & Telethon")
+
+# Пока задачи идут, перезапускаем скрипт, чтобы подтянуть прогресс из очереди
+if jobs_pending and auto_refresh:
+    time.sleep(JOBS_REFRESH_SECONDS)
+    st.rerun()
@@ -0,0 +1,53 @@
+"""
+Бенчмарк параллельного скрапинга: последовательный режим (concurrency=1)
+против параллельного на FakeClient.
+
+Запуск: python benchmarks/bench_concurrency.py [--channels 50] [--messages 1000] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_client import FakeClient  # noqa: E402
+from scraper import scrape_channels  # noqa: E402
+
+
+async def measure(client, links, concurrency, messages):
+    # Лимиты планировщика сняты: меряем параллельность, а не темп запросов
+    options = {
+        "mode": "by_count",
+        "message_limit": messages,
+        "concurrency": concurrency,
+        "rate_limits": {"history": None, "resolve": None},
+    }
+    started = time.perf_counter()
+    results = await scrape_channels(client, links, options)
+    elapsed = time.perf_counter() - started
+    assert [r["channel"] for r in results] == links, "порядок результатов должен совпадать с порядком ссылок"
+    return elapsed, sum(r["total_messages"] for r in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка на страницу истории, с")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    client = FakeClient(messages_per_channel=args.messages, page_latency=args.latency, resolve_latency=args.latency)
+    links = [f"channel_{i:04d}" for i in range(args.channels)]
+    baseline = None
+    print(f"{'concurrency':>11} {'seconds':>9} {'msg/s':>10} {'speedup':>8}")
+    for concurrency in args.concurrency:
+        elapsed, total = asyncio.run(measure(client, links, concurrency, args.messages))
+        baseline = baseline or elapsed
+        print(f"{concurrency:>11} {elapsed:>9.2f} {total / elapsed:>10.0f} {baseline / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
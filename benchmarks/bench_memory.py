@@ -0,0 +1,100 @@
+"""
+Бенчмарк памяти: список dict на сообщение (старый формат scrape_channel)
+против колоночного MessageBuffer на синтетических сообщениях.
+
+Запуск: python benchmarks/bench_memory.py [--sizes 1000000 10000000]
+Для 10M сообщений списку dict нужно порядка 15+ ГБ RAM — используйте --skip-dicts на небольших машинах.
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_buffer import MEDIA_TYPES, MessageBuffer  # noqa: E402
+
+WORDS = ["новости", "канал", "telegram", "сегодня", "цена", "рынок", "обзор", "пост", "видео", "ссылка"]
+REACTIONS = ["👍", "❤", "🔥", "😁", "😢"]
+BASE_TS = 1_704_067_200
+
+
+def synthetic_messages(count, seed=42):
+    """Кортежи (id, unixtime, text, views, forwards, media_type, reactions, reply_to)."""
+    rnd = random.Random(seed)
+    for i in range(count, 0, -1):
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(0, 40)))
+        reactions = [{"emoji": e, "count": rnd.randint(1, 500)} for e in rnd.sample(REACTIONS, rnd.randint(0, 3))]
+        yield (
+            i,
+            BASE_TS + i * 60,
+            text,
+            rnd.randint(100, 100_000),
+            rnd.randint(0, 500),
+            rnd.choice(MEDIA_TYPES),
+            reactions,
+            i - 1 if rnd.random() < 0.05 else None,
+        )
+
+
+def build_dicts(count):
+    data = []
+    for message_id, ts, text, views, forwards, media_type, reactions, reply_to in synthetic_messages(count):
+        data.append({
+            "id": message_id,
+            "date": datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+            "date_unixtime": ts,
+            "text": text,
+            "views": views,
+            "forwards": forwards,
+            "media_type": media_type,
+            "reactions": reactions,
+            "reply_to_msg_id": reply_to,
+            "url": f"https://t.me/benchmark/{message_id}",
+        })
+    return data
+
+
+def build_buffer(count):
+    buffer = MessageBuffer("benchmark")
+    for row in synthetic_messages(count):
+        buffer.append(*row)
+    return buffer
+
+
+def measure(builder, count):
+    """(байт на сообщение, секунд на построение) по tracemalloc."""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = builder(count)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    gc.collect()
+    return current / count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--skip-dicts", action="store_true", help="не строить список dict (экономит память)")
+    args = parser.parse_args()
+
+    print(f"{'messages':>10} {'format':>14} {'bytes/msg':>10} {'total MB':>10} {'seconds':>8}")
+    for size in args.sizes:
+        builders = [("MessageBuffer", build_buffer)]
+        if not args.skip_dicts:
+            builders.insert(0, ("list[dict]", build_dicts))
+        for name, builder in builders:
+            per_message, elapsed = measure(builder, size)
+            print(f"{size:>10} {name:>14} {per_message:>10.0f} {per_message * size / 2**20:>10.0f} {elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Офлайн-набор бенчмарков: скорость (сообщений/с), пиковый RSS и байт на сообщение
+для каждого режима скрапинга и для выгрузки в JSON/CSV/Excel на FakeClient.
+Случаи history:* сравнивают чтение истории через telethon Message (iter_messages)
+и быстрый путь raw_history на настоящих TL-объектах.
+Каждый замер идёт в отдельном процессе, чтобы пиковый RSS не смешивался между замерами.
+Итоги сохраняются в benchmarks/results/<время>_<коммит>.json для сравнения версий.
+
+Запуск:
+    python benchmarks/bench_suite.py                               # 10k сообщений
+    python benchmarks/bench_suite.py --sizes 10000 1000000 10000000
+    python benchmarks/bench_suite.py --page-latency 0.02 --flood-wait-every 50
+    python benchmarks/bench_suite.py --modes --exports --history telethon raw
+    python benchmarks/bench_suite.py --compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SCRAPE_MODES = ["by_count", "by_date", "from_start", "by_words"]
+EXPORT_FORMATS = ["json", "csv", "excel", "bundle"]
+# Пути чтения истории: telethon — iter_messages с telethon Message, raw — raw_history
+HISTORY_PATHS = ["telethon", "raw"]
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def reset_peak_rss():
+    """Сбрасывает пиковый RSS до текущего (только Linux); иначе пик считается с начала процесса."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """Пиковый RSS процесса в байтах (None, если платформа не даёт его узнать)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def channel_links(channels):
+    return [f"bench_channel_{i:03d}" for i in range(channels)]
+
+
+def scrape_options(mode, per_channel, channels):
+    """options для scrape_channel, при которых с канала соберётся около per_channel сообщений."""
+    from benchmarks.fake_client import MEAN_WORDS, message_date
+
+    # Лимиты планировщика сняты: меряем обработку сообщений, а не темп запросов
+    options = {
+        "mode": mode,
+        "message_limit": per_channel,
+        "concurrency": channels,
+        "rate_limits": {"history": None, "resolve": None},
+    }
+    newest = messages_per_channel(per_channel)
+    if mode == "by_date":
+        options["message_limit"] = 20_000_000
+        options["from_date"] = message_date(newest - per_channel + 1).date()
+    elif mode == "by_words":
+        options["message_limit"] = 20_000_000
+        options["word_limit"] = int(per_channel * MEAN_WORDS)
+    return options
+
+
+def messages_per_channel(per_channel):
+    # Запас, чтобы by_date и by_words останавливались по своему условию, а не по концу канала
+    return per_channel + per_channel // 10 + 200
+
+
+async def run_scrape(mode, size, args, history=None):
+    """history (из HISTORY_PATHS) — сообщения TL-объектами и этот путь чтения; None — лёгкие FakeMessage."""
+    from benchmarks.fake_client import FakeClient
+    from scraper import scrape_channels
+
+    per_channel = math.ceil(size / args.channels)
+    client = FakeClient(
+        messages_per_channel=messages_per_channel(per_channel),
+        page_latency=args.page_latency,
+        resolve_latency=0,
+        flood_wait_every=args.flood_wait_every,
+        flood_wait_seconds=args.flood_wait_seconds,
+        tl_messages=history is not None,
+    )
+    options = scrape_options(mode, per_channel, args.channels)
+    options["raw_history"] = history == "raw"
+    reset_peak_rss()
+    rss_before = peak_rss()
+    started = time.perf_counter()
+    results = await scrape_channels(client, channel_links(args.channels), options)
+    elapsed = time.perf_counter() - started
+    messages = sum(r["total_messages"] for r in results)
+    return {
+        "messages": messages,
+        "seconds": elapsed,
+        "flood_waits": client.flood_waits,
+        "rss_before": rss_before,
+        "data_bytes": sum(r["messages"].nbytes() for r in results),
+    }
+
+
+def build_results(size, channels):
+    """Результаты как у run_scraping, собранные напрямую из синтетических сообщений (без замера)."""
+    from benchmarks.fake_client import FakeMessage
+    from message_buffer import MessageBuffer
+    from scraper import get_media_type, parse_reactions
+
+    results = []
+    per_channel = math.ceil(size / channels)
+    for number, link in enumerate(channel_links(channels)):
+        count = min(per_channel, size - number * per_channel)
+        buffer = MessageBuffer(link)
+        for message_id in range(count, 0, -1):
+            message = FakeMessage(message_id, channel_salt=number)
+            buffer.append(
+                message.id,
+                int(message.date.timestamp()),
+                message.text,
+                message.views,
+                message.forwards,
+                get_media_type(message),
+                parse_reactions(message),
+                message.reply_to_msg_id,
+            )
+        results.append({
+            "channel": link,
+            "channel_id": number,
+            "channel_title": f"Channel {link}",
+            "messages": buffer,
+            "total_messages": len(buffer),
+            "streamed": False,
+            "total_words": None,
+            "stop_reason": None,
+            "incremental_since_id": None,
+        })
+    return results
+
+
+def run_export(export_format, size, args):
+    from cli import FILE_EXTENSIONS, write_results
+
+    results = build_results(size, args.channels)
+    # Импорт pandas/openpyxl не относится к стоимости выгрузки — делаем его до замера
+    import pandas  # noqa: F401
+    if export_format == "excel":
+        import openpyxl  # noqa: F401
+    reset_peak_rss()
+    rss_before = peak_rss()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"export.{FILE_EXTENSIONS[export_format]}")
+        started = time.perf_counter()
+        write_results(results, export_format, path)
+        elapsed = time.perf_counter() - started
+        file_bytes = os.path.getsize(path)
+    return {"messages": size, "seconds": elapsed, "rss_before": rss_before, "file_bytes": file_bytes}
+
+
+def run_case(kind, name, size, args):
+    """Один замер в текущем процессе; результат — dict для отчёта."""
+    rss_start = peak_rss()
+    if kind == "scrape":
+        result = asyncio.run(run_scrape(name, size, args))
+    elif kind == "history":
+        result = asyncio.run(run_scrape("by_count", size, args, history=name))
+    else:
+        result = run_export(name, size, args)
+    rss_peak = peak_rss()
+    rss_before = result.pop("rss_before") or rss_start
+    messages = result["messages"]
+    report = {
+        "kind": kind,
+        "name": name,
+        "size": size,
+        **result,
+        "msgs_per_sec": messages / result["seconds"] if result["seconds"] else None,
+        "peak_rss": rss_peak,
+        "bytes_per_msg": (rss_peak - rss_before) / messages if rss_peak and messages else None,
+    }
+    return report
+
+
+def spawn_case(kind, name, size, args):
+    """Запускает замер в дочернем процессе и читает его JSON из stdout."""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--run-case", kind, name, str(size),
+        "--channels", str(args.channels),
+        "--page-latency", str(args.page_latency),
+        "--flood-wait-every", str(args.flood_wait_every),
+        "--flood-wait-seconds", str(args.flood_wait_seconds),
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+    if completed.returncode != 0:
+        return {"kind": kind, "name": name, "size": size, "error": (completed.stderr.strip().splitlines() or ["?"])[-1]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def format_row(case):
+    label = f"{case['kind']}:{case['name']}"
+    if "error" in case:
+        return f"{label:<18} {case['size']:>10}  — {case['error']}"
+    rss = f"{case['peak_rss'] / 2 ** 20:>9.0f}" if case.get("peak_rss") else f"{'—':>9}"
+    per_msg = f"{case['bytes_per_msg']:>9.0f}" if case.get("bytes_per_msg") is not None else f"{'—':>9}"
+    return f"{label:<18} {case['size']:>10} {case['messages']:>10} {case['msgs_per_sec']:>11.0f} {rss} {per_msg}"
+
+
+def print_header():
+    print(f"{'case':<18} {'size':>10} {'messages':>10} {'msg/s':>11} {'rss, MB':>9} {'B/msg':>9}")
+
+
+def compare(old_path, new_path):
+    """Таблица изменений msg/s и байт на сообщение между двумя сохранёнными прогонами."""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    old_cases = {(c["kind"], c["name"], c["size"]): c for c in old["cases"]}
+    print(f"{old['revision']} → {new['revision']}")
+    print(f"{'case':<18} {'size':>10} {'msg/s old':>11} {'msg/s new':>11} {'Δ':>7} {'B/msg old':>10} {'B/msg new':>10}")
+    for case in new["cases"]:
+        before = old_cases.get((case["kind"], case["name"], case["size"]))
+        if not before or "msgs_per_sec" not in case or "msgs_per_sec" not in before:
+            continue
+        change = case["msgs_per_sec"] / before["msgs_per_sec"] - 1 if before["msgs_per_sec"] else 0
+        print(
+            f"{case['kind'] + ':' + case['name']:<18} {case['size']:>10} "
+            f"{before['msgs_per_sec']:>11.0f} {case['msgs_per_sec']:>11.0f} {change:>+7.0%} "
+            f"{before.get('bytes_per_msg') or 0:>10.0f} {case.get('bytes_per_msg') or 0:>10.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--modes", nargs="*", choices=SCRAPE_MODES, default=SCRAPE_MODES)
+    parser.add_argument("--exports", nargs="*", choices=EXPORT_FORMATS, default=EXPORT_FORMATS)
+    parser.add_argument("--history", nargs="*", choices=HISTORY_PATHS, default=HISTORY_PATHS)
+    parser.add_argument("--channels", type=int, default=4, help="на сколько каналов делить сообщения")
+    parser.add_argument("--page-latency", type=float, default=0.0, help="задержка на страницу истории, с")
+    parser.add_argument("--flood-wait-every", type=int, default=0, help="FloodWait на каждой N-й странице")
+    parser.add_argument("--flood-wait-seconds", type=int, default=1)
+    parser.add_argument("--output", help="куда сохранить итоги (по умолчанию benchmarks/results/)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два сохранённых прогона")
+    parser.add_argument("--run-case", nargs=3, metavar=("KIND", "NAME", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.run_case:
+        kind, name, size = args.run_case
+        print(json.dumps(run_case(kind, name, int(size), args)))
+        return
+
+    cases = (
+        [("scrape", mode) for mode in args.modes]
+        + [("history", path) for path in args.history]
+        + [("export", fmt) for fmt in args.exports]
+    )
+    report = {
+        "revision": git_revision(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "channels": args.channels,
+            "page_latency": args.page_latency,
+            "flood_wait_every": args.flood_wait_every,
+            "flood_wait_seconds": args.flood_wait_seconds,
+        },
+        "cases": [],
+    }
+    print_header()
+    for size in args.sizes:
+        for kind, name in cases:
+            case = spawn_case(kind, name, size, args)
+            report["cases"].append(case)
+            print(format_row(case), flush=True)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report['revision']}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nИтоги сохранены: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Офлайн-заменитель TelegramClient для бенчмарков: эмулирует get_entity, iter_messages
+и запрос messages.GetHistory с задержкой на каждую страницу истории, без сети и аккаунта.
+Содержимое сообщений синтетическое, но правдоподобное: длина текста, медиа,
+реакции и даты распределены примерно как в живых каналах и зависят только от id.
+"""
+import asyncio
+import random
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from telethon.client.messages import _MessagesIter
+from telethon.errors import FloodWaitError
+from telethon.extensions import markdown
+from telethon.tl import types
+from telethon.tl.functions.messages import GetHistoryRequest
+from telethon.tl.types import Channel, ChatPhotoEmpty, MessageReactions, ReactionCount, ReactionEmoji
+
+PAGE_SIZE = 100
+BASE_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+# Средний интервал между постами и разброс внутри него, секунды
+MESSAGE_INTERVAL = 600
+DATE_JITTER = 300
+
+WORDS = [
+    "новости", "канал", "сегодня", "цена", "рынок", "обзор", "пост", "видео", "ссылка", "подписывайтесь",
+    "курс", "доллар", "биткоин", "акции", "прогноз", "итоги", "неделя", "важно", "срочно", "разбор",
+    "telegram", "update", "release", "market", "crypto", "news", "today", "thread", "🔥", "👉",
+]
+# Доли типов медиа в процентах
+MEDIA_WEIGHTS = {
+    "none": 55, "photo": 25, "video": 8, "document": 4, "voice": 2, "audio": 1, "sticker": 2, "gif": 2, "poll": 1,
+}
+REACTION_EMOJI = ["👍", "❤", "🔥", "😁", "😢", "👎", "🤔", "🎉"]
+# Пулы заранее сгенерированных значений: сообщение берёт элементы по хэшу id
+POOL_SIZE = 4096
+
+
+def _build_pools(seed=42):
+    rnd = random.Random(seed)
+    texts = []
+    for _ in range(POOL_SIZE):
+        if rnd.random() < 0.15:
+            texts.append("")  # только медиа без подписи
+            continue
+        words = max(1, min(int(rnd.lognormvariate(3.0, 1.0)), 700))
+        texts.append(" ".join(rnd.choice(WORDS) for _ in range(words))[:4096])
+    media = rnd.choices(list(MEDIA_WEIGHTS), weights=list(MEDIA_WEIGHTS.values()), k=POOL_SIZE)
+    reactions = []
+    for _ in range(POOL_SIZE):
+        kinds = rnd.sample(REACTION_EMOJI, min(int(rnd.expovariate(0.7)), len(REACTION_EMOJI)))
+        reactions.append(
+            MessageReactions(
+                results=[ReactionCount(reaction=ReactionEmoji(e), count=int(rnd.paretovariate(1.2))) for e in kinds]
+            )
+            if kinds
+            else None
+        )
+    return texts, media, reactions
+
+
+def _document(kind, attributes):
+    return types.Document(
+        id=hash(kind) & 0xFFFFFFFF,
+        access_hash=0,
+        file_reference=b"",
+        date=BASE_DATE,
+        mime_type="application/octet-stream",
+        size=1024,
+        dc_id=2,
+        attributes=attributes,
+    )
+
+
+def _build_tl_media():
+    """TL-медиа для каждого типа из MEDIA_WEIGHTS (одно на тип, сообщения ссылаются на него)."""
+    photo = types.Photo(id=1, access_hash=0, file_reference=b"", date=BASE_DATE, sizes=[], dc_id=2)
+    video = types.DocumentAttributeVideo(duration=30, w=1280, h=720)
+    return {
+        "none": None,
+        "photo": types.MessageMediaPhoto(photo=photo),
+        "video": types.MessageMediaDocument(document=_document("video", [video])),
+        "document": types.MessageMediaDocument(
+            document=_document("document", [types.DocumentAttributeFilename(file_name="report.pdf")])
+        ),
+        "voice": types.MessageMediaDocument(
+            document=_document("voice", [types.DocumentAttributeAudio(duration=12, voice=True)])
+        ),
+        "audio": types.MessageMediaDocument(
+            document=_document("audio", [types.DocumentAttributeAudio(duration=180, title="Track")])
+        ),
+        "sticker": types.MessageMediaDocument(
+            document=_document(
+                "sticker",
+                [types.DocumentAttributeImageSize(w=512, h=512),
+                 types.DocumentAttributeSticker(alt="🔥", stickerset=types.InputStickerSetEmpty())],
+            )
+        ),
+        "gif": types.MessageMediaDocument(
+            document=_document("gif", [types.DocumentAttributeAnimated(), video])
+        ),
+        "poll": types.MessageMediaPoll(
+            poll=types.Poll(
+                id=1,
+                question="Ваш прогноз?",
+                answers=[types.PollAnswer(text="Рост", option=b"0"), types.PollAnswer(text="Падение", option=b"1")],
+            ),
+            results=types.PollResults(),
+        ),
+    }
+
+
+TEXT_POOL, MEDIA_POOL, REACTION_POOL = _build_pools()
+TL_MEDIA = _build_tl_media()
+# Слов в среднем на сообщение (с учётом метки #id, см. FakeMessage)
+MEAN_WORDS = sum(len(t.split()) + 1 for t in TEXT_POOL if t) / POOL_SIZE
+
+
+def _pick(pool, message_id, salt):
+    return pool[((message_id + salt) * 2654435761) % POOL_SIZE]
+
+
+def message_date(message_id):
+    """Дата сообщения: растёт с id, интервал MESSAGE_INTERVAL ± DATE_JITTER."""
+    jitter = (message_id * 40503) % DATE_JITTER
+    return BASE_DATE + timedelta(seconds=message_id * MESSAGE_INTERVAL + jitter)
+
+
+def last_id_before(date):
+    """Самый новый id с датой раньше date (0, если таких нет)."""
+    message_id = max(int((date - BASE_DATE).total_seconds() // MESSAGE_INTERVAL) + 1, 0)
+    while message_id > 0 and message_date(message_id) >= date:
+        message_id -= 1
+    return message_id
+
+
+class FakeMessage:
+    """Минимальный набор атрибутов telethon Message, которые читает scraper."""
+
+    __slots__ = (
+        "id", "date", "text", "views", "forwards", "photo", "video", "voice", "document",
+        "audio", "sticker", "gif", "poll", "reactions", "reply_to_msg_id",
+    )
+
+    def __init__(self, message_id, date=None, text=None, channel_salt=0):
+        self.id = message_id
+        self.date = date or message_date(message_id)
+        if text is None:
+            # Метка делает текст отдельной строкой, как у настоящих сообщений, а не ссылкой на общий пул
+            text = _pick(TEXT_POOL, message_id, channel_salt)
+            text = f"{text} #{message_id}" if text else ""
+        self.text = text
+        self.views = 100 + (message_id * 7919 + channel_salt) % 50_000
+        self.forwards = (message_id * 31 + channel_salt) % 97
+        self.photo = self.video = self.voice = self.document = None
+        self.audio = self.sticker = self.gif = self.poll = None
+        media = _pick(MEDIA_POOL, message_id, channel_salt + 1)
+        if media != "none":
+            setattr(self, media, True)
+        self.reactions = _pick(REACTION_POOL, message_id, channel_salt + 2)
+        self.reply_to_msg_id = message_id - 1 if message_id % 20 == 0 else None
+
+
+def tl_message(message_id, channel_id, channel_salt=0):
+    """
+    То же сообщение, что FakeMessage, но TL-объектом, как его присылает сервер:
+    медиа, реакции и ответ — настоящие типы telethon, у каждого десятого текста — жирное первое слово.
+    """
+    text = _pick(TEXT_POOL, message_id, channel_salt)
+    text = f"{text} #{message_id}" if text else ""
+    entities = None
+    if text and message_id % 10 == 0:
+        first_word = text.split(" ", 1)[0]
+        entities = [types.MessageEntityBold(offset=0, length=len(first_word.encode("utf-16-le")) // 2)]
+    return types.Message(
+        id=message_id,
+        peer_id=types.PeerChannel(channel_id),
+        date=message_date(message_id),
+        message=text,
+        post=True,
+        entities=entities,
+        media=TL_MEDIA[_pick(MEDIA_POOL, message_id, channel_salt + 1)],
+        views=100 + (message_id * 7919 + channel_salt) % 50_000,
+        forwards=(message_id * 31 + channel_salt) % 97,
+        reactions=_pick(REACTION_POOL, message_id, channel_salt + 2),
+        reply_to=types.MessageReplyHeader(reply_to_msg_id=message_id - 1) if message_id % 20 == 0 else None,
+    )
+
+
+class FakeClient:
+    """
+    Каналы с messages_per_channel сообщениями; каждая страница из PAGE_SIZE стоит page_latency секунд.
+    flood_wait_every > 0 — каждая N-я загрузка страницы падает с FloodWaitError(flood_wait_seconds).
+    tl_messages=True — iter_messages идёт через настоящий итератор telethon поверх GetHistory
+    и отдаёт telethon Message, как TelegramClient; иначе — лёгкие FakeMessage.
+    """
+
+    # Форматирование текста по умолчанию, как у TelegramClient
+    parse_mode = markdown
+
+    def __init__(self, messages_per_channel=1000, page_latency=0.05, resolve_latency=0.05,
+                 flood_wait_every=0, flood_wait_seconds=1, tl_messages=False):
+        self.messages_per_channel = messages_per_channel
+        self.tl_messages = tl_messages
+        self.page_latency = page_latency
+        self.resolve_latency = resolve_latency
+        self.flood_wait_every = flood_wait_every
+        self.flood_wait_seconds = flood_wait_seconds
+        self.resolve_calls = 0
+        self.page_requests = 0
+        self.flood_waits = 0
+        # Поля, которые читает Message._finish_init у настоящего клиента
+        self._self_id = None
+        self._mb_entity_cache = {}
+
+    async def get_entity(self, link):
+        self.resolve_calls += 1
+        await asyncio.sleep(self.resolve_latency)
+        channel_id = zlib.crc32(link.encode("utf-8"))
+        return Channel(
+            id=channel_id,
+            title=f"Channel {link}",
+            photo=ChatPhotoEmpty(),
+            date=BASE_DATE,
+            broadcast=True,
+            access_hash=channel_id * 31,
+            username=link,
+        )
+
+    async def get_input_entity(self, entity):
+        return entity
+
+    async def _load_page(self):
+        self.page_requests += 1
+        if self.flood_wait_every and self.page_requests % self.flood_wait_every == 0:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.flood_wait_seconds)
+        await asyncio.sleep(self.page_latency)
+
+    async def __call__(self, request):
+        """
+        messages.GetHistory как на сервере: сообщения старше offset_id и offset_date,
+        сдвинутые на add_offset к новым, не больше limit, от новых к старым.
+        """
+        if not isinstance(request, GetHistoryRequest):
+            raise NotImplementedError(type(request).__name__)
+        await self._load_page()
+        channel_id = getattr(request.peer, "channel_id", 0)
+        newest = self.messages_per_channel
+        top = newest
+        if request.offset_id:
+            top = min(top, request.offset_id - 1)
+        if request.offset_date:
+            top = min(top, last_id_before(request.offset_date))
+        # Позиция 0 — самое новое сообщение (id == newest)
+        start = max(newest - top + request.add_offset, 0)
+        end = min(newest - top + request.add_offset + request.limit, newest)
+        messages = [
+            tl_message(message_id, channel_id, channel_id % POOL_SIZE)
+            for message_id in range(newest - start, newest - end, -1)
+        ]
+        return types.messages.MessagesSlice(count=newest, messages=messages, chats=[], users=[])
+
+    def iter_messages(self, entity, limit=None, offset_id=0, min_id=0, max_id=0, offset_date=None,
+                      reverse=False, wait_time=None, **kwargs):
+        """
+        Сообщения с id от messages_per_channel до 1 с фильтрами как у Telethon: от новых к старым,
+        а с reverse=True — от старых к новым (offset_id и offset_date тогда задают нижнюю границу).
+        """
+        if self.tl_messages:
+            # Тот же итератор, что строит TelegramClient.iter_messages
+            return _MessagesIter(
+                self, limit, reverse=reverse, wait_time=wait_time, entity=entity, offset_id=offset_id,
+                min_id=min_id, max_id=max_id, from_user=None, offset_date=offset_date, add_offset=0,
+                filter=None, search=None, reply_to=None, scheduled=False,
+            )
+        return self._iter_fake_messages(entity, limit, offset_id, min_id, max_id, offset_date, reverse)
+
+    async def _iter_fake_messages(self, entity, limit, offset_id, min_id, max_id, offset_date, reverse):
+        salt = getattr(entity, "channel_id", 0) % POOL_SIZE
+        newest = self.messages_per_channel
+        oldest = 1
+        if max_id:
+            newest = min(newest, max_id - 1)
+        if min_id:
+            oldest = max(oldest, min_id + 1)
+        if reverse:
+            if offset_id:
+                oldest = max(oldest, offset_id + 1)
+            if offset_date:
+                oldest = max(oldest, last_id_before(offset_date) + 1)
+            ids = range(oldest, newest + 1)
+        else:
+            if offset_id:
+                newest = min(newest, offset_id - 1)
+            if offset_date:
+                newest = min(newest, last_id_before(offset_date))
+            ids = range(newest, oldest - 1, -1)
+        yielded = 0
+        for message_id in ids:
+            if limit is not None and yielded >= limit:
+                break
+            if yielded % PAGE_SIZE == 0:
+                await self._load_page()
+            yielded += 1
+            yield FakeMessage(message_id, channel_salt=salt)
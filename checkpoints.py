@@ -0,0 +1,74 @@
+"""
+Хранилище контрольных точек скрапинга (SQLite).
+Для каждого канала помнит диапазон уже собранных id сообщений, чтобы следующий
+запуск докачивал только новые сообщения, а прерванный проход вглубь истории продолжался.
+"""
+import os
+import sqlite3
+import time
+
+DATA_DIR = os.environ.get("SCRAPER_DATA_DIR", "data")
+DEFAULT_CHECKPOINT_PATH = os.path.join(DATA_DIR, "checkpoints.sqlite3")
+
+
+class CheckpointStore:
+    """
+    Контрольные точки по ключу (scope, channel_id).
+    scope отделяет аккаунты друг от друга: у разных пользователей свои точки.
+    max_id / min_id — границы непрерывного диапазона собранных сообщений,
+    backfill_done — закончен ли проход от max_id вглубь истории.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_PATH, scope="default"):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.scope = str(scope)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                scope TEXT NOT NULL,
+                channel_id INTEGER NOT NULL,
+                max_id INTEGER NOT NULL,
+                min_id INTEGER NOT NULL,
+                backfill_done INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (scope, channel_id)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, channel_id):
+        """Возвращает dict(max_id, min_id, backfill_done, updated_at) или None."""
+        row = self._conn.execute(
+            "SELECT max_id, min_id, backfill_done, updated_at FROM checkpoints WHERE scope = ? AND channel_id = ?",
+            (self.scope, channel_id),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"max_id": row[0], "min_id": row[1], "backfill_done": bool(row[2]), "updated_at": row[3]}
+
+    def save(self, channel_id, max_id, min_id, backfill_done):
+        self._conn.execute(
+            """
+            INSERT INTO checkpoints (scope, channel_id, max_id, min_id, backfill_done, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (scope, channel_id) DO UPDATE SET
+                max_id = excluded.max_id,
+                min_id = excluded.min_id,
+                backfill_done = excluded.backfill_done,
+                updated_at = excluded.updated_at
+            """,
+            (self.scope, channel_id, max_id, min_id, int(backfill_done), time.time()),
+        )
+        self._conn.commit()
+
+    def reset(self, channel_id):
+        self._conn.execute("DELETE FROM checkpoints WHERE scope = ? AND channel_id = ?", (self.scope, channel_id))
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
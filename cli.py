@@ -0,0 +1,293 @@
+"""
+Запуск скрапинга из командной строки — для cron и пакетных запусков без Streamlit.
+Ключи берутся из окружения или .env: API_ID, API_HASH, TELEGRAM_SESSION
+(и необязательно TELEGRAM_POOL_SESSIONS — дополнительные сессии через запятую).
+
+Пример:
+    python cli.py links.txt --mode by_count --limit 5000 --format csv --output out.csv
+
+Живое наблюдение (новые сообщения и правки по событиям, до Ctrl+C):
+    python cli.py links.txt --live --format json --output live.jsonl
+
+Адаптивное обновление каталога (файл на раунд в каталоге --output, до Ctrl+C):
+    python cli.py catalogue.txt --refresh --budget 600 --format json --output data/refresh
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import date, datetime
+
+# Формат выгрузки → формат потоковой записи (Excel и бандл потоково не пишутся)
+STREAM_FORMATS = {"json": "jsonl", "csv": "csv", "excel": "csv", "parquet": "parquet", "bundle": "jsonl"}
+FILE_EXTENSIONS = {"json": "json", "csv": "csv", "excel": "xlsx", "parquet": "parquet", "bundle": "bundle.zip"}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Telegram Cloud Scraper — пакетный запуск без веб-интерфейса")
+    parser.add_argument("links_file", help="файл со ссылками на каналы, по одной на строку ('-' — stdin)")
+    parser.add_argument(
+        "--mode",
+        choices=["by_count", "by_date", "from_start", "by_words"],
+        default="by_count",
+        help="что выгружать (как на вкладке «Конфигурация»)",
+    )
+    parser.add_argument("--limit", type=int, default=1000, help="сообщений с канала (by_count, from_start)")
+    parser.add_argument("--from-date", type=date.fromisoformat, help="дата начала для by_date, ГГГГ-ММ-ДД")
+    parser.add_argument("--to-date", type=date.fromisoformat, help="дата конца для by_date (включительно)")
+    parser.add_argument("--words", type=int, default=100_000, help="последних слов (by_words)")
+    parser.add_argument("--format", choices=list(FILE_EXTENSIONS), default="json", help="формат выгрузки")
+    parser.add_argument("--output", help="путь к файлу (для parquet — к каталогу датасета)")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="писать сообщения на диск во время сбора (json → JSON Lines, excel → CSV)",
+    )
+    parser.add_argument("--concurrency", type=int, help="каналов одновременно на одной сессии")
+    parser.add_argument("--incremental", action="store_true", help="только новые сообщения с прошлого запуска")
+    parser.add_argument(
+        "--pool-id",
+        default=os.getenv("TELEGRAM_POOL_ID", ""),
+        help="имя пула сессий: его контрольные точки и повторы (по умолчанию общие для API_ID)",
+    )
+    parser.add_argument(
+        "--raw-history",
+        action="store_true",
+        help="быстрое чтение истории сырыми страницами GetHistory (результат тот же)",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="искать повторы и репосты (индекс похожих текстов в data/dedup.sqlite3)",
+    )
+    parser.add_argument("--drop-duplicates", action="store_true", help="не выгружать повторы (включает --dedup)")
+    parser.add_argument("--comments", action="store_true", help="собирать комментарии к постам (группа обсуждения)")
+    parser.add_argument("--comments-concurrency", type=int, help="тредов комментариев одновременно на канал")
+    parser.add_argument("--media", action="store_true", help="скачивать медиа в data/media (файлы по хэшу содержимого)")
+    parser.add_argument(
+        "--media-types",
+        help="типы медиа через запятую: photo, video, voice, document (по умолчанию все)",
+    )
+    parser.add_argument("--media-max-size", type=int, help="пропускать файлы больше N МБ")
+    parser.add_argument("--media-concurrency", type=int, help="файлов одновременно")
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="не собирать историю, а дописывать новые сообщения и правки по событиям до Ctrl+C (json или csv)",
+    )
+    parser.add_argument(
+        "--live-join",
+        action="store_true",
+        help="подписаться на каналы: события приходят только по каналам, на которые подписан аккаунт",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="обновлять каталог раундами: активные каналы чаще, тихие реже (до Ctrl+C)",
+    )
+    parser.add_argument("--budget", type=int, help="запросов к API в час для --refresh (по умолчанию 600)")
+    parser.add_argument("--min-interval", type=int, help="проверять канал не чаще раза в N минут (--refresh)")
+    parser.add_argument("--env-file", default=".env", help="файл с переменными окружения")
+    parser.add_argument("--metrics-file", help="записать метрики запуска в файл формата Prometheus")
+    parser.add_argument("--quiet", action="store_true", help="не печатать лог")
+    return parser.parse_args(argv)
+
+
+def read_links(links_file):
+    if links_file == "-":
+        return sys.stdin.read()
+    with open(links_file, encoding="utf-8") as f:
+        return f.read()
+
+
+def build_options(args):
+    """Те же options, что собирает app.py."""
+    from scraper import DEFAULT_CONCURRENCY, MAX_CONCURRENCY
+
+    message_limit = args.limit
+    if args.mode in ("by_date", "by_words"):
+        message_limit = 20_000_000
+    return {
+        "mode": args.mode,
+        "message_limit": message_limit,
+        "from_date": args.from_date,
+        "to_date": args.to_date,
+        "word_limit": args.words,
+        "concurrency": max(1, min(args.concurrency or DEFAULT_CONCURRENCY, MAX_CONCURRENCY)),
+        "incremental": args.incremental,
+        "pool_id": args.pool_id,
+        "raw_history": args.raw_history,
+        "dedup": args.dedup or args.drop_duplicates,
+        "drop_duplicates": args.drop_duplicates,
+        "comments": args.comments,
+        "comments_concurrency": args.comments_concurrency,
+        "media": args.media,
+        "media_types": [t.strip() for t in args.media_types.split(",") if t.strip()] if args.media_types else None,
+        "media_max_size": args.media_max_size * 2 ** 20 if args.media_max_size else None,
+        "media_concurrency": args.media_concurrency,
+    }
+
+
+def default_output_path(export_format):
+    """Файл в каталоге выгрузок с отметкой времени, как у потоковой записи."""
+    from export import EXPORTS_DIR
+
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(EXPORTS_DIR, f"telegram_scrape_{ts}.{FILE_EXTENSIONS[export_format]}")
+
+
+def write_results(results, export_format, path):
+    """
+    Сохраняет результаты в файл; pandas/openpyxl/pyarrow подгружаются только для своего формата.
+    Parquet пишется каталогом-датасетом, а не zip-архивом, как в веб-интерфейсе.
+    """
+    from export import write_export, write_parquet_dataset
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if export_format == "parquet":
+        write_parquet_dataset(results, path)
+    else:
+        write_export(results, export_format, path)
+
+
+def run_live_mode(args, api_id, api_hash, session, links, options):
+    """Живое наблюдение: записи пишутся в файл по мере прихода событий, до Ctrl+C."""
+    from export import new_stream_path
+    from live import run_live
+
+    if args.format not in ("json", "csv"):
+        print("❌ Для --live нужен --format json или csv.", file=sys.stderr)
+        return 2
+    options["stream_format"] = STREAM_FORMATS[args.format]
+    options["stream_path"] = args.output or new_stream_path(options["stream_format"])
+    options["live_join"] = args.live_join
+    directory = os.path.dirname(options["stream_path"])
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    def log_line(msg):
+        if not args.quiet:
+            print(msg, file=sys.stderr)
+
+    log_line(f"📄 Запись в {options['stream_path']} (Ctrl+C — остановить)")
+    try:
+        stats = asyncio.run(run_live(api_id, api_hash, session, links, options, log_line))
+    except KeyboardInterrupt:
+        # Буфер записан и файл закрыт при отмене задачи
+        stats = {}
+    if stats is None:
+        return 1
+    print(options["stream_path"])
+    return 0
+
+
+def run_refresh_mode(args, api_id, api_hash, session, links, options):
+    """Адаптивное обновление: каждый раунд с новыми сообщениями — отдельный файл в каталоге --output."""
+    from client_manager import get_client_manager
+    from export import EXPORTS_DIR
+    from refresh import run_refresh
+
+    directory = args.output or os.path.join(EXPORTS_DIR, "refresh")
+    options["refresh_budget"] = args.budget
+    options["refresh_min_interval"] = args.min_interval * 60 if args.min_interval else None
+
+    def log_line(msg):
+        if not args.quiet:
+            print(msg, file=sys.stderr)
+
+    def write_round(results):
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        path = os.path.join(directory, f"refresh_{ts}.{FILE_EXTENSIONS[args.format]}")
+        write_results(results, args.format, path)
+        print(path, flush=True)
+
+    clients = get_client_manager()
+    try:
+        clients.run(
+            run_refresh(api_id, api_hash, session, links, options, log_line, write_round, client_manager=clients)
+        )
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from dotenv import load_dotenv
+
+    load_dotenv(args.env_file)
+    api_id = os.getenv("API_ID", "")
+    api_hash = os.getenv("API_HASH", "")
+    session = os.getenv("TELEGRAM_SESSION", "")
+    pool_sessions = [s.strip() for s in os.getenv("TELEGRAM_POOL_SESSIONS", "").split(",") if s.strip()]
+    if not (api_id and api_hash and session):
+        print("❌ Нужны переменные окружения API_ID, API_HASH и TELEGRAM_SESSION (или .env).", file=sys.stderr)
+        return 2
+    if args.mode == "by_date" and not args.from_date:
+        print("❌ Для --mode by_date укажите --from-date.", file=sys.stderr)
+        return 2
+    if args.to_date and args.from_date and args.to_date < args.from_date:
+        print("❌ --to-date раньше --from-date.", file=sys.stderr)
+        return 2
+
+    from export import new_stream_path, path_size
+    from metrics import ScrapeMetrics, record_job, write_textfile
+    from scraper import run_scraping, validate_channel_links
+
+    valid_links, invalid_links = validate_channel_links(read_links(args.links_file))
+    if invalid_links:
+        print(f"⚠️ Некорректные строки (пропущены): {', '.join(invalid_links)}", file=sys.stderr)
+    if not valid_links:
+        print("❌ Нет ни одной корректной ссылки на канал.", file=sys.stderr)
+        return 2
+
+    options = build_options(args)
+    if args.live:
+        return run_live_mode(args, api_id, api_hash, session, valid_links, options)
+    if args.refresh:
+        return run_refresh_mode(args, api_id, api_hash, session, valid_links, options)
+    if args.stream:
+        options["stream_format"] = STREAM_FORMATS[args.format]
+        options["stream_path"] = args.output or new_stream_path(options["stream_format"])
+        output = options["stream_path"]
+    else:
+        output = args.output or default_output_path(args.format)
+
+    def log_line(msg):
+        if not args.quiet:
+            print(msg, file=sys.stderr)
+
+    metrics = ScrapeMetrics()
+    if pool_sessions:
+        from session_pool import run_scraping_pool
+
+        scrape = run_scraping_pool(
+            api_id, api_hash, [session, *pool_sessions], valid_links, options, None, log_line, None, metrics
+        )
+    else:
+        scrape = run_scraping(api_id, api_hash, session, valid_links, options, None, log_line, None, metrics)
+    results = asyncio.run(scrape)
+    if results and not args.stream:
+        with metrics.phase("export"):
+            write_results(results, args.format, output)
+        metrics.export_bytes += path_size(output)
+    metrics.finish()
+    summary = metrics.summary()
+    log_line(
+        f"⏱ {summary['duration']:.1f} с, {summary['messages']} сообщений ({summary['messages_per_sec']:.0f}/с), "
+        f"запросов к API: {sum(summary['api_requests'].values())}, "
+        f"FloodWait: {sum(summary['flood_wait_seconds'].values())} с"
+    )
+    if args.metrics_file:
+        record_job(summary if results else None, "done" if results else "failed")
+        write_textfile(args.metrics_file)
+    if not results:
+        return 1
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
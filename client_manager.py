@@ -0,0 +1,204 @@
+"""
+Подключённые клиенты Telegram, общие для шагов входа, перезапусков Streamlit и задач.
+Клиенты живут на отдельном долгоживущем event loop в фоновом потоке и переиспользуются
+по строке сессии: повторное действие не платит за новое MTProto-рукопожатие.
+Неиспользуемые клиенты отключаются по таймауту простоя и при переполнении (LRU).
+"""
+import asyncio
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+
+# Сколько подключённых клиентов держит процесс
+MAX_CLIENTS = 32
+# Клиент без дела дольше этого отключается, секунды
+IDLE_TIMEOUT = 15 * 60
+# Как часто ищутся простаивающие клиенты, секунды
+IDLE_CHECK_INTERVAL = 60
+# Сколько ждать отключения всех клиентов при выходе процесса, секунды
+SHUTDOWN_TIMEOUT = 5
+
+
+class _Entry:
+    __slots__ = ("client", "leases", "last_used", "connecting")
+
+    def __init__(self, client):
+        self.client = client
+        self.leases = 0
+        self.last_used = time.monotonic()
+        # Параллельные acquire одной сессии подключают клиента один раз
+        self.connecting = asyncio.Lock()
+
+
+class ClientManager:
+    """
+    Клиенты по ключу (api_id, api_hash, строка сессии). Корутины, работающие с клиентами,
+    выполняются на loop менеджера: из синхронного кода — через run(), из асинхронного
+    кода, уже запущенного через run(), — напрямую acquire() / release().
+    Клиент, выданный acquire(), не отключается, пока его не вернут release().
+    """
+
+    def __init__(self, max_clients=MAX_CLIENTS, idle_timeout=IDLE_TIMEOUT):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.pid = os.getpid()
+        self.stats = {"connects": 0, "reused": 0, "closed": 0}
+        self._entries = OrderedDict()
+        self._closed = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="telegram-clients", daemon=True)
+        self._thread.start()
+        self._idle_task = asyncio.run_coroutine_threadsafe(self._close_idle_loop(), self._loop)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def run(self, coro, timeout=None):
+        """
+        Выполняет корутину на loop менеджера и возвращает её результат (блокирует поток).
+        Если ожидание прервано (таймаут, Ctrl+C), корутина отменяется.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    @staticmethod
+    def _key(api_id, api_hash, session_string):
+        return int(str(api_id).strip()), api_hash.strip(), (session_string or "").strip()
+
+    async def acquire(self, api_id, api_hash, session_string=""):
+        """
+        Подключённый клиент для сессии. Пустая строка сессии — новый клиент (шаг входа):
+        после release() он доступен по строке client.session.save().
+        """
+        key = self._key(api_id, api_hash, session_string)
+        entry = self._entries.get(key) if key[2] else None
+        if entry is None:
+            entry = _Entry(TelegramClient(StringSession(key[2]), key[0], key[1]))
+            # Запись видна сразу: параллельный acquire той же сессии дождётся того же подключения
+            if key[2]:
+                self._entries[key] = entry
+        else:
+            self._entries.move_to_end(key)
+        entry.leases += 1
+        entry.last_used = time.monotonic()
+        try:
+            async with entry.connecting:
+                if entry.client.is_connected():
+                    self.stats["reused"] += 1
+                else:
+                    await entry.client.connect()
+                    self.stats["connects"] += 1
+        except BaseException:
+            entry.leases -= 1
+            if not entry.leases and self._entries.get(key) is entry:
+                del self._entries[key]
+            raise
+        return entry.client
+
+    def release(self, client):
+        """
+        Возвращает клиента менеджеру. Ключ берётся заново из сессии: после входа
+        или переезда в другой дата-центр строка сессии могла измениться.
+        """
+        for key, entry in list(self._entries.items()):
+            if entry.client is client:
+                del self._entries[key]
+                break
+        else:
+            entry = _Entry(client)
+            entry.leases = 1
+        entry.leases -= 1
+        entry.last_used = time.monotonic()
+        session_string = client.session.save()
+        if session_string and client.is_connected():
+            key = self._key(client.api_id, client.api_hash, session_string)
+            previous = self._entries.pop(key, None)
+            if previous is not None and previous.client is not client:
+                self._loop.create_task(self._close(previous))
+            self._entries[key] = entry
+            self._evict()
+        else:
+            self._loop.create_task(self._close(entry))
+        return session_string
+
+    def _evict(self):
+        """Отключает самые давно использованные свободные клиенты сверх max_clients."""
+        excess = len(self._entries) - self.max_clients
+        for key, entry in list(self._entries.items()):
+            if excess <= 0:
+                break
+            if entry.leases == 0:
+                del self._entries[key]
+                self._loop.create_task(self._close(entry))
+                excess -= 1
+
+    async def _close(self, entry):
+        self.stats["closed"] += 1
+        try:
+            await entry.client.disconnect()
+        except Exception:
+            pass
+
+    async def _close_idle_loop(self):
+        while True:
+            await asyncio.sleep(IDLE_CHECK_INTERVAL)
+            self.close_idle()
+
+    def close_idle(self, now=None):
+        """Отключает свободные клиенты, простаивающие дольше idle_timeout."""
+        now = time.monotonic() if now is None else now
+        for key, entry in list(self._entries.items()):
+            if entry.leases == 0 and now - entry.last_used > self.idle_timeout:
+                del self._entries[key]
+                self._loop.create_task(self._close(entry))
+
+    def usage(self):
+        """Сколько клиентов подключено и сколько из них сейчас занято."""
+        return {
+            "clients": len(self._entries),
+            "in_use": sum(1 for entry in self._entries.values() if entry.leases),
+            **self.stats,
+        }
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """Отключает все клиенты и останавливает loop."""
+        async def close_all():
+            entries, self._entries = list(self._entries.values()), OrderedDict()
+            await asyncio.gather(*(self._close(entry) for entry in entries))
+
+        if self._closed:
+            return
+        self._closed = True
+        self._idle_task.cancel()
+        try:
+            self.run(close_all(), timeout)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_client_manager():
+    """
+    Общий на процесс менеджер. После fork (процессы-воркеры) поток loop родителя
+    не существует, поэтому у дочернего процесса — свой менеджер.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None or _manager.pid != os.getpid():
+            _manager = ClientManager()
+            atexit.register(_manager.shutdown)
+        return _manager
@@ -0,0 +1,126 @@
+"""
+Кэш комментариев к постам каналов (SQLite).
+Для каждого треда помнит число комментариев, которое показывал пост, и последний
+собранный комментарий: тред, где число не изменилось, повторно не запрашивается,
+а изменившийся докачивается только новыми комментариями. Сами комментарии лежат
+здесь же, поэтому в выгрузку попадают и треды, которые в этот запуск не запрашивались.
+"""
+import json
+import os
+import sqlite3
+import time
+
+from checkpoints import DATA_DIR
+
+DEFAULT_COMMENTS_PATH = os.path.join(DATA_DIR, "comments.sqlite3")
+
+
+class CommentStore:
+    """
+    threads — (channel_id, post_id) → replies (сколько комментариев показывал пост
+    при последнем сборе) и max_id (последний собранный комментарий); comments — записи
+    комментариев в формате scraper.message_record (дата — unixtime, реакции — JSON).
+    id каналов и сообщений общие для всех аккаунтов, поэтому scope здесь не нужен.
+    """
+
+    def __init__(self, path=DEFAULT_COMMENTS_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS threads (
+                channel_id INTEGER NOT NULL,
+                post_id INTEGER NOT NULL,
+                replies INTEGER NOT NULL,
+                max_id INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (channel_id, post_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS comments (
+                channel_id INTEGER NOT NULL,
+                post_id INTEGER NOT NULL,
+                id INTEGER NOT NULL,
+                date INTEGER,
+                text TEXT NOT NULL,
+                views INTEGER,
+                forwards INTEGER,
+                media_type TEXT NOT NULL,
+                reactions TEXT,
+                reply_to INTEGER,
+                PRIMARY KEY (channel_id, post_id, id)
+            ) WITHOUT ROWID;
+            """
+        )
+        self._conn.commit()
+
+    def _fetch(self, sql, ids, *params):
+        """Строки запроса sql с IN ({}) по списку ids — частями, чтобы не упереться в лимит параметров."""
+        rows = []
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            rows.extend(self._conn.execute(sql.format(", ".join("?" * len(part))), (*params, *part)))
+        return rows
+
+    def threads(self, channel_id, post_ids):
+        """Известные треды постов: post_id → (replies, max_id)."""
+        return {
+            post_id: (replies, max_id)
+            for post_id, replies, max_id in self._fetch(
+                "SELECT post_id, replies, max_id FROM threads WHERE channel_id = ? AND post_id IN ({})",
+                list(post_ids),
+                channel_id,
+            )
+        }
+
+    def save(self, channel_id, post_id, replies, records):
+        """
+        Дописывает комментарии треда (записи message_record, дата — unixtime) и запоминает
+        число комментариев поста. Одна транзакция: тред не остаётся собранным наполовину.
+        """
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO comments (channel_id, post_id, id, date, text, views, forwards, media_type,"
+                " reactions, reply_to) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (channel_id, post_id, message_id, date, text, views, forwards, media_type,
+                     json.dumps(reactions, ensure_ascii=False) if reactions else None, reply_to)
+                    for message_id, date, text, views, forwards, media_type, reactions, reply_to in records
+                ],
+            )
+            self._conn.execute(
+                """
+                INSERT INTO threads (channel_id, post_id, replies, max_id, updated_at)
+                VALUES (?, ?, ?, COALESCE((SELECT max(id) FROM comments WHERE channel_id = ? AND post_id = ?), 0), ?)
+                ON CONFLICT (channel_id, post_id) DO UPDATE SET
+                    replies = excluded.replies,
+                    max_id = excluded.max_id,
+                    updated_at = excluded.updated_at
+                """,
+                (channel_id, post_id, replies, channel_id, post_id, time.time()),
+            )
+
+    def load(self, channel_id, post_ids):
+        """
+        Комментарии постов post_ids: (post_id, id, date, text, views, forwards, media_type,
+        reactions, reply_to) по постам в порядке post_ids, внутри треда — от старых к новым.
+        """
+        order = {post_id: i for i, post_id in enumerate(post_ids)}
+        rows = self._fetch(
+            "SELECT post_id, id, date, text, views, forwards, media_type, reactions, reply_to FROM comments"
+            " WHERE channel_id = ? AND post_id IN ({})",
+            list(post_ids),
+            channel_id,
+        )
+        rows.sort(key=lambda row: (order[row[0]], row[1]))
+        return [
+            (*row[:7], json.loads(row[7]) if row[7] else [], row[8])
+            for row in rows
+        ]
+
+    def close(self):
+        self._conn.close()
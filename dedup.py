@@ -0,0 +1,307 @@
+"""
+Поиск повторов и репостов между каналами и запусками (SQLite + MinHash/LSH).
+Для текста сообщения считается MinHash-подпись по шинглам из трёх слов; подписи режутся
+на полосы, и кандидаты в похожие находятся по совпавшей полосе в индексе, без попарного
+сравнения. Похожие сообщения собираются в группы, у группы помнится самый ранний источник.
+"""
+import os
+import sqlite3
+import time
+
+from checkpoints import DATA_DIR
+from message_buffer import NULL
+
+DEFAULT_DEDUP_PATH = os.path.join(DATA_DIR, "dedup.sqlite3")
+# Длина MinHash-подписи и её разбиение на полосы LSH: BANDS полос по NUM_PERM // BANDS значений
+NUM_PERM = 64
+BANDS = 16
+# Сообщения считаются повтором, если доля совпавших значений подписи (оценка Жаккара) не меньше
+SIMILARITY_THRESHOLD = 0.6
+SHINGLE_WORDS = 3
+# Короче этого (в словах) текст не сравнивается: «Доброе утро» — не репост
+MIN_WORDS = 5
+# По сколько сообщений канала обрабатывается за раз — память не растёт с размером канала
+CHUNK_SIZE = 5_000
+# Кэш страниц SQLite, КиБ
+CACHE_KIB = 131_072
+_SEED = 20240917
+
+
+def _permutations():
+    import numpy as np
+
+    rng = np.random.default_rng(_SEED)
+    a = rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+    return a, b
+
+
+def normalize_text(text):
+    """Нижний регистр и одиночные пробелы: репост с другими переносами строк — тот же текст."""
+    return " ".join((text or "").lower().split())
+
+
+def signatures(texts):
+    """
+    MinHash-подписи (n × NUM_PERM, uint32) для нормализованных текстов (см. normalize_text),
+    в каждом не меньше SHINGLE_WORDS слов. Хэши слов считаются векторно по кодовым точкам
+    всего пакета (полиномиальный хэш через префиксные суммы), без цикла Python по словам.
+    """
+    import numpy as np
+
+    words = np.fromiter((text.count(" ") + 1 for text in texts), dtype=np.int64, count=len(texts))
+    codes = np.frombuffer((" ".join(texts) + " ").encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    # Полиномиальный хэш по модулю 2**64: h(s..e) = sum c[j] * B**(e-1-j) = (G[e] - G[s]) * B**(e-1),
+    # где G — префиксные суммы c[j] * B**-j (B нечётное, обратное по модулю 2**64 существует)
+    base = np.uint64(1_000_003)
+    inverse = np.uint64(pow(1_000_003, -1, 2 ** 64))
+    powers = np.cumprod(np.full(len(codes), base, dtype=np.uint64))
+    inverse_powers = np.concatenate(([np.uint64(1)], np.cumprod(np.full(len(codes) - 1, inverse, dtype=np.uint64))))
+    prefix = np.concatenate(([np.uint64(0)], np.cumsum(codes * inverse_powers, dtype=np.uint64)))
+    ends = np.flatnonzero(codes == 32)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # powers[e - 2] = B**(e-1); у слова e > s, поэтому e >= 1 (для e == 1 берётся B**0 = 1)
+    scale = np.where(ends >= 2, powers[np.maximum(ends - 2, 0)], np.where(ends == 1, np.uint64(1), np.uint64(0)))
+    word_hashes = (prefix[ends] - prefix[starts]) * scale
+    # Шинглы: SHINGLE_WORDS подряд идущих слов внутри одного сообщения
+    counts = words - SHINGLE_WORDS + 1
+    first_word = np.concatenate(([0], np.cumsum(words)[:-1]))
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    positions = np.repeat(first_word - offsets, counts) + np.arange(counts.sum())
+    shingles = np.zeros(len(positions), dtype=np.uint64)
+    for k in range(SHINGLE_WORDS):
+        shingles = shingles * np.uint64(0x9E3779B97F4A7C15) + word_hashes[positions + k]
+    a, b = _permutations()
+    result = np.empty((len(texts), NUM_PERM), dtype=np.uint32)
+    for p in range(NUM_PERM):
+        result[:, p] = np.minimum.reduceat((shingles * a[p] + b[p]) >> np.uint64(32), offsets)
+    return result
+
+
+def band_keys(signature_rows):
+    """
+    Ключи полос LSH (n × BANDS, int64): совпадение хоть одного ключа — кандидат в повтор.
+    Номер полосы входит в ключ, так что ключи разных полос не совпадают.
+    """
+    import numpy as np
+
+    rows = NUM_PERM // BANDS
+    bands = signature_rows.reshape(len(signature_rows), BANDS, rows).astype(np.uint64)
+    weights = np.uint64(0x100000001B3) ** np.arange(1, rows + 1, dtype=np.uint64)
+    salt = np.arange(BANDS, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return ((bands * weights).sum(axis=2, dtype=np.uint64) + salt).view(np.int64)
+
+
+class DuplicateIndex:
+    """
+    Группы похожих сообщений по ключу scope (как у CheckpointStore — свои у каждого аккаунта).
+    clusters — группа: подпись первого сообщения и самый ранний источник (канал, id, дата);
+    members — к какой группе отнесено сообщение (channel_id, message_id);
+    buckets — ключи полос LSH подписи группы → группа (scope проверяется по clusters:
+    строк полос на каждую группу BANDS, и без scope в них индекс заметно меньше).
+    """
+
+    def __init__(self, path=DEFAULT_DEDUP_PATH, scope="default"):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.scope = str(scope)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Ключи полос случайны: вставки идут по всему B-дереву, без большого кэша страниц каждая читает диск
+        self._conn.execute(f"PRAGMA cache_size=-{CACHE_KIB}")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS clusters (
+                id INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                source_channel_id INTEGER NOT NULL,
+                source_channel TEXT NOT NULL,
+                source_message_id INTEGER NOT NULL,
+                source_date INTEGER,
+                size INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS members (
+                scope TEXT NOT NULL,
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                cluster_id INTEGER NOT NULL,
+                PRIMARY KEY (scope, channel_id, message_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS buckets (
+                key INTEGER NOT NULL,
+                cluster_id INTEGER NOT NULL,
+                PRIMARY KEY (key, cluster_id)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def _fetch(self, sql, ids, *params):
+        """Строки запроса sql с IN ({}) по списку ids — частями, чтобы не упереться в лимит параметров."""
+        rows = []
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            rows.extend(self._conn.execute(sql.format(", ".join("?" * len(part))), (*params, *part)))
+        return rows
+
+    def _buckets(self, keys):
+        """Группы в индексе по ключам полос: key → [cluster_id] (только найденные ключи)."""
+        import numpy as np
+
+        buckets = {}
+        for key, cluster_id in self._fetch(
+            "SELECT key, cluster_id FROM buckets WHERE key IN ({})",
+            np.unique(keys).tolist(),
+        ):
+            buckets.setdefault(key, []).append(cluster_id)
+        return buckets
+
+    def add(self, channel_id, channel, message_ids, dates, texts):
+        """
+        Добавляет сообщения канала в индекс и возвращает для каждого источник повтора —
+        (канал, message_id) более раннего похожего сообщения — или None, если это не повтор
+        (короткий текст, новая группа или самое раннее сообщение своей группы).
+        Сообщение, уже бывшее в индексе, остаётся в своей группе.
+        """
+        sources = [None] * len(message_ids)
+        for start in range(0, len(message_ids), CHUNK_SIZE):
+            stop = min(start + CHUNK_SIZE, len(message_ids))
+            # Пакет — одна транзакция: id новых групп выдаются без гонки с другими процессами
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                sources[start:stop] = self._add_chunk(
+                    channel_id, channel, message_ids[start:stop], dates[start:stop], texts[start:stop]
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return sources
+
+    def _add_chunk(self, channel_id, channel, message_ids, dates, texts):
+        import numpy as np
+
+        cluster_of = {}
+        known = dict(self._fetch(
+            "SELECT message_id, cluster_id FROM members WHERE scope = ? AND channel_id = ? AND message_id IN ({})",
+            list(message_ids),
+            self.scope,
+            channel_id,
+        ))
+        rows = []
+        normalized = []
+        for i, (message_id, text) in enumerate(zip(message_ids, texts)):
+            if message_id in known:
+                cluster_of[i] = known[message_id]
+                continue
+            text = normalize_text(text)
+            if text.count(" ") + 1 >= MIN_WORDS:
+                rows.append(i)
+                normalized.append(text)
+        if rows:
+            signature_rows = signatures(normalized)
+            keys = band_keys(signature_rows)
+            buckets = self._buckets(keys)
+            wanted = sorted({cluster_id for clusters in buckets.values() for cluster_id in clusters})
+            seeds = {
+                cluster_id: np.frombuffer(signature, dtype=np.uint32)
+                for cluster_id, signature in self._fetch(
+                    "SELECT id, signature FROM clusters WHERE scope = ? AND id IN ({})", wanted, self.scope
+                )
+            }
+            new_buckets = []
+            new_clusters = []
+            next_id = self._conn.execute("SELECT coalesce(max(id), 0) + 1 FROM clusters").fetchone()[0]
+            now = time.time()
+            # От старых к новым: в пределах пакета первым в группу попадает самое раннее сообщение
+            for r in sorted(range(len(rows)), key=lambda r: dates[rows[r]] or 0):
+                i = rows[r]
+                signature = signature_rows[r]
+                row_keys = keys[r].tolist()
+                found = {cluster_id for key in row_keys for cluster_id in buckets.get(key, ())}
+                best = None
+                best_matches = SIMILARITY_THRESHOLD * NUM_PERM
+                for cluster_id in found & seeds.keys():
+                    matches = np.count_nonzero(seeds[cluster_id] == signature)
+                    if matches >= best_matches:
+                        best, best_matches = cluster_id, matches
+                if best is None:
+                    # Новая группа: её подпись — подпись этого сообщения, ключи полос — в индекс
+                    best = next_id
+                    next_id += 1
+                    new_clusters.append(
+                        (best, self.scope, signature.tobytes(), channel_id, channel, message_ids[i], dates[i], now)
+                    )
+                    seeds[best] = signature
+                    for key in row_keys:
+                        buckets.setdefault(key, []).append(best)
+                        new_buckets.append((key, best))
+                cluster_of[i] = best
+            self._conn.executemany(
+                "INSERT INTO clusters (id, scope, signature, source_channel_id, source_channel,"
+                " source_message_id, source_date, size, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)",
+                new_clusters,
+            )
+            # По порядку ключей: соседние вставки попадают в одни и те же страницы B-дерева
+            new_buckets.sort()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO buckets (key, cluster_id) VALUES (?, ?)", new_buckets
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO members (scope, channel_id, message_id, cluster_id) VALUES (?, ?, ?, ?)",
+                [(self.scope, channel_id, message_ids[i], cluster_of[i]) for i in rows],
+            )
+            # Размер группы и более ранний источник, если он пришёл позже (догрузка истории, другой канал)
+            added = {}
+            for i in rows:
+                added.setdefault(cluster_of[i], []).append(i)
+            updates = []
+            for cluster_id, members in added.items():
+                earliest = min(members, key=lambda i: dates[i] or 0)
+                date = dates[earliest]
+                updates.append((
+                    len(members),
+                    date, channel_id, date, channel, date, message_ids[earliest], date,
+                    now, cluster_id,
+                ))
+            self._conn.executemany(
+                """
+                UPDATE clusters SET
+                    size = size + ?,
+                    source_channel_id = CASE WHEN ? < source_date THEN ? ELSE source_channel_id END,
+                    source_channel = CASE WHEN ? < source_date THEN ? ELSE source_channel END,
+                    source_message_id = CASE WHEN ? < source_date THEN ? ELSE source_message_id END,
+                    source_date = min(source_date, ?),
+                    updated_at = ?
+                WHERE id = ?
+                """,
+                updates,
+            )
+        sources = {
+            cluster_id: (source_channel_id, source_channel, source_message_id)
+            for cluster_id, source_channel_id, source_channel, source_message_id in self._fetch(
+                "SELECT id, source_channel_id, source_channel, source_message_id FROM clusters WHERE id IN ({})",
+                sorted(set(cluster_of.values())),
+            )
+        }
+        result = []
+        for i, message_id in enumerate(message_ids):
+            source = sources.get(cluster_of.get(i))
+            if source is None or (source[0] == channel_id and source[2] == message_id):
+                result.append(None)
+            else:
+                result.append((source[1], source[2]))
+        return result
+
+    def add_buffer(self, channel_id, channel, messages, start=0, stop=None):
+        """add для сообщений MessageBuffer[start:stop]."""
+        stop = len(messages) if stop is None else min(stop, len(messages))
+        dates = [None if ts == NULL else ts for ts in messages.date_unixtime[start:stop]]
+        return self.add(channel_id, channel, messages.ids[start:stop].tolist(), dates, messages.texts[start:stop])
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,133 @@
+"""
+Кэш разрешения каналов (SQLite): username → id, access_hash, название.
+Повторные запуски не делают contacts.ResolveUsername для уже известных каналов.
+"""
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+
+from telethon import utils
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser
+
+from checkpoints import DATA_DIR
+
+DEFAULT_ENTITY_CACHE_PATH = os.path.join(DATA_DIR, "entities.sqlite3")
+# Сколько живёт запись кэша: username может перейти к другому каналу
+DEFAULT_ENTITY_TTL = 7 * 24 * 3600
+
+
+@dataclass(frozen=True)
+class ResolvedEntity:
+    """Разрешённый канал: всё, что нужно scrape_channel без повторного get_entity."""
+
+    id: int
+    access_hash: int
+    kind: str
+    username: str
+    title: str
+
+    @classmethod
+    def from_entity(cls, entity, fallback_username=""):
+        peer = utils.get_input_peer(entity)
+        if isinstance(peer, InputPeerChannel):
+            kind, access_hash = "channel", peer.access_hash
+        elif isinstance(peer, InputPeerUser):
+            kind, access_hash = "user", peer.access_hash
+        else:
+            kind, access_hash = "chat", 0
+        return cls(
+            id=entity.id,
+            access_hash=access_hash,
+            kind=kind,
+            username=getattr(entity, "username", None) or fallback_username,
+            title=getattr(entity, "title", None),
+        )
+
+    def input_peer(self):
+        """InputPeer для вызовов API — Telethon не будет разрешать его заново."""
+        if self.kind == "channel":
+            return InputPeerChannel(self.id, self.access_hash)
+        if self.kind == "user":
+            return InputPeerUser(self.id, self.access_hash)
+        return InputPeerChat(self.id)
+
+
+class EntityCache:
+    """
+    Записи по ключу (scope, username). access_hash привязан к аккаунту,
+    поэтому scope — id пользователя Telegram, как и у CheckpointStore.
+    """
+
+    def __init__(self, path=DEFAULT_ENTITY_CACHE_PATH, scope="default", ttl=DEFAULT_ENTITY_TTL):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.scope = str(scope)
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entities (
+                scope TEXT NOT NULL,
+                username TEXT NOT NULL,
+                entity_id INTEGER NOT NULL,
+                access_hash INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                entity_username TEXT,
+                title TEXT,
+                resolved_at REAL NOT NULL,
+                PRIMARY KEY (scope, username)
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(username):
+        return username.strip().lower()
+
+    def get(self, username):
+        """ResolvedEntity из кэша или None (нет записи или истёк TTL)."""
+        row = self._conn.execute(
+            "SELECT entity_id, access_hash, kind, entity_username, title, resolved_at FROM entities "
+            "WHERE scope = ? AND username = ?",
+            (self.scope, self.key(username)),
+        ).fetchone()
+        if row is None or time.time() - row[5] > self.ttl:
+            return None
+        return ResolvedEntity(id=row[0], access_hash=row[1], kind=row[2], username=row[3] or username, title=row[4])
+
+    def put(self, username, resolved):
+        self._conn.execute(
+            """
+            INSERT INTO entities (scope, username, entity_id, access_hash, kind, entity_username, title, resolved_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (scope, username) DO UPDATE SET
+                entity_id = excluded.entity_id,
+                access_hash = excluded.access_hash,
+                kind = excluded.kind,
+                entity_username = excluded.entity_username,
+                title = excluded.title,
+                resolved_at = excluded.resolved_at
+            """,
+            (
+                self.scope,
+                self.key(username),
+                resolved.id,
+                resolved.access_hash,
+                resolved.kind,
+                resolved.username,
+                resolved.title,
+                time.time(),
+            ),
+        )
+        self._conn.commit()
+
+    def invalidate(self, username):
+        self._conn.execute("DELETE FROM entities WHERE scope = ? AND username = ?", (self.scope, self.key(username)))
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
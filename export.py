@@ -0,0 +1,553 @@
+"""
+Экспорт результатов скрапинга: плоские строки для CSV/Excel и потоковая запись на диск.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import zipfile
+from datetime import datetime
+
+from checkpoints import DATA_DIR
+from message_buffer import MEDIA_TYPES, NULL, MessageBuffer
+
+EXPORTS_DIR = os.path.join(DATA_DIR, "exports")
+# Сколько сообщений копится в памяти перед записью на диск
+STREAM_CHUNK_SIZE = 500
+# Колонки плоской выгрузки (CSV / Excel)
+EXPORT_COLUMNS = [
+    "channel",
+    "channel_title",
+    "message_id",
+    "post_id",
+    "date",
+    "text",
+    "views",
+    "forwards",
+    "replies",
+    "media_type",
+    "media_file",
+    "url",
+]
+STREAM_EXTENSIONS = {"jsonl": "jsonl", "csv": "csv", "parquet": "parquet"}
+STREAM_MIME_TYPES = {"jsonl": "application/x-ndjson", "csv": "text/csv", "parquet": "application/zip"}
+PARQUET_COMPRESSION = "zstd"
+# Размер row group при потоковой записи Parquet (пачки сообщений копятся до этого размера)
+PARQUET_ROW_GROUP_SIZE = 50_000
+# Строк данных на листе Excel (без заголовка); дальше — следующий лист
+EXCEL_MAX_ROWS = 1_048_575
+# По сколько сообщений канала разворачивается в таблицу при записи Excel
+EXCEL_CHUNK_SIZE = 100_000
+# Файлы выгрузки по запросу: формат → (расширение, MIME)
+EXPORT_FILES = {
+    "json": ("json", "application/json"),
+    "csv": ("csv", "text/csv"),
+    "excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": ("parquet.zip", "application/zip"),
+    "bundle": ("bundle.zip", "application/zip"),
+}
+# Архив-бандл: сжатие deflate (как у gzip) и сколько байт JSON копится перед записью в архив
+BUNDLE_COMPRESSLEVEL = 6
+BUNDLE_CHUNK_BYTES = 1 << 20
+
+
+def channel_buffers(ch):
+    """Буферы канала для плоской выгрузки: посты, затем комментарии (у их строк заполнен post_id)."""
+    comments = ch.get("comments")
+    return [ch["messages"], comments] if comments is not None and len(comments) else [ch["messages"]]
+
+
+def channel_frame(channel, channel_title, messages, start=0, stop=None):
+    """
+    Плоская выгрузка сообщений канала (MessageBuffer[start:stop]) с колонками EXPORT_COLUMNS.
+    post_id заполнен только у комментариев (CommentBuffer).
+    """
+    import pandas as pd
+
+    frame = messages.to_frame(start, stop)
+    if "post_id" not in frame:
+        frame["post_id"] = pd.array([pd.NA] * len(frame), dtype="Int64")
+    frame.insert(0, "channel_title", channel_title or "")
+    frame.insert(0, "channel", channel or "")
+    return frame.rename(columns={"id": "message_id"})[EXPORT_COLUMNS]
+
+
+def results_dataframe(results):
+    """Все сообщения всех каналов одной таблицей — без промежуточных dict на строку."""
+    import pandas as pd
+
+    frames = [
+        channel_frame(ch.get("channel", ""), ch.get("channel_title", ""), messages)
+        for ch in results
+        for messages in channel_buffers(ch)
+    ]
+    if not frames:
+        return pd.DataFrame(columns=EXPORT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def parquet_schema():
+    """
+    Схема Parquet-выгрузки. Колонки channel в файлах нет: датасет разбит
+    по каналам в стиле Hive (channel=<имя>/...), её восстанавливают pandas/DuckDB.
+    """
+    import pyarrow as pa
+
+    return pa.schema([
+        ("channel_title", pa.string()),
+        ("message_id", pa.int64()),
+        ("post_id", pa.int64()),
+        ("date", pa.timestamp("s", tz="UTC")),
+        ("text", pa.string()),
+        ("views", pa.int64()),
+        ("forwards", pa.int64()),
+        ("replies", pa.int64()),
+        ("media_type", pa.dictionary(pa.int8(), pa.string())),
+        ("reactions", pa.list_(pa.struct([("emoji", pa.string()), ("count", pa.int64())]))),
+        ("reply_to_msg_id", pa.int64()),
+        ("url", pa.string()),
+        ("media_file", pa.string()),
+    ])
+
+
+def results_document(results):
+    """Итоговый документ выгрузки (JSON): метаданные и все каналы."""
+    return {
+        "scraped_at": datetime.now().isoformat(),
+        "total_channels": len(results),
+        "total_messages": sum(r["total_messages"] for r in results),
+        "channels": results,
+    }
+
+
+def write_excel(results, target):
+    """
+    Сообщения в .xlsx через write-only книгу openpyxl: строки пишутся потоком, каналы
+    разворачиваются в таблицу пачками по EXCEL_CHUNK_SIZE. После EXCEL_MAX_ROWS строк
+    начинается следующий лист (Messages 2, Messages 3, ...) со своим заголовком.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    workbook = Workbook(write_only=True)
+    sheet = None
+    sheet_rows = EXCEL_MAX_ROWS
+    for ch in results:
+        for messages in channel_buffers(ch):
+            for start in range(0, len(messages), EXCEL_CHUNK_SIZE):
+                frame = channel_frame(
+                    ch.get("channel", ""), ch.get("channel_title", ""), messages, start, start + EXCEL_CHUNK_SIZE
+                )
+                # Управляющие символы openpyxl в ячейку не пишет
+                frame["text"] = frame["text"].str.replace(ILLEGAL_CHARACTERS_RE, "", regex=True)
+                frame = frame.astype(object).where(frame.notna(), None)
+                for row in frame.itertuples(index=False, name=None):
+                    if sheet_rows >= EXCEL_MAX_ROWS:
+                        title = "Messages" if sheet is None else f"Messages {len(workbook.worksheets) + 1}"
+                        sheet = workbook.create_sheet(title)
+                        sheet.append(EXPORT_COLUMNS)
+                        sheet_rows = 0
+                    sheet.append(row)
+                    sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet("Messages").append(EXPORT_COLUMNS)
+    workbook.save(target)
+
+
+def write_export(results, export_format, target):
+    """Выгрузка результатов в файл target в формате export_format (ключ EXPORT_FILES)."""
+    if export_format == "json":
+        with open(target, "w", encoding="utf-8") as f:
+            for chunk in iter_json_chunks(results_document(results)):
+                f.write(chunk)
+    elif export_format == "csv":
+        with open(target, "w", encoding="utf-8-sig", newline="") as f:
+            f.write(",".join(EXPORT_COLUMNS) + "\n")
+            for ch in results:
+                for messages in channel_buffers(ch):
+                    channel_frame(ch.get("channel", ""), ch.get("channel_title", ""), messages).to_csv(
+                        f, header=False, index=False
+                    )
+    elif export_format == "excel":
+        write_excel(results, target)
+    elif export_format == "parquet":
+        with tempfile.TemporaryDirectory() as directory, open(target, "wb") as f:
+            write_parquet_dataset(results, directory)
+            zip_directory(directory, f)
+    elif export_format == "bundle":
+        write_bundle(results, target)
+    else:
+        raise ValueError(f"Неизвестный формат выгрузки: {export_format}")
+
+
+def export_cache_path(key, export_format, directory=EXPORTS_DIR):
+    """Где лежит (или будет лежать) выгрузка результата key в формате export_format."""
+    return os.path.join(directory, f"result_{key}.{EXPORT_FILES[export_format][0]}")
+
+
+def cached_export(results, export_format, key, directory=EXPORTS_DIR):
+    """
+    Файл выгрузки результата key (например, id задачи) в формате export_format.
+    Строится только при первом запросе и дальше берётся с диска; запись атомарная.
+    """
+    path = export_cache_path(key, export_format, directory)
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            write_export(results, export_format, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return path
+
+
+def channel_arrow_table(channel_title, messages):
+    """Arrow-таблица из MessageBuffer напрямую по колонкам (реакции — вложенный список)."""
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+
+    def nullable(values, arrow_type=pa.int64()):
+        data = np.frombuffer(values, dtype=np.int64)
+        return pa.array(data, mask=data == NULL, type=arrow_type)
+
+    ids = np.frombuffer(messages.ids, dtype=np.int64)
+    offsets = np.frombuffer(messages.reaction_offsets, dtype=np.uint64).astype(np.int32)
+    emoji = pa.array(messages.emoji_table, type=pa.string()).take(
+        pa.array(np.frombuffer(messages.reaction_emoji, dtype=np.uint16))
+    )
+    reaction_structs = pa.StructArray.from_arrays(
+        [emoji, pa.array(np.frombuffer(messages.reaction_counts, dtype=np.int64))],
+        names=["emoji", "count"],
+    )
+    urls = f"https://t.me/{messages.channel_username}/" + pd.Series(ids, dtype="int64").astype(str)
+    post_ids = getattr(messages, "post_ids", None)
+    if post_ids is not None:
+        # Комментарий: ссылка в тред поста
+        urls = (
+            f"https://t.me/{messages.channel_username}/"
+            + pd.Series(np.frombuffer(post_ids, dtype=np.int64)).astype(str)
+            + "?comment="
+            + pd.Series(ids, dtype="int64").astype(str)
+        )
+    columns = [
+        pa.array(np.full(len(messages), channel_title or "", dtype=object), type=pa.string()),
+        pa.array(ids),
+        pa.array(np.frombuffer(post_ids, dtype=np.int64)) if post_ids is not None else pa.nulls(len(messages), pa.int64()),
+        nullable(messages.date_unixtime, pa.timestamp("s", tz="UTC")),
+        pa.array(messages.texts, type=pa.string()),
+        nullable(messages.views),
+        nullable(messages.forwards),
+        nullable(messages.replies),
+        pa.DictionaryArray.from_arrays(
+            pa.array(np.frombuffer(messages.media, dtype=np.uint8).astype(np.int8)),
+            pa.array(MEDIA_TYPES, type=pa.string()),
+        ),
+        pa.ListArray.from_arrays(pa.array(offsets), reaction_structs),
+        nullable(messages.reply_to),
+        pa.array(urls, type=pa.string()),
+        pa.array([messages.media_files.get(i) for i in range(len(messages))], type=pa.string())
+        if messages.media_files
+        else pa.nulls(len(messages), pa.string()),
+    ]
+    return pa.Table.from_arrays(columns, schema=parquet_schema())
+
+
+def partition_dir(directory, channel):
+    """Каталог раздела канала: channel=<имя> (небезопасные символы заменяются на _)."""
+    return os.path.join(directory, "channel=" + re.sub(r"[^\w.-]", "_", channel or "unknown"))
+
+
+def partition_parts(directory, channel):
+    """Файлы part-N.parquet раздела канала по порядку N (дозапись добавляет следующий номер)."""
+    target = partition_dir(directory, channel)
+    if not os.path.isdir(target):
+        return []
+    parts = [name for name in os.listdir(target) if re.fullmatch(r"part-\d+\.parquet", name)]
+    return [os.path.join(target, name) for name in sorted(parts, key=lambda name: int(name[5:-8]))]
+
+
+def write_parquet_dataset(results, directory):
+    """
+    Пишет результаты в Parquet-датасет, разбитый по каналам (комментарии — в файле канала,
+    после постов). Возвращает список файлов.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    paths = []
+    for ch in results:
+        target = partition_dir(directory, ch.get("channel", ""))
+        os.makedirs(target, exist_ok=True)
+        path = os.path.join(target, "part-0.parquet")
+        table = pa.concat_tables([channel_arrow_table(ch.get("channel_title", ""), m) for m in channel_buffers(ch)])
+        pq.write_table(table, path, compression=PARQUET_COMPRESSION)
+        paths.append(path)
+    return paths
+
+
+def zip_directory(directory, fileobj):
+    """Упаковывает каталог в zip без повторного сжатия (Parquet уже сжат)."""
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_STORED) as archive:
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                archive.write(path, os.path.relpath(path, directory))
+
+
+def iter_json_chunks(obj, indent=2, _level=0):
+    """
+    JSON по кускам, как json.dumps(obj, ensure_ascii=False, indent=indent),
+    но MessageBuffer разворачивается в список сообщений на лету.
+    indent=None — компактный JSON без пробелов, как с separators=(",", ":").
+    """
+    if indent is None:
+        pad = closing_pad = ""
+        colon = ":"
+    else:
+        pad = "\n" + " " * (indent * (_level + 1))
+        closing_pad = "\n" + " " * (indent * _level)
+        colon = ": "
+    if isinstance(obj, dict):
+        if not obj:
+            yield "{}"
+            return
+        yield "{"
+        for i, (key, value) in enumerate(obj.items()):
+            yield ("," if i else "") + pad + json.dumps(str(key), ensure_ascii=False) + colon
+            yield from iter_json_chunks(value, indent, _level + 1)
+        yield closing_pad + "}"
+    elif indent is None and isinstance(obj, MessageBuffer):
+        # Компактная запись сообщения целиком — без обхода каждого поля
+        yield "["
+        for i, record in enumerate(obj.iter_records()):
+            yield ("," if i else "") + json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        yield "]"
+    elif isinstance(obj, (list, tuple, MessageBuffer)):
+        if not len(obj):
+            yield "[]"
+            return
+        yield "["
+        for i, value in enumerate(obj):
+            yield ("," if i else "") + pad
+            yield from iter_json_chunks(value, indent, _level + 1)
+        yield closing_pad + "]"
+    else:
+        yield json.dumps(obj, ensure_ascii=False)
+
+
+def bundle_member_name(index, channel):
+    """Имя файла канала в бандле: номер сохраняет порядок каналов и различает одинаковые имена."""
+    safe_name = re.sub(r"[^\w.-]", "_", channel or "unknown")
+    return f"channels/{index:03d}_{safe_name}.json"
+
+
+def write_bundle(results, target):
+    """
+    Архив-бандл (zip, deflate): по компактному JSON-файлу на канал (поля канала,
+    messages и comments) и manifest.json с числом сообщений, размером и SHA-256 каждого файла.
+    JSON пишется в архив кусками по BUNDLE_CHUNK_BYTES — целиком в памяти не собирается.
+    """
+    files = []
+    with zipfile.ZipFile(
+        target, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=BUNDLE_COMPRESSLEVEL
+    ) as archive:
+        for index, ch in enumerate(results, 1):
+            name = bundle_member_name(index, ch.get("channel"))
+            digest = hashlib.sha256()
+            size = 0
+            with archive.open(name, "w", force_zip64=True) as member:
+                pending = []
+                pending_size = 0
+                for chunk in iter_json_chunks(ch, indent=None):
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                    if pending_size < BUNDLE_CHUNK_BYTES:
+                        continue
+                    data = "".join(pending).encode("utf-8")
+                    digest.update(data)
+                    member.write(data)
+                    size += len(data)
+                    pending, pending_size = [], 0
+                data = "".join(pending).encode("utf-8")
+                digest.update(data)
+                member.write(data)
+                size += len(data)
+            comments = ch.get("comments")
+            files.append({
+                "path": name,
+                "channel": ch.get("channel"),
+                "channel_title": ch.get("channel_title"),
+                "messages": len(ch["messages"]) if ch.get("messages") is not None else 0,
+                "comments": len(comments) if comments is not None else 0,
+                "bytes": size,
+                "sha256": digest.hexdigest(),
+            })
+        manifest = {
+            "scraped_at": datetime.now().isoformat(),
+            "total_channels": len(results),
+            "total_messages": sum(r["total_messages"] for r in results),
+            "total_comments": sum(f["comments"] for f in files),
+            "files": files,
+        }
+        archive.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+
+
+def path_size(path):
+    """Размер файла или каталога (Parquet-датасета) в байтах; 0, если его нет."""
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files
+        )
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def new_stream_path(stream_format, directory=EXPORTS_DIR):
+    """Путь для нового файла потоковой выгрузки."""
+    os.makedirs(directory, exist_ok=True)
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(directory, f"telegram_scrape_{ts}.{STREAM_EXTENSIONS[stream_format]}")
+
+
+class JsonlSink:
+    """JSON Lines: одна строка — одно сообщение вместе с полями канала. append=True — дописывать в файл."""
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.rows_written = 0
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, channel, channel_title, messages):
+        lines = []
+        for msg in messages.iter_records():
+            lines.append(json.dumps({"channel": channel, "channel_title": channel_title, **msg}, ensure_ascii=False))
+        if lines:
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            self.rows_written += len(lines)
+
+    def flush(self, channel=None):
+        """Всё записанное — на диске (write уже сбрасывает буфер на каждой пачке, здесь — fsync)."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class CsvSink:
+    """
+    CSV с колонками EXPORT_COLUMNS (UTF-8 с BOM, как обычная CSV-выгрузка).
+    append=True — дописывать в файл; BOM и заголовок пишутся, только если файл новый или пустой.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.rows_written = 0
+        new_file = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+        # utf-8-sig не пишет BOM при дозаписи в непустой файл
+        self._file = open(path, "a" if append else "w", encoding="utf-8-sig", newline="")
+        if new_file:
+            self._file.write(",".join(EXPORT_COLUMNS) + "\n")
+
+    def write(self, channel, channel_title, messages):
+        if not len(messages):
+            return
+        channel_frame(channel, channel_title, messages).to_csv(self._file, header=False, index=False)
+        self._file.flush()
+        self.rows_written += len(messages)
+
+    def flush(self, channel=None):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """
+    Parquet-датасет в каталоге path, разбитый по каналам (channel=<имя>/part-N.parquet).
+    Пачки копятся в Arrow до PARQUET_ROW_GROUP_SIZE строк и пишутся одной row group.
+    Файл пишется под временным именем _part-N.tmp и получает своё имя только целиком,
+    с футером: flush() закрывает текущий файл канала, следующие пачки идут в part-N+1.
+    Недописанный файл упавшего процесса удаляется при следующем открытии канала.
+    append=True — прежние файлы каналов остаются, запись продолжается следующим номером.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.append = append
+        self.rows_written = 0
+        self._writers = {}
+        self._pending = {}
+        self._opened = set()
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, channel, channel_title, messages):
+        if not len(messages):
+            return
+        pending = self._pending.setdefault(channel, [])
+        pending.append(channel_arrow_table(channel_title, messages))
+        self.rows_written += len(messages)
+        if sum(table.num_rows for table in pending) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush(channel)
+
+    def _flush(self, channel):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pending = self._pending.pop(channel, None)
+        if not pending:
+            return
+        if channel not in self._writers:
+            target = partition_dir(self.path, channel)
+            os.makedirs(target, exist_ok=True)
+            if channel not in self._opened:
+                self._opened.add(channel)
+                stale = [name for name in os.listdir(target) if re.fullmatch(r"_part-\d+\.tmp", name)]
+                if not self.append:
+                    stale += [os.path.basename(part) for part in partition_parts(self.path, channel)]
+                for name in stale:
+                    os.remove(os.path.join(target, name))
+            parts = partition_parts(self.path, channel)
+            number = int(os.path.basename(parts[-1])[5:-8]) + 1 if parts else 0
+            tmp_path = os.path.join(target, f"_part-{number}.tmp")
+            writer = pq.ParquetWriter(tmp_path, parquet_schema(), compression=PARQUET_COMPRESSION)
+            self._writers[channel] = (writer, tmp_path, os.path.join(target, f"part-{number}.parquet"))
+        self._writers[channel][0].write_table(pa.concat_tables(pending))
+
+    def _finish(self, channel):
+        """Дописывает футер текущего файла канала и даёт ему окончательное имя."""
+        writer, tmp_path, path = self._writers.pop(channel)
+        writer.close()
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def flush(self, channel=None):
+        """
+        Записывает накопленные пачки канала (или всех каналов) и закрывает текущий файл:
+        после возврата всё записанное читается с диска даже при падении процесса.
+        """
+        for key in [channel] if channel is not None else list(set(self._pending) | set(self._writers)):
+            self._flush(key)
+            if key in self._writers:
+                self._finish(key)
+
+    def close(self):
+        self.flush()
+
+
+def open_sink(stream_format, path, append=False):
+    """Потоковая запись в path; append=True — дописывать к уже выгруженному (повтор задачи, live)."""
+    if stream_format == "jsonl":
+        return JsonlSink(path, append)
+    if stream_format == "csv":
+        return CsvSink(path, append)
+    if stream_format == "parquet":
+        return ParquetSink(path, append)
+    raise ValueError(f"Неизвестный формат потоковой выгрузки: {stream_format}")
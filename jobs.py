@@ -0,0 +1,529 @@
+"""
+Фоновые задачи скрапинга: постоянная очередь в SQLite и пул процессов-воркеров.
+Интерфейс только ставит задачу в очередь и опрашивает её статус, прогресс и лог —
+перезапуски Streamlit и обрыв вебсокета задачу не прерывают.
+
+Запуск воркеров отдельно от веб-приложения (адрес и ключ хранилища ключей — те же, что у приложения):
+    JOBS_VAULT_ADDRESS=127.0.0.1:47291 JOBS_VAULT_KEY=... python jobs.py worker --processes 2
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from multiprocessing.managers import BaseManager
+
+from checkpoints import DATA_DIR
+from metrics import ScrapeMetrics, record_job, write_textfile
+
+DEFAULT_JOBS_PATH = os.path.join(DATA_DIR, "jobs.sqlite3")
+RESULTS_DIR = os.path.join(DATA_DIR, "jobs")
+# Воркер без признаков жизни дольше этого считается упавшим, его задача возвращается в очередь
+STALE_AFTER = 300
+POLL_INTERVAL = 1.0
+# Как часто воркер шлёт пульс задачи во время долгих шагов без прогресса (запись результата), секунды
+HEARTBEAT_INTERVAL = 30
+# Прогресс пишется в базу не чаще раза в PROGRESS_WRITE_INTERVAL секунд
+PROGRESS_WRITE_INTERVAL = 1.0
+DEFAULT_WORKER_PROCESSES = 2
+# Сжатие файла результатов: быстрый уровень gzip уменьшает pickle в 5–6 раз
+RESULTS_COMPRESSLEVEL = 1
+
+ACTIVE_STATUSES = ("queued", "running")
+# Что из параметров задачи — ключи и сессии: в базу очереди не пишутся, только в CredentialVault
+CREDENTIAL_KEYS = ("api_id", "api_hash", "sessions")
+# Ключи задачи, которая за это время так и не завершилась, забываются, секунды
+CREDENTIALS_TTL = 24 * 3600
+# Где слушает хранилище ключей и чем подписаны подключения (у приложения и внешних воркеров — одинаковые)
+VAULT_ADDRESS_ENV = "JOBS_VAULT_ADDRESS"
+VAULT_KEY_ENV = "JOBS_VAULT_KEY"
+
+
+class CredentialVault:
+    """
+    Ключи и сессии задач по id задачи — только в памяти процесса хранилища (start_credential_vault).
+    Воркер берёт их по id; после завершения или отмены задачи они удаляются.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def put(self, job_id, credentials):
+        with self._lock:
+            now = time.time()
+            for key in [key for key, (added, _) in self._items.items() if now - added > CREDENTIALS_TTL]:
+                del self._items[key]
+            self._items[job_id] = (now, credentials)
+
+    def get(self, job_id):
+        with self._lock:
+            item = self._items.get(job_id)
+            return item[1] if item else None
+
+    def discard(self, job_id):
+        with self._lock:
+            self._items.pop(job_id, None)
+
+
+_vault = None
+
+
+def _vault_instance():
+    global _vault
+    if _vault is None:
+        _vault = CredentialVault()
+    return _vault
+
+
+class _VaultManager(BaseManager):
+    pass
+
+
+_VaultManager.register("vault", callable=_vault_instance)
+
+
+def start_credential_vault():
+    """
+    Запускает хранилище ключей в отдельном процессе и возвращает прокси к нему. Адрес и ключ
+    попадают в окружение: воркеры, запущенные после этого из того же процесса, подключаются сами.
+    """
+    address = os.getenv(VAULT_ADDRESS_ENV) or "127.0.0.1:0"
+    host, port = address.rsplit(":", 1)
+    authkey = os.getenv(VAULT_KEY_ENV) or secrets.token_hex(16)
+    manager = _VaultManager((host, int(port)), authkey.encode())
+    manager.start()
+    os.environ[VAULT_ADDRESS_ENV] = f"{manager.address[0]}:{manager.address[1]}"
+    os.environ[VAULT_KEY_ENV] = authkey
+    return manager.vault()
+
+
+def connect_credential_vault():
+    """Прокси к хранилищу ключей по JOBS_VAULT_ADDRESS / JOBS_VAULT_KEY или None, если оно недоступно."""
+    address = os.getenv(VAULT_ADDRESS_ENV)
+    authkey = os.getenv(VAULT_KEY_ENV)
+    if not address or not authkey:
+        return None
+    host, port = address.rsplit(":", 1)
+    manager = _VaultManager((host, int(port)), authkey.encode())
+    try:
+        manager.connect()
+        return manager.vault()
+    except (OSError, EOFError):
+        return None
+
+
+class JobStore:
+    """
+    Очередь задач и их состояние. Разделяется процессами через один файл SQLite (WAL).
+    vault (прокси CredentialVault) хранит ключи и сессии задач: в базе их нет.
+    """
+
+    def __init__(self, path=DEFAULT_JOBS_PATH, vault=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.vault = vault
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                status TEXT NOT NULL,
+                params BLOB,
+                progress REAL NOT NULL DEFAULT 0,
+                channels TEXT,
+                result_path TEXT,
+                stream_path TEXT,
+                error TEXT,
+                metrics TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+            CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at);
+            CREATE TABLE IF NOT EXISTS job_logs (
+                job_id TEXT NOT NULL,
+                ts REAL NOT NULL,
+                line TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS job_logs_job ON job_logs (job_id, ts);
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "metrics" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN metrics TEXT")
+        if "attempts" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def submit(self, owner, params):
+        """
+        Ставит задачу в очередь. params: api_id, api_hash, sessions (список строк сессий),
+        links, options. Ключи и сессии уходят в vault до завершения задачи, в базу — только ссылки и опции.
+        """
+        if self.vault is None:
+            raise RuntimeError("Хранилище ключей задач не запущено (start_credential_vault).")
+        job_id = uuid.uuid4().hex[:12]
+        self.vault.put(job_id, {key: params[key] for key in CREDENTIAL_KEYS})
+        stored = {key: value for key, value in params.items() if key not in CREDENTIAL_KEYS}
+        self._conn.execute(
+            "INSERT INTO jobs (id, owner, status, params, stream_path, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+            (job_id, owner, pickle.dumps(stored), params["options"].get("stream_path"), time.time()),
+        )
+        return job_id
+
+    def credentials(self, job_id):
+        """Ключи и сессии задачи из vault или None (хранилище недоступно или перезапускалось)."""
+        if self.vault is None:
+            return None
+        try:
+            return self.vault.get(job_id)
+        except (OSError, EOFError):
+            self.vault = None
+            return None
+
+    def _discard_credentials(self, job_id):
+        if self.vault is not None:
+            try:
+                self.vault.discard(job_id)
+            except (OSError, EOFError):
+                self.vault = None
+
+    def claim(self, worker):
+        """
+        Атомарно забирает самую старую задачу из очереди. Возвращает (job_id, params) или None.
+        У повторной попытки (задача возвращена requeue_stale) options["stream_append"] = True:
+        потоковая выгрузка дописывается к тому, что успела записать прежняя попытка.
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT id, params, attempts FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                self._conn.execute("COMMIT")
+                return None
+            now = time.time()
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker, now, now, row[0]),
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        params = pickle.loads(row[1])
+        if row[2]:
+            params["options"] = {**params["options"], "stream_append": True}
+        return row[0], params
+
+    def requeue_stale(self, stale_after=STALE_AFTER):
+        """Возвращает в очередь задачи упавших воркеров."""
+        cursor = self._conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat_at < ?",
+            (time.time() - stale_after,),
+        )
+        return cursor.rowcount
+
+    def update_progress(self, job_id, progress, channels):
+        self._conn.execute(
+            "UPDATE jobs SET progress = ?, channels = ?, heartbeat_at = ? WHERE id = ?",
+            (progress, json.dumps(channels, ensure_ascii=False), time.time(), job_id),
+        )
+
+    def heartbeat(self, job_id):
+        self._conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def append_log(self, job_id, line):
+        self._conn.execute("INSERT INTO job_logs (job_id, ts, line) VALUES (?, ?, ?)", (job_id, time.time(), line))
+
+    def finish(self, job_id, status, result_path=None, error=None, metrics=None):
+        """
+        Завершает задачу (done / failed / cancelled), стирает её параметры и удаляет ключи
+        и сессии из vault. metrics — ScrapeMetrics.summary().
+        """
+        self._conn.execute(
+            "UPDATE jobs SET status = ?, result_path = ?, error = ?, finished_at = ?, params = NULL, metrics = ?, "
+            "progress = CASE WHEN ? = 'done' THEN 1.0 ELSE progress END WHERE id = ?",
+            (status, result_path, error, time.time(), json.dumps(metrics) if metrics else None, status, job_id),
+        )
+        self._discard_credentials(job_id)
+
+    def request_cancel(self, job_id):
+        self._conn.execute(
+            "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN ('queued', 'running')", (job_id,)
+        )
+        # Задачу из очереди отменяем сразу, запущенную — останавливает воркер
+        cancelled = self._conn.execute(
+            "UPDATE jobs SET status = 'cancelled', params = NULL, finished_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id),
+        ).rowcount
+        if cancelled:
+            self._discard_credentials(job_id)
+
+    def cancel_requested(self, job_id):
+        row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def get(self, job_id):
+        row = self._conn.execute(
+            "SELECT id, owner, status, progress, channels, result_path, stream_path, error, "
+            "created_at, started_at, finished_at, metrics FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list(self, owner, limit=20):
+        rows = self._conn.execute(
+            "SELECT id, owner, status, progress, channels, result_path, stream_path, error, "
+            "created_at, started_at, finished_at, metrics FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ?",
+            (owner, limit),
+        ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def logs(self, job_id, limit=15):
+        rows = self._conn.execute(
+            "SELECT line FROM job_logs WHERE job_id = ? ORDER BY ts DESC, rowid DESC LIMIT ?", (job_id, limit)
+        ).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def queue_position(self, job_id):
+        """Сколько задач стоит в очереди перед этой."""
+        row = self._conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < "
+            "(SELECT created_at FROM jobs WHERE id = ?)",
+            (job_id,),
+        ).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _row_to_job(row):
+        return {
+            "id": row[0],
+            "owner": row[1],
+            "status": row[2],
+            "progress": row[3],
+            "channels": json.loads(row[4]) if row[4] else [],
+            "result_path": row[5],
+            "stream_path": row[6],
+            "error": row[7],
+            "created_at": row[8],
+            "started_at": row[9],
+            "finished_at": row[10],
+            "metrics": json.loads(row[11]) if row[11] else None,
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+def load_results(result_path):
+    """
+    Результаты завершённой задачи (список каналов, как у run_scraping).
+    Файлы .pkl.gz сжаты; несжатые .pkl прежних версий читаются как есть.
+    """
+    opener = gzip.open if result_path.endswith(".gz") else open
+    with opener(result_path, "rb") as f:
+        return pickle.load(f)
+
+
+class _JobProgress:
+    """Адаптер progress_bar / channel_progress / log_callback для run_scraping, пишущий в JobStore."""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.fraction = 0.0
+        self.channels = {}
+        self._written_at = 0.0
+
+    def progress(self, fraction):
+        self.fraction = fraction
+        self._write()
+
+    def channel(self, idx, link, status, fetched, fraction):
+        self.channels[idx] = {"link": link, "status": status, "fetched": fetched, "fraction": fraction}
+        self._write(force=status in ("done", "failed"))
+
+    def log(self, line):
+        self.store.append_log(self.job_id, line)
+
+    def _write(self, force=False):
+        now = time.monotonic()
+        if force or now - self._written_at >= PROGRESS_WRITE_INTERVAL:
+            self._written_at = now
+            self.store.update_progress(self.job_id, self.fraction, [self.channels[i] for i in sorted(self.channels)])
+
+
+async def _run_job(store, job_id, params, metrics, client_manager=None):
+    """Запускает скрапинг и параллельно следит за отменой и пульсом задачи."""
+    from scraper import run_scraping
+    from session_pool import run_scraping_pool
+
+    tracker = _JobProgress(store, job_id)
+    sessions = params["sessions"]
+    if len(sessions) > 1:
+        scrape = run_scraping_pool(
+            params["api_id"], params["api_hash"], sessions, params["links"], params["options"],
+            tracker, tracker.log, tracker.channel, metrics, client_manager,
+        )
+    else:
+        scrape = run_scraping(
+            params["api_id"], params["api_hash"], sessions[0], params["links"], params["options"],
+            tracker, tracker.log, tracker.channel, metrics, client_manager,
+        )
+    task = asyncio.ensure_future(scrape)
+    while not task.done():
+        await asyncio.wait([task], timeout=2.0)
+        if task.done():
+            break
+        store.heartbeat(job_id)
+        if store.cancel_requested(job_id):
+            tracker.log("⏹ Задача отменена пользователем.")
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            return None, True
+    tracker._write(force=True)
+    return task.result(), False
+
+
+def dump_results(store, job_id, results, path):
+    """
+    Сжимает результаты в path (через временный файл) в отдельном потоке, а пока он работает,
+    шлёт пульс задачи: долгая запись большого результата не выглядит упавшим воркером.
+    """
+    tmp_path = path + ".tmp"
+    failure = []
+
+    def dump():
+        try:
+            with gzip.open(tmp_path, "wb", compresslevel=RESULTS_COMPRESSLEVEL) as f:
+                pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except BaseException as e:
+            failure.append(e)
+
+    thread = threading.Thread(target=dump, name=f"dump-{job_id}", daemon=True)
+    thread.start()
+    while thread.is_alive():
+        store.heartbeat(job_id)
+        thread.join(HEARTBEAT_INTERVAL)
+    if failure:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise failure[0]
+    os.replace(tmp_path, path)
+
+
+def process_job(store, job_id, params):
+    """
+    Выполняет одну задачу и записывает итог и метрики в store и в файл метрик воркера.
+    Задачи воркера идут на loop общего менеджера клиентов: следующая задача той же сессии
+    берёт уже подключённый клиент.
+    """
+    from client_manager import get_client_manager
+
+    metrics = ScrapeMetrics()
+    status = "failed"
+    if not all(key in params for key in CREDENTIAL_KEYS):
+        credentials = store.credentials(job_id)
+        if credentials is None:
+            store.finish(
+                job_id, status, error="Ключи и сессия задачи недоступны (сервер перезапускался?) — запустите задачу заново."
+            )
+            record_job(None, status)
+            return
+        params = {**params, **credentials}
+    try:
+        client_manager = get_client_manager()
+        results, cancelled = client_manager.run(_run_job(store, job_id, params, metrics, client_manager))
+        metrics.finish()
+        if cancelled:
+            status = "cancelled"
+            store.finish(job_id, status, metrics=metrics.summary())
+        elif results:
+            os.makedirs(RESULTS_DIR, exist_ok=True)
+            result_path = os.path.join(RESULTS_DIR, f"{job_id}.pkl.gz")
+            dump_results(store, job_id, results, result_path)
+            status = "done"
+            store.finish(job_id, status, result_path=result_path, metrics=metrics.summary())
+        else:
+            store.finish(job_id, status, error="Нет результатов — подробности в логе задачи.", metrics=metrics.summary())
+    except Exception as e:
+        store.append_log(job_id, f"❌ Ошибка воркера: {e}")
+        store.finish(job_id, status, error=traceback.format_exc(limit=3))
+    record_job(metrics.summary() if status == "done" else None, status)
+    write_textfile()
+
+
+def worker_loop(jobs_path=DEFAULT_JOBS_PATH, stop_event=None):
+    """Цикл одного процесса-воркера: берёт задачи из очереди, пока не попросят остановиться."""
+    store = JobStore(jobs_path)
+    worker = f"{os.uname().nodename if hasattr(os, 'uname') else 'local'}:{os.getpid()}"
+    write_textfile()
+    while stop_event is None or not stop_event.is_set():
+        if store.vault is None:
+            # Хранилище ключей могло перезапуститься вместе с приложением
+            store.vault = connect_credential_vault()
+        store.requeue_stale()
+        claimed = store.claim(worker)
+        if claimed is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        job_id, params = claimed
+        process_job(store, job_id, params)
+    store.close()
+
+
+def start_worker_pool(processes=DEFAULT_WORKER_PROCESSES, jobs_path=DEFAULT_JOBS_PATH, daemon=True):
+    """Запускает processes воркеров в отдельных процессах. Возвращает (процессы, событие остановки)."""
+    stop_event = multiprocessing.Event()
+    workers = []
+    for _ in range(processes):
+        process = multiprocessing.Process(target=worker_loop, args=(jobs_path, stop_event), daemon=daemon)
+        process.start()
+        workers.append(process)
+    return workers, stop_event
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркеры фоновых задач скрапинга")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="запустить пул воркеров")
+    worker_parser.add_argument("--processes", type=int, default=DEFAULT_WORKER_PROCESSES)
+    worker_parser.add_argument("--db", default=DEFAULT_JOBS_PATH, help="путь к базе очереди")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        workers, stop_event = start_worker_pool(args.processes, args.db, daemon=False)
+        print(f"Воркеров запущено: {len(workers)} (очередь: {args.db})")
+        try:
+            for process in workers:
+                process.join()
+        except KeyboardInterrupt:
+            stop_event.set()
+            for process in workers:
+                process.join()
+
+
+if __name__ == "__main__":
+    main()
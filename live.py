@@ -0,0 +1,306 @@
+"""
+Живое наблюдение за каналами: один подключённый клиент получает события новых
+и отредактированных сообщений и пачками дописывает их в потоковую выгрузку —
+без повторного сбора истории и get_entity на каждый круг. После обрыва связи
+и при перезапуске пропуск докачивается от последнего записанного id.
+
+Запуск из командной строки:
+    python cli.py links.txt --live --format json --output live.jsonl
+"""
+import asyncio
+import time
+
+from telethon import TelegramClient, events, utils
+from telethon.errors import FloodWaitError
+from telethon.sessions import StringSession
+from telethon.tl.functions.channels import JoinChannelRequest
+
+from checkpoints import DEFAULT_CHECKPOINT_PATH, CheckpointStore
+from entity_cache import DEFAULT_ENTITY_CACHE_PATH, EntityCache
+from export import open_sink
+from message_buffer import MessageBuffer
+from rate_limit import get_scheduler
+from scraper import dedupe_links, message_record, resolve_links
+
+# Буфер пишется на диск, когда в нём столько записей или прошло LIVE_FLUSH_INTERVAL секунд
+LIVE_BATCH_SIZE = 500
+LIVE_FLUSH_INTERVAL = 2.0
+# Сколько сообщений канала докачивается после перерыва; если пропущено больше — берутся самые старые из них
+CATCH_UP_LIMIT = 10_000
+# Паузы между попытками переподключения, секунды (дальше — последняя)
+RECONNECT_DELAYS = (1, 2, 5, 10, 30, 60)
+
+
+def live_scope(user_id):
+    """scope контрольных точек живого режима: отдельно от точек инкрементального сбора."""
+    return f"live:{user_id}"
+
+
+class LiveMonitor:
+    """
+    Подписка клиента на NewMessage / MessageEdited каналов channels (список пар
+    (ссылка, ResolvedEntity)). Записи — те же, что у scrape_channel (scraper.message_record),
+    пишутся в sink (export.JsonlSink / CsvSink) пачками; правка сообщения дописывается
+    ещё одной записью с тем же message_id (актуальна последняя).
+    state (CheckpointStore) хранит последний записанный id канала: точка сдвигается
+    только после записи пачки, поэтому после сбоя ничего не теряется.
+    """
+
+    def __init__(self, client, channels, sink, state, scheduler, options=None, log_callback=None):
+        self.client = client
+        self.sink = sink
+        self.state = state
+        self.scheduler = scheduler
+        self.options = options or {}
+        self.log = log_callback or (lambda msg: None)
+        # Отмеченный id (как в событиях) → (ссылка, ResolvedEntity)
+        self._channels = {utils.get_peer_id(resolved.input_peer()): (link, resolved) for link, resolved in channels}
+        self._buffers = {}
+        self._buffered = 0
+        # Последний принятый id канала (в памяти — вместе с ещё не записанным буфером)
+        self._last_ids = {}
+        # События, пришедшие во время докачки пропуска: разбираются после неё, по порядку
+        self._catching_up = False
+        self._queued = []
+        self.stats = {"new": 0, "edited": 0, "caught_up": 0, "written": 0, "reconnects": 0}
+
+    def _append(self, channel_key, message, new=True):
+        """Добавляет сообщение в буфер канала; новое сообщение не старше уже принятого пропускается."""
+        link, resolved = self._channels[channel_key]
+        last_id = self._last_ids.get(resolved.id, 0)
+        if new and message.id <= last_id:
+            return False
+        try:
+            message_id, message_date, text, views, forwards, media_type, reactions, reply_to, replies = (
+                message_record(message)
+            )
+        except Exception:
+            return False
+        buffer = self._buffers.get(channel_key)
+        if buffer is None:
+            buffer = self._buffers[channel_key] = MessageBuffer(resolved.username or link)
+        date_unixtime = int(message_date.timestamp()) if message_date else None
+        buffer.append(message_id, date_unixtime, text, views, forwards, media_type, reactions, reply_to, replies)
+        self._buffered += 1
+        if new:
+            self._last_ids[resolved.id] = message_id
+        if self._buffered >= self.options.get("live_batch_size", LIVE_BATCH_SIZE):
+            self.flush()
+        return True
+
+    async def _on_new(self, event):
+        self._receive(event.message, True)
+
+    async def _on_edit(self, event):
+        self._receive(event.message, False)
+
+    def _receive(self, message, new):
+        if self._catching_up:
+            self._queued.append((message, new))
+        else:
+            self._handle(message, new)
+
+    def _handle(self, message, new):
+        channel_key = utils.get_peer_id(message.peer_id)
+        if channel_key not in self._channels:
+            return
+        if self._append(channel_key, message, new):
+            self.stats["new" if new else "edited"] += 1
+
+    def flush(self):
+        """Пишет накопленные записи в sink и сдвигает контрольные точки каналов."""
+        buffers, self._buffers, self._buffered = self._buffers, {}, 0
+        for channel_key, buffer in buffers.items():
+            link, resolved = self._channels[channel_key]
+            self.sink.write(link, resolved.title, buffer)
+            self.stats["written"] += len(buffer)
+        # Точка не должна обгонять то, что уже на диске: сохраняем после записи
+        for channel_key in buffers:
+            resolved = self._channels[channel_key][1]
+            last_id = self._last_ids.get(resolved.id)
+            if last_id is not None:
+                self.state.save(resolved.id, last_id, last_id, True)
+
+    async def _flush_loop(self):
+        interval = self.options.get("live_flush_interval", LIVE_FLUSH_INTERVAL)
+        while True:
+            await asyncio.sleep(interval)
+            if self._buffered:
+                self.flush()
+
+    async def catch_up(self):
+        """
+        Докачивает сообщения, вышедшие, пока клиента не было на связи: история канала
+        от последнего принятого id вперёд (min_id), обычно одна страница на канал.
+        Канал без контрольной точки получает её по последнему сообщению — прошлое не выгружается.
+        """
+        limit = self.options.get("live_catch_up_limit", CATCH_UP_LIMIT)
+
+        async def catch_up_channel(channel_key, link, resolved):
+            entity = resolved.input_peer()
+            last_id = self._last_ids.get(resolved.id)
+            if last_id is None:
+                checkpoint = self.state.get(resolved.id)
+                if checkpoint is None:
+                    latest = await self.scheduler.call("history", self.client.get_messages, entity, limit=1)
+                    last_id = latest[0].id if latest else 0
+                    self._last_ids[resolved.id] = last_id
+                    self.state.save(resolved.id, last_id, last_id, True)
+                    return
+                last_id = checkpoint["max_id"]
+                self._last_ids[resolved.id] = last_id
+            count = 0
+            async for message in self.scheduler.iter_messages(
+                self.client, entity, limit=limit, min_id=last_id, reverse=True
+            ):
+                if self._append(channel_key, message):
+                    count += 1
+            if count:
+                self.stats["caught_up"] += count
+                self.log(f"↩️ Докачано после перерыва: {count} сообщений: {link}")
+                if count >= limit:
+                    self.log(f"⚠️ Пропуск больше {limit} сообщений, часть не докачана: {link}")
+
+        self._catching_up = True
+        try:
+            # Темп запросов задаёт планировщик ("history")
+            await asyncio.gather(
+                *(catch_up_channel(key, link, resolved) for key, (link, resolved) in self._channels.items())
+            )
+        finally:
+            self._catching_up = False
+            queued, self._queued = self._queued, []
+            for message, new in queued:
+                self._handle(message, new)
+
+    async def _connect(self):
+        """Подключение и докачка пропуска; False — связи нет, нужна повторная попытка."""
+        try:
+            if not self.client.is_connected():
+                await self.client.connect()
+                # Любой запрос верхнего уровня сообщает Telegram, что клиенту нужны обновления
+                await self.client.get_me()
+            await self.catch_up()
+            return True
+        except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+            self.log(f"⚠️ Нет связи: {e or type(e).__name__}")
+            return False
+
+    async def run(self, stop=None):
+        """
+        Слушает события, пока не установлен stop (asyncio.Event) или задачу не отменят.
+        Обрыв связи не завершает наблюдение: клиент переподключается с паузами
+        RECONNECT_DELAYS и докачивает пропуск.
+        """
+        stop = stop or asyncio.Event()
+        chats = [resolved.input_peer() for _, resolved in self._channels.values()]
+        new_messages = events.NewMessage(chats=chats)
+        edits = events.MessageEdited(chats=chats)
+        self.client.add_event_handler(self._on_new, new_messages)
+        self.client.add_event_handler(self._on_edit, edits)
+        flusher = asyncio.create_task(self._flush_loop())
+        stopping = asyncio.create_task(stop.wait())
+        failures = 0
+        try:
+            while not stop.is_set():
+                if not await self._connect():
+                    delay = RECONNECT_DELAYS[min(failures, len(RECONNECT_DELAYS) - 1)]
+                    failures += 1
+                    await asyncio.wait({stopping}, timeout=delay)
+                    continue
+                if failures or self.stats["reconnects"]:
+                    self.log("🔌 Связь восстановлена")
+                failures = 0
+                disconnected = asyncio.ensure_future(self.client.disconnected)
+                await asyncio.wait({disconnected, stopping}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    # Ошибка обрыва уже учтена: дальше — переподключение
+                    if not disconnected.cancelled():
+                        disconnected.exception()
+                    if not stop.is_set():
+                        self.stats["reconnects"] += 1
+                        self.log("⚠️ Связь потеряна, переподключение…")
+                else:
+                    disconnected.cancel()
+        finally:
+            flusher.cancel()
+            stopping.cancel()
+            self.client.remove_event_handler(self._on_new, new_messages)
+            self.client.remove_event_handler(self._on_edit, edits)
+            self.flush()
+        return self.stats
+
+
+async def run_live(api_id, api_hash, session_string, links, options, log_callback, stop=None):
+    """
+    Подключается, разрешает ссылки (через кэш, как run_scraping) и наблюдает за каналами,
+    пока не установлен stop или задачу не отменят. Записи идут в options["stream_path"]
+    в формате options["stream_format"]. Возвращает LiveMonitor.stats или None при ошибке.
+    """
+    client = None
+    state = None
+    entity_cache = None
+    sink = None
+    try:
+        api_id = int(api_id.strip())
+        # Переподключается LiveMonitor: так обрыв виден и пропуск докачивается
+        client = TelegramClient(
+            StringSession(session_string.strip()),
+            api_id,
+            api_hash.strip(),
+            auto_reconnect=False,
+        )
+        await client.connect()
+        if not await client.is_user_authorized():
+            log_callback("❌ Сессия не авторизована.")
+            return None
+        me = await client.get_me()
+        client.flood_sleep_threshold = 0
+        scheduler = get_scheduler(f"user:{me.id}", options.get("rate_limits"))
+        if options.get("entity_cache", True):
+            entity_cache = EntityCache(options.get("entity_cache_path") or DEFAULT_ENTITY_CACHE_PATH, scope=me.id)
+        resolved, unresolved = await resolve_links(client, links, entity_cache, log_callback, scheduler)
+        for link, reason in unresolved:
+            log_callback(f"❌ Канал не найден: {link} ({reason})")
+        channels = [(link, resolved[link]) for link in dedupe_links(links) if link in resolved]
+        if not channels:
+            log_callback("❌ Ни одна ссылка не разрешилась.")
+            return None
+        if options.get("live_join"):
+            # Telegram присылает события только каналов, на которые аккаунт подписан
+            for link, entity in channels:
+                if entity.kind != "channel":
+                    continue
+                try:
+                    await scheduler.call("default", client, JoinChannelRequest(entity.input_peer()))
+                except FloodWaitError as e:
+                    log_callback(f"⚠️ Не удалось подписаться ({e.seconds} с FloodWait): {link}")
+                except Exception as e:
+                    log_callback(f"⚠️ Не удалось подписаться: {link} ({e})")
+        state = CheckpointStore(options.get("checkpoint_path") or DEFAULT_CHECKPOINT_PATH, scope=live_scope(me.id))
+        # Дозапись: контрольные точки считают записанным всё, что уже есть в файле прошлых запусков
+        sink = open_sink(options["stream_format"], options["stream_path"], append=True)
+        monitor = LiveMonitor(client, channels, sink, state, scheduler, options, log_callback)
+        log_callback(f"📡 Наблюдение за каналами: {len(channels)}")
+        started = time.perf_counter()
+        stats = await monitor.run(stop)
+        log_callback(
+            f"✅ Наблюдение остановлено через {time.perf_counter() - started:.0f} с: новых {stats['new']}, "
+            f"правок {stats['edited']}, докачано {stats['caught_up']}"
+        )
+        return stats
+    except ValueError:
+        log_callback("❌ API_ID должен быть числом.")
+        return None
+    except Exception as e:
+        log_callback(f"❌ Ошибка: {e}")
+        return None
+    finally:
+        if sink:
+            sink.close()
+        if state:
+            state.close()
+        if entity_cache:
+            entity_cache.close()
+        if client:
+            await client.disconnect()
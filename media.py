@@ -0,0 +1,468 @@
+"""
+Скачивание медиа сообщений — отдельный этап рядом со scrape_channel.
+Сбор текста только ставит сообщения в очередь; файлы качают несколько фоновых задач
+через свой класс запросов планировщика ("media"), так что большие видео и FloodWait
+на скачивании не тормозят чтение истории. Файлы лежат по хэшу содержимого
+(data/media/ab/abcdef….jpg): одно и то же медиа из разных каналов и запусков хранится
+один раз. Что скачано, на какой файл ссылается сообщение и что ещё в очереди — в SQLite,
+поэтому прерванный запуск докачивает с места остановки (и недокачанный файл — с последнего куска).
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+import uuid
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Photo
+
+from checkpoints import DATA_DIR
+from raw_history import media_type
+
+MEDIA_DIR = os.path.join(DATA_DIR, "media")
+DEFAULT_MEDIA_DB = os.path.join(MEDIA_DIR, "media.sqlite3")
+# Типы медиа с файлами (см. scraper.get_media_type: аудио, стикеры и GIF — это "document")
+DOWNLOADABLE_TYPES = ("photo", "video", "voice", "document")
+DEFAULT_MEDIA_CONCURRENCY = 3
+MAX_MEDIA_CONCURRENCY = 10
+# Сообщений в одном запросе get_messages (столько принимает channels.GetMessages)
+LOOKUP_BATCH = 100
+# Размер запроса upload.GetFile; недокачанный файл продолжается с границы куска
+DOWNLOAD_CHUNK = 512 * 1024
+# Столько неудачных попыток на сообщение, дальше оно не ставится в очередь
+MAX_ATTEMPTS = 3
+# Отметка «файл качается» без обновления дольше этого считается брошенной (процесс упал), секунды
+CLAIM_STALE = 120
+# Как часто качающий процесс обновляет отметку и как часто остальные проверяют, готов ли файл, секунды
+CLAIM_HEARTBEAT = 30
+CLAIM_POLL = 2
+
+
+def media_info(message):
+    """
+    Медиа сообщения (TL-объект из get_messages) как dict: key — id файла в Telegram
+    (у пересланного медиа тот же), type, size, mime_type, ext и target для iter_download.
+    None — сообщения нет или скачивать нечего.
+    """
+    if message is None:
+        return None
+    kind = media_type(message)
+    target = message.photo or message.document
+    if kind not in DOWNLOADABLE_TYPES or target is None:
+        return None
+    file = message.file
+    try:
+        size = file.size
+    except Exception:
+        size = None
+    return {
+        "key": f"{'photo' if isinstance(target, Photo) else 'document'}_{target.id}",
+        "type": kind,
+        "size": size,
+        "mime_type": file.mime_type,
+        "ext": file.ext or "",
+        "target": target,
+    }
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaStore:
+    """
+    Хранилище скачанных медиа. files — файлы по sha256 содержимого (path — относительно
+    directory); media_keys — id файла в Telegram → sha256, чтобы уже скачанное медиа
+    не запрашивать повторно; message_media — медиа сообщений: status "pending" (в очереди
+    или не докачано) или "done" со ссылкой на файл; downloads — кто сейчас качает медиа:
+    .part-файл общий для всех процессов-воркеров, и писать в него может только один.
+    id каналов и файлов общие для всех аккаунтов, поэтому scope здесь не нужен.
+    """
+
+    def __init__(self, path=DEFAULT_MEDIA_DB, directory=MEDIA_DIR):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "tmp"), exist_ok=True)
+        db_directory = os.path.dirname(path)
+        if db_directory:
+            os.makedirs(db_directory, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Коммит на каждый файл: в WAL без fsync на коммите это дёшево, а база переживает падение процесса
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                sha256 TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mime_type TEXT,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS media_keys (
+                media_key TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS message_media (
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                sha256 TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (channel_id, message_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS downloads (
+                media_key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                heartbeat REAL NOT NULL
+            ) WITHOUT ROWID;
+            """
+        )
+        self._conn.commit()
+
+    def _fetch(self, sql, ids, *params):
+        """Строки запроса sql с IN ({}) по списку ids — частями, чтобы не упереться в лимит параметров."""
+        rows = []
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            rows.extend(self._conn.execute(sql.format(", ".join("?" * len(part))), (*params, *part)))
+        return rows
+
+    def queue(self, channel_id, message_ids):
+        """
+        Ставит в очередь сообщения, которых ещё нет в хранилище; возвращает их id.
+        Новые строки определяет сам INSERT OR IGNORE: если тот же канал ставит в очередь
+        другой процесс, каждое сообщение достаётся ровно одному из них.
+        """
+        new_ids = []
+        now = time.time()
+        with self._conn:
+            for message_id in dict.fromkeys(message_ids):
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO message_media (channel_id, message_id, status, updated_at)"
+                    " VALUES (?, ?, 'pending', ?)",
+                    (channel_id, message_id, now),
+                )
+                if cursor.rowcount == 1:
+                    new_ids.append(message_id)
+        return new_ids
+
+    def pending(self, channel_id):
+        """id сообщений канала, медиа которых осталось от прошлых запусков."""
+        return [
+            row[0] for row in self._conn.execute(
+                "SELECT message_id FROM message_media WHERE channel_id = ? AND status = 'pending' AND attempts < ?"
+                " ORDER BY message_id",
+                (channel_id, MAX_ATTEMPTS),
+            )
+        ]
+
+    def file_for_key(self, media_key):
+        """sha256 уже скачанного файла с этим id в Telegram или None."""
+        row = self._conn.execute("SELECT sha256 FROM media_keys WHERE media_key = ?", (media_key,)).fetchone()
+        return row[0] if row else None
+
+    def partial_path(self, media_key):
+        """Куда качается файл, пока не готов (писать в него можно, только заняв media_key через claim)."""
+        return os.path.join(self.directory, "tmp", f"{media_key}.part")
+
+    def claim(self, media_key, owner):
+        """
+        Занимает скачивание media_key для owner. False — медиа качает другой владелец
+        и его отметка обновлялась не раньше CLAIM_STALE секунд назад. Брошенная отметка
+        перехватывается: новый владелец докачивает тот же .part-файл.
+        """
+        now = time.time()
+        with self._conn:
+            # INSERT берёт блокировку записи: проверка и захват — одна транзакция для всех процессов
+            self._conn.execute(
+                "INSERT OR IGNORE INTO downloads (media_key, owner, heartbeat) VALUES (?, ?, ?)", (media_key, owner, now)
+            )
+            claimed = self._conn.execute(
+                "UPDATE downloads SET owner = ?, heartbeat = ? WHERE media_key = ? AND (owner = ? OR heartbeat < ?)",
+                (owner, now, media_key, owner, now - CLAIM_STALE),
+            ).rowcount
+        return claimed == 1
+
+    def heartbeat(self, media_key, owner):
+        """Обновляет отметку владельца: скачивание ещё идёт."""
+        with self._conn:
+            self._conn.execute(
+                "UPDATE downloads SET heartbeat = ? WHERE media_key = ? AND owner = ?", (time.time(), media_key, owner)
+            )
+
+    def release(self, media_key, owner):
+        with self._conn:
+            self._conn.execute("DELETE FROM downloads WHERE media_key = ? AND owner = ?", (media_key, owner))
+
+    def add_file(self, media_key, partial_path, sha256, mime_type, ext):
+        """
+        Переносит докачанный файл на место по хэшу содержимого sha256 (если такой файл уже
+        есть — копия удаляется) и запоминает id файла в Telegram.
+        """
+        if self._conn.execute("SELECT 1 FROM files WHERE sha256 = ?", (sha256,)).fetchone():
+            os.remove(partial_path)
+        else:
+            relative_path = f"{sha256[:2]}/{sha256}{ext}"
+            target = os.path.join(self.directory, relative_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(partial_path, target)
+            # Тот же файл мог одновременно прийти под другим id из другого процесса
+            self._conn.execute(
+                "INSERT OR IGNORE INTO files (sha256, path, size, mime_type, created_at) VALUES (?, ?, ?, ?, ?)",
+                (sha256, relative_path, os.path.getsize(target), mime_type, time.time()),
+            )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO media_keys (media_key, sha256) VALUES (?, ?)", (media_key, sha256)
+        )
+        self._conn.commit()
+
+    def link(self, channel_id, message_id, sha256):
+        self._conn.execute(
+            "UPDATE message_media SET status = 'done', sha256 = ?, updated_at = ? WHERE channel_id = ? AND message_id = ?",
+            (sha256, time.time(), channel_id, message_id),
+        )
+        self._conn.commit()
+
+    def fail(self, channel_id, message_id):
+        self._conn.execute(
+            "UPDATE message_media SET attempts = attempts + 1, updated_at = ? WHERE channel_id = ? AND message_id = ?",
+            (time.time(), channel_id, message_id),
+        )
+        self._conn.commit()
+
+    def drop(self, channel_id, message_id):
+        """Убирает сообщение из очереди: файла нет или он не прошёл фильтры."""
+        self._conn.execute(
+            "DELETE FROM message_media WHERE channel_id = ? AND message_id = ?", (channel_id, message_id)
+        )
+        self._conn.commit()
+
+    def files(self, channel_id, message_ids):
+        """Скачанные файлы сообщений: message_id → путь относительно directory."""
+        return dict(self._fetch(
+            "SELECT m.message_id, f.path FROM message_media m JOIN files f ON f.sha256 = m.sha256"
+            " WHERE m.channel_id = ? AND m.status = 'done' AND m.message_id IN ({})",
+            list(message_ids),
+            channel_id,
+        ))
+
+    def attach(self, channel_id, messages):
+        """Проставляет ссылки на скачанные файлы в MessageBuffer; возвращает, сколько нашлось."""
+        files = self.files(channel_id, messages.ids)
+        if files:
+            for i, message_id in enumerate(messages.ids):
+                path = files.get(message_id)
+                if path:
+                    messages.media_files[i] = path
+        return len(files)
+
+    def close(self):
+        self._conn.close()
+
+
+class MediaDownloader:
+    """
+    Очередь скачивания для одного запуска. scrape_channel вызывает add() на каждое сообщение
+    с медиа нужного типа; сообщения копятся пачками по LOOKUP_BATCH, пачка перечитывается
+    через get_messages (file_reference свежий), и файлы качаются не больше чем в concurrency
+    задач сразу. Файлы больше max_size байт пропускаются. close() дожидается очереди.
+    """
+
+    def __init__(self, store, options=None, log_callback=None):
+        options = options or {}
+        self.store = store
+        self.media_types = set(options.get("media_types") or DOWNLOADABLE_TYPES)
+        self.max_size = options.get("media_max_size")
+        self.concurrency = max(1, min(options.get("media_concurrency") or DEFAULT_MEDIA_CONCURRENCY,
+                                      MAX_MEDIA_CONCURRENCY))
+        self.log = log_callback or (lambda msg: None)
+        self.stats = {"queued": 0, "downloaded": 0, "reused": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        self._batches = {}
+        self._queue = None
+        self._workers = []
+        self._inflight = {}
+        # Владелец отметок downloads: уникален для процесса и запуска
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+
+    def wants(self, media_type):
+        return media_type in self.media_types
+
+    def add(self, client, scheduler, entity, channel_id, message_id):
+        """Добавляет сообщение в очередь канала (без запросов к API)."""
+        batch = self._batches.setdefault(channel_id, (client, scheduler, entity, []))
+        batch[3].append(message_id)
+        if len(batch[3]) >= LOOKUP_BATCH:
+            self.flush(channel_id)
+
+    def resume(self, client, scheduler, entity, channel_id):
+        """Ставит в очередь недокачанное в прошлых запусках; возвращает, сколько сообщений."""
+        message_ids = self.store.pending(channel_id)
+        for start in range(0, len(message_ids), LOOKUP_BATCH):
+            self._submit(channel_id, client, scheduler, entity, message_ids[start:start + LOOKUP_BATCH])
+        return len(message_ids)
+
+    def flush(self, channel_id=None):
+        """Отдаёт воркерам накопленные пачки канала (или всех каналов)."""
+        for key in [channel_id] if channel_id is not None else list(self._batches):
+            batch = self._batches.pop(key, None)
+            if batch:
+                client, scheduler, entity, message_ids = batch
+                # Уже скачанное, недокачанное (его ставит resume) и исчерпавшее попытки не повторяется
+                message_ids = self.store.queue(key, message_ids)
+                if message_ids:
+                    self._submit(key, client, scheduler, entity, message_ids)
+
+    def _submit(self, channel_id, client, scheduler, entity, message_ids):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+        self.stats["queued"] += len(message_ids)
+        self._queue.put_nowait(("lookup", channel_id, client, scheduler, entity, message_ids))
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job[0] == "lookup":
+                    await self._lookup(*job[1:])
+                else:
+                    await self._download(*job[1:])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(f"⚠️ Медиа: {e or type(e).__name__}")
+            finally:
+                self._queue.task_done()
+
+    async def _lookup(self, channel_id, client, scheduler, entity, message_ids):
+        try:
+            messages = await scheduler.call("media", client.get_messages, entity, ids=message_ids)
+        except Exception:
+            for message_id in message_ids:
+                self.store.fail(channel_id, message_id)
+            self.stats["failed"] += len(message_ids)
+            return
+        for message_id, message in zip(message_ids, messages):
+            info = media_info(message)
+            if info is None or info["type"] not in self.media_types:
+                self.store.drop(channel_id, message_id)
+                self.stats["skipped"] += 1
+            elif self.max_size and info["size"] and info["size"] > self.max_size:
+                self.store.drop(channel_id, message_id)
+                self.stats["skipped"] += 1
+            else:
+                self._queue.put_nowait(("file", channel_id, message_id, client, scheduler, info))
+
+    async def _download(self, channel_id, message_id, client, scheduler, info):
+        key = info["key"]
+        sha256 = self.store.file_for_key(key)
+        if sha256 is not None:
+            self.stats["reused"] += 1
+        elif key in self._inflight:
+            # То же медиа уже качается для другого сообщения (репост) — ждём его
+            sha256 = await asyncio.shield(self._inflight[key])
+            self.stats["reused" if sha256 else "failed"] += 1
+        else:
+            future = self._inflight[key] = asyncio.get_running_loop().create_future()
+            try:
+                sha256, downloaded = await self._fetch_exclusive(client, scheduler, info)
+                self.stats["downloaded" if downloaded else "reused"] += 1
+            except Exception:
+                self.stats["failed"] += 1
+            finally:
+                future.set_result(sha256)
+                del self._inflight[key]
+        if sha256 is None:
+            self.store.fail(channel_id, message_id)
+        else:
+            self.store.link(channel_id, message_id, sha256)
+
+    async def _fetch_exclusive(self, client, scheduler, info):
+        """
+        Скачивание под отметкой в базе: одно медиа в один момент качает один процесс,
+        остальные ждут его файл. Возвращает (sha256, скачано ли здесь).
+        """
+        key = info["key"]
+        while not self.store.claim(key, self.owner):
+            await asyncio.sleep(CLAIM_POLL)
+            sha256 = self.store.file_for_key(key)
+            if sha256 is not None:
+                return sha256, False
+
+        async def keep_claim():
+            while True:
+                await asyncio.sleep(CLAIM_HEARTBEAT)
+                self.store.heartbeat(key, self.owner)
+
+        keeper = asyncio.ensure_future(keep_claim())
+        try:
+            # Пока ждали отметку, файл мог докачать другой процесс
+            sha256 = self.store.file_for_key(key)
+            if sha256 is not None:
+                return sha256, False
+            return await self._fetch(client, scheduler, info), True
+        finally:
+            keeper.cancel()
+            self.store.release(key, self.owner)
+
+    async def _fetch(self, client, scheduler, info):
+        """Качает файл в .part кусками по DOWNLOAD_CHUNK, после FloodWait — с того же куска."""
+        partial_path = self.store.partial_path(info["key"])
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        offset -= offset % DOWNLOAD_CHUNK
+        while True:
+            await scheduler.acquire("media")
+            try:
+                with open(partial_path, "r+b" if offset else "wb") as f:
+                    f.truncate(offset)
+                    f.seek(offset)
+                    async for chunk in client.iter_download(info["target"], offset=offset, request_size=DOWNLOAD_CHUNK):
+                        f.write(chunk)
+                        offset += len(chunk)
+                        self.stats["bytes"] += len(chunk)
+                break
+            except FloodWaitError as e:
+                scheduler.pause("media", e.seconds)
+                offset -= offset % DOWNLOAD_CHUNK
+        # Хэш большого файла считается в потоке, чтобы не останавливать цикл событий
+        sha256 = await asyncio.to_thread(file_sha256, partial_path)
+        self.store.add_file(info["key"], partial_path, sha256, info["mime_type"], info["ext"])
+        return sha256
+
+    async def finish(self, results):
+        """
+        Ждёт очередь скачивания и проставляет ссылки на файлы в сообщения results.
+        В потоковую выгрузку попадают только файлы, готовые к моменту записи пачки.
+        """
+        if self._batches or self._queue is not None:
+            self.log("📥 Докачиваем медиа…")
+        await self.close()
+        for ch in results:
+            self.store.attach(ch["channel_id"], ch["messages"])
+        s = self.stats
+        self.log(
+            f"📥 Медиа: скачано файлов {s['downloaded']} ({s['bytes'] / 2 ** 20:.1f} МБ), "
+            f"уже были {s['reused']}, пропущено {s['skipped']}, ошибок {s['failed']}"
+        )
+
+    async def close(self):
+        """Отдаёт оставшиеся пачки и ждёт, пока всё скачается."""
+        self.flush()
+        if self._queue is not None:
+            await self._queue.join()
+        await self.cancel()
+
+    async def cancel(self):
+        """Останавливает воркеры; недокачанное остаётся в очереди хранилища до следующего запуска."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
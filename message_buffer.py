@@ -0,0 +1,252 @@
+"""
+Компактное колоночное хранение сообщений канала.
+Вместо dict на каждое сообщение — типизированные массивы по колонкам,
+media_type и эмодзи реакций хранятся кодами, ссылки строятся только при экспорте.
+"""
+from array import array
+from datetime import datetime, timezone
+
+# Значение «нет данных» в целочисленных колонках
+NULL = -(2 ** 63)
+MEDIA_TYPES = ("none", "photo", "video", "voice", "document", "audio", "sticker", "gif", "poll")
+_MEDIA_CODES = {name: code for code, name in enumerate(MEDIA_TYPES)}
+# Поля записи сообщения в порядке, в котором их отдаёт scrape_channel
+RECORD_FIELDS = (
+    "id",
+    "date",
+    "date_unixtime",
+    "text",
+    "views",
+    "forwards",
+    "media_type",
+    "reactions",
+    "reply_to_msg_id",
+    "replies",
+    "url",
+    "media_file",
+)
+
+
+def _nullable(value):
+    return NULL if value is None else value
+
+
+def _value(value):
+    return None if value == NULL else value
+
+
+def iso_from_unixtime(ts):
+    """ISO-дата в том же виде, что message.date.isoformat() у Telethon (UTC)."""
+    if ts is None or ts == NULL:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class MessageBuffer:
+    """
+    Сообщения одного канала в колоночном виде.
+    Реакции хранятся как CSR: reaction_offsets[i]..reaction_offsets[i + 1] —
+    диапазон реакций i-го сообщения в reaction_emoji / reaction_counts.
+    media_files — номер сообщения → путь скачанного медиа (только у сообщений с файлом).
+    """
+
+    def __init__(self, channel_username=""):
+        self.channel_username = (channel_username or "").lstrip("@")
+        self.ids = array("q")
+        self.date_unixtime = array("q")
+        self.views = array("q")
+        self.forwards = array("q")
+        self.reply_to = array("q")
+        self.replies = array("q")
+        self.media = array("B")
+        self.texts = []
+        self.reaction_offsets = array("Q", [0])
+        self.reaction_emoji = array("H")
+        self.reaction_counts = array("q")
+        self._emoji = []
+        self._emoji_codes = {}
+        self.media_files = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def append(self, message_id, date_unixtime, text, views, forwards, media_type, reactions, reply_to_msg_id,
+               replies=None, media_file=None):
+        if media_file:
+            self.media_files[len(self.ids)] = media_file
+        self.ids.append(message_id)
+        self.date_unixtime.append(_nullable(date_unixtime))
+        self.texts.append(text or "")
+        self.views.append(_nullable(views))
+        self.forwards.append(_nullable(forwards))
+        self.media.append(_MEDIA_CODES.get(media_type, 0))
+        self.reply_to.append(_nullable(reply_to_msg_id))
+        self.replies.append(_nullable(replies))
+        for reaction in reactions or ():
+            emoji = reaction["emoji"]
+            code = self._emoji_codes.get(emoji)
+            if code is None:
+                code = self._emoji_codes[emoji] = len(self._emoji)
+                self._emoji.append(emoji)
+            self.reaction_emoji.append(code)
+            self.reaction_counts.append(reaction["count"])
+        self.reaction_offsets.append(len(self.reaction_emoji))
+
+    def extend(self, other, start=0, stop=None):
+        """Дописывает сообщения other[start:stop]."""
+        stop = len(other) if stop is None else min(stop, len(other))
+        for i in range(start, stop):
+            self.append(
+                other.ids[i],
+                _value(other.date_unixtime[i]),
+                other.texts[i],
+                _value(other.views[i]),
+                _value(other.forwards[i]),
+                MEDIA_TYPES[other.media[i]],
+                other.reactions_at(i),
+                _value(other.reply_to[i]),
+                _value(other.replies[i]),
+                other.media_files.get(i),
+            )
+
+    def slice(self, start=0, stop=None):
+        part = type(self)(self.channel_username)
+        part.extend(self, start, stop)
+        return part
+
+    def take(self, indices):
+        """Новый буфер из сообщений с номерами indices (в их порядке)."""
+        part = type(self)(self.channel_username)
+        for i in indices:
+            part.extend(self, i, i + 1)
+        return part
+
+    @property
+    def emoji_table(self):
+        """Список эмодзи: reaction_emoji хранит индексы в нём."""
+        return self._emoji
+
+    def reactions_at(self, i):
+        lo, hi = self.reaction_offsets[i], self.reaction_offsets[i + 1]
+        return [
+            {"emoji": self._emoji[self.reaction_emoji[j]], "count": self.reaction_counts[j]}
+            for j in range(lo, hi)
+        ]
+
+    def url_at(self, i):
+        return f"https://t.me/{self.channel_username}/{self.ids[i]}"
+
+    def record(self, i):
+        """Сообщение в виде dict — тот же формат, что раньше отдавал scrape_channel."""
+        ts = _value(self.date_unixtime[i])
+        return {
+            "id": self.ids[i],
+            "date": iso_from_unixtime(ts),
+            "date_unixtime": ts,
+            "text": self.texts[i],
+            "views": _value(self.views[i]),
+            "forwards": _value(self.forwards[i]),
+            "media_type": MEDIA_TYPES[self.media[i]],
+            "reactions": self.reactions_at(i),
+            "reply_to_msg_id": _value(self.reply_to[i]),
+            "replies": _value(self.replies[i]),
+            "url": self.url_at(i),
+            "media_file": self.media_files.get(i),
+        }
+
+    def iter_records(self, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop):
+            yield self.record(i)
+
+    def to_frame(self, start=0, stop=None):
+        """
+        DataFrame по колонкам без промежуточных dict: id, date, date_unixtime, text,
+        views, forwards, media_type, reply_to_msg_id, replies, url, media_file. Пустые значения — pd.NA
+        (у media_file — None).
+        """
+        import numpy as np
+        import pandas as pd
+
+        stop = len(self) if stop is None else min(stop, len(self))
+
+        def nullable_column(values):
+            data = np.frombuffer(values, dtype=np.int64)[start:stop]
+            return pd.arrays.IntegerArray(data.copy(), data == NULL)
+
+        ids = np.frombuffer(self.ids, dtype=np.int64)[start:stop]
+        unixtime = nullable_column(self.date_unixtime)
+        dates = pd.to_datetime(pd.Series(unixtime, dtype="Int64"), unit="s", utc=True)
+        id_strings = pd.Series(ids).astype(str)
+        media_files = [None] * len(ids)
+        for i, path in self.media_files.items():
+            if start <= i < stop:
+                media_files[i - start] = path
+        return pd.DataFrame({
+            "id": ids,
+            "date": dates.dt.strftime("%Y-%m-%dT%H:%M:%S+00:00").astype(object).where(dates.notna(), None),
+            "date_unixtime": unixtime,
+            "text": self.texts[start:stop],
+            "views": nullable_column(self.views),
+            "forwards": nullable_column(self.forwards),
+            "media_type": pd.Categorical.from_codes(
+                np.frombuffer(self.media, dtype=np.uint8)[start:stop], categories=list(MEDIA_TYPES)
+            ),
+            "reply_to_msg_id": nullable_column(self.reply_to),
+            "replies": nullable_column(self.replies),
+            "url": f"https://t.me/{self.channel_username}/" + id_strings,
+            "media_file": media_files,
+        })
+
+    def nbytes(self):
+        """Примерный объём данных в памяти (массивы + строки текста)."""
+        arrays = (
+            self.ids, self.date_unixtime, self.views, self.forwards, self.reply_to, self.replies, self.media,
+            self.reaction_offsets, self.reaction_emoji, self.reaction_counts,
+        )
+        size = sum(a.itemsize * len(a) for a in arrays)
+        return size + sum(len(t.encode("utf-8")) for t in self.texts)
+
+
+class CommentBuffer(MessageBuffer):
+    """
+    Комментарии к постам канала (из группы обсуждения) в том же колоночном виде.
+    post_ids[i] — id поста канала, к которому относится комментарий; ссылка ведёт
+    в тред поста (t.me/<канал>/<пост>?comment=<id>).
+    """
+
+    def __init__(self, channel_username=""):
+        super().__init__(channel_username)
+        self.post_ids = array("q")
+
+    def add(self, post_id, *fields, **kwargs):
+        """Комментарий к посту post_id; fields и kwargs — как у MessageBuffer.append."""
+        self.post_ids.append(post_id)
+        self.append(*fields, **kwargs)
+
+    def extend(self, other, start=0, stop=None):
+        stop = len(other) if stop is None else min(stop, len(other))
+        self.post_ids.extend(other.post_ids[start:stop])
+        super().extend(other, start, stop)
+
+    def url_at(self, i):
+        return f"https://t.me/{self.channel_username}/{self.post_ids[i]}?comment={self.ids[i]}"
+
+    def record(self, i):
+        return {**super().record(i), "post_id": self.post_ids[i]}
+
+    def to_frame(self, start=0, stop=None):
+        """Как MessageBuffer.to_frame, плюс колонка post_id; url — ссылка на комментарий."""
+        import numpy as np
+        import pandas as pd
+
+        frame = super().to_frame(start, stop)
+        post_ids = pd.Series(np.frombuffer(self.post_ids, dtype=np.int64)[start:stop])
+        frame["post_id"] = post_ids
+        frame["url"] = (
+            f"https://t.me/{self.channel_username}/" + post_ids.astype(str) + "?comment=" + frame["id"].astype(str)
+        )
+        return frame
@@ -0,0 +1,259 @@
+"""
+Метрики скрапинга: время по этапам, запросы к API, страницы, FloodWait и объём выгрузки.
+ScrapeMetrics собирает их по одной задаче; итоги задач копятся в счётчиках процесса
+и пишутся в файл формата Prometheus (textfile). Отдать их по HTTP:
+    python metrics.py serve --port 9108
+"""
+import argparse
+import glob
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from checkpoints import DATA_DIR
+
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+PREFIX = "tgscraper"
+DEFAULT_METRICS_PORT = 9108
+
+
+class ScrapeMetrics:
+    """
+    Метрики одной задачи. Этапы задачи (connect, resolve, scrape, export) — время по часам;
+    по каналам — собственное время канала, сообщения и страницы (каналы идут параллельно,
+    поэтому сумма времени каналов больше длительности этапа scrape).
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.phase_seconds = {}
+        self.channels = {}
+        self.failed_channels = 0
+        self.api_requests = {}
+        self.flood_waits = {}
+        self.flood_wait_seconds = {}
+        self.export_bytes = 0
+        self.media = {}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started)
+
+    def add_phase(self, name, seconds):
+        self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + seconds
+
+    def record_channel(self, link, messages, pages, seconds, sink_seconds=0.0):
+        self.channels[link] = {
+            "messages": messages,
+            "pages": pages,
+            "seconds": seconds,
+            "sink_seconds": sink_seconds,
+        }
+
+    def record_failed_channel(self):
+        self.failed_channels += 1
+
+    def add_scheduler_stats(self, before, after):
+        """Добавляет разницу двух RequestScheduler.stats(): планировщик общий на аккаунт, а не на задачу."""
+        targets = {
+            "requests": self.api_requests,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+        }
+        for key, target in targets.items():
+            for kind, value in after[key].items():
+                delta = value - before[key].get(kind, 0)
+                if delta:
+                    target[kind] = target.get(kind, 0) + delta
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+
+    @property
+    def messages(self):
+        return sum(ch["messages"] for ch in self.channels.values())
+
+    @property
+    def pages(self):
+        return sum(ch["pages"] for ch in self.channels.values())
+
+    def summary(self):
+        """Итоги задачи в виде dict (сериализуется в JSON)."""
+        duration = self.duration if self.duration is not None else time.perf_counter() - self._started
+        scrape_seconds = self.phase_seconds.get("scrape") or duration
+        return {
+            "started_at": self.started_at,
+            "duration": duration,
+            "messages": self.messages,
+            "messages_per_sec": self.messages / scrape_seconds if scrape_seconds else 0.0,
+            "pages": self.pages,
+            "channels": len(self.channels),
+            "failed_channels": self.failed_channels,
+            "phase_seconds": dict(self.phase_seconds),
+            "api_requests": dict(self.api_requests),
+            "flood_waits": dict(self.flood_waits),
+            "flood_wait_seconds": dict(self.flood_wait_seconds),
+            "export_bytes": self.export_bytes,
+            "media": dict(self.media),
+            "per_channel": {
+                link: {**ch, "messages_per_sec": ch["messages"] / ch["seconds"] if ch["seconds"] else 0.0}
+                for link, ch in self.channels.items()
+            },
+        }
+
+
+# ——— Счётчики процесса (сумма по всем задачам) ———
+_totals_lock = threading.Lock()
+_totals = {
+    "jobs": {},
+    "messages": 0,
+    "pages": 0,
+    "channels_failed": 0,
+    "api_requests": {},
+    "flood_waits": {},
+    "flood_wait_seconds": {},
+    "phase_seconds": {},
+    "export_bytes": 0,
+    "last_job": None,
+}
+
+
+def _add(target, values):
+    for key, value in values.items():
+        target[key] = target.get(key, 0) + value
+
+
+def record_job(summary, status):
+    """Добавляет итоги задачи к счётчикам процесса."""
+    with _totals_lock:
+        _totals["jobs"][status] = _totals["jobs"].get(status, 0) + 1
+        if summary is None:
+            return
+        _totals["messages"] += summary["messages"]
+        _totals["pages"] += summary["pages"]
+        _totals["channels_failed"] += summary["failed_channels"]
+        _totals["export_bytes"] += summary["export_bytes"]
+        _add(_totals["api_requests"], summary["api_requests"])
+        _add(_totals["flood_waits"], summary["flood_waits"])
+        _add(_totals["flood_wait_seconds"], summary["flood_wait_seconds"])
+        _add(_totals["phase_seconds"], summary["phase_seconds"])
+        _totals["last_job"] = summary
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+def prometheus_text(worker=None):
+    """Счётчики процесса в текстовом формате Prometheus."""
+    base = {"worker": worker or f"{socket.gethostname()}:{os.getpid()}"}
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{PREFIX}_{name}{_labels({**base, **labels})} {value}")
+
+    with _totals_lock:
+        totals = {key: (dict(value) if isinstance(value, dict) else value) for key, value in _totals.items()}
+    metric("jobs_total", "counter", "Finished scrape jobs by status.",
+           [({"status": status}, count) for status, count in sorted(totals["jobs"].items())])
+    metric("messages_total", "counter", "Messages scraped.", [({}, totals["messages"])])
+    metric("pages_total", "counter", "History pages fetched.", [({}, totals["pages"])])
+    metric("channels_failed_total", "counter", "Channels that failed to scrape.", [({}, totals["channels_failed"])])
+    metric("api_requests_total", "counter", "Telegram API requests by request class.",
+           [({"kind": kind}, count) for kind, count in sorted(totals["api_requests"].items())])
+    metric("flood_waits_total", "counter", "FloodWait errors by request class.",
+           [({"kind": kind}, count) for kind, count in sorted(totals["flood_waits"].items())])
+    metric("flood_wait_seconds_total", "counter", "Seconds requested by FloodWait errors.",
+           [({"kind": kind}, seconds) for kind, seconds in sorted(totals["flood_wait_seconds"].items())])
+    metric("phase_seconds_total", "counter", "Wall-clock seconds spent per job phase.",
+           [({"phase": phase}, round(seconds, 3)) for phase, seconds in sorted(totals["phase_seconds"].items())])
+    metric("export_bytes_total", "counter", "Bytes written to export files.", [({}, totals["export_bytes"])])
+    last = totals["last_job"]
+    if last:
+        metric("last_job_messages_per_second", "gauge", "Throughput of the last finished job.",
+               [({}, round(last["messages_per_sec"], 3))])
+        metric("last_job_duration_seconds", "gauge", "Duration of the last finished job.",
+               [({}, round(last["duration"], 3))])
+        metric("last_job_timestamp_seconds", "gauge", "Start time of the last finished job.",
+               [({}, round(last["started_at"], 3))])
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path=None):
+    """Пишет счётчики процесса в файл (атомарно: через временный файл)."""
+    path = path or os.path.join(METRICS_DIR, f"{socket.gethostname()}_{os.getpid()}.prom")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
+    return path
+
+
+def collect_textfiles(directory=METRICS_DIR):
+    """Содержимое всех .prom файлов каталога одним ответом (HELP/TYPE без повторов)."""
+    seen = set()
+    lines = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.prom"))):
+        with open(path, encoding="utf-8") as f:
+            for line in f.read().splitlines():
+                if line.startswith("#"):
+                    if line in seen:
+                        continue
+                    seen.add(line)
+                lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def serve(port=DEFAULT_METRICS_PORT, directory=METRICS_DIR):
+    """HTTP-эндпоинт /metrics для Prometheus."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            body = collect_textfiles(directory).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    print(f"Метрики: http://0.0.0.0:{port}/metrics (файлы: {directory})")
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Метрики скрапера в формате Prometheus")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="отдавать метрики по HTTP")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_METRICS_PORT)
+    serve_parser.add_argument("--dir", default=METRICS_DIR, help="каталог с .prom файлами")
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.port, args.dir)
+
+
+if __name__ == "__main__":
+    main()
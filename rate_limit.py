@@ -0,0 +1,165 @@
+"""
+Общий планировщик запросов к Telegram: token bucket на каждый класс запросов
+и пауза класса при FloodWaitError. Через него идут страницы истории,
+разрешение каналов, шаги входа и скачивание медиа.
+"""
+import asyncio
+import threading
+import time
+
+from telethon.errors import FloodWaitError
+
+# Класс запроса → (запросов в секунду, размер всплеска); None — без ограничения
+DEFAULT_RATES = {
+    "history": (4.0, 8),
+    "resolve": (1.0, 3),
+    "auth": (0.2, 2),
+    # Скачивание медиа: токен на файл и на пачку get_messages, пауза FloodWait — только этому классу
+    "media": (2.0, 4),
+    "default": (5.0, 10),
+}
+# Сообщений на одной странице messages.GetHistory (так же грузит iter_messages)
+HISTORY_PAGE_SIZE = 100
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Token bucket с резервированием: reserve() сразу списывает токен
+    и возвращает, сколько ждать. Не привязан к event loop, защищён threading.Lock.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class RequestScheduler:
+    """
+    Ограничивает темп запросов по классам ("history", "resolve", "auth", ...)
+    и ставит на паузу только тот класс, который получил FloodWaitError.
+    """
+
+    def __init__(self, rates=None):
+        self.rates = {**DEFAULT_RATES, **(rates or {})}
+        self._buckets = {}
+        self._paused_until = {}
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.flood_waits = {}
+        self.flood_wait_seconds = {}
+
+    def _bucket(self, kind):
+        with self._lock:
+            if kind not in self._buckets:
+                rate = self.rates.get(kind, self.rates["default"])
+                self._buckets[kind] = TokenBucket(*rate) if rate else None
+            return self._buckets[kind]
+
+    def paused_for(self, kind):
+        """Сколько секунд ещё длится пауза класса (0 — не на паузе)."""
+        return max(0.0, self._paused_until.get(kind, 0.0) - time.monotonic())
+
+    def pause(self, kind, seconds):
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._paused_until[kind] = max(self._paused_until.get(kind, 0.0), until)
+            self.flood_waits[kind] = self.flood_waits.get(kind, 0) + 1
+            self.flood_wait_seconds[kind] = self.flood_wait_seconds.get(kind, 0) + seconds
+
+    async def acquire(self, kind, max_wait=None):
+        """
+        Ждёт окончания паузы класса и свободного токена.
+        Если пауза длиннее max_wait — сразу FloodWaitError с оставшимся временем.
+        """
+        while True:
+            paused = self.paused_for(kind)
+            if paused > 0:
+                if max_wait is not None and paused > max_wait:
+                    raise FloodWaitError(request=None, capture=int(paused) + 1)
+                await asyncio.sleep(paused)
+                continue
+            bucket = self._bucket(kind)
+            delay = bucket.reserve() if bucket else 0.0
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Пауза могла начаться, пока ждали токен
+            if self.paused_for(kind) <= 0:
+                with self._lock:
+                    self.requests[kind] = self.requests.get(kind, 0) + 1
+                return
+
+    async def call(self, kind, func, *args, max_wait=None, **kwargs):
+        """Вызывает await func(*args, **kwargs) через планировщик, повторяя после FloodWait."""
+        while True:
+            await self.acquire(kind, max_wait)
+            try:
+                return await func(*args, **kwargs)
+            except FloodWaitError as e:
+                self.pause(kind, e.seconds)
+                if max_wait is not None and e.seconds > max_wait:
+                    raise
+
+    async def iter_messages(self, client, entity, limit=None, kind="history", max_wait=None, **kwargs):
+        """
+        client.iter_messages через планировщик: токен берётся перед каждой страницей,
+        а после FloodWait итерация продолжается с того же сообщения (offset_id последнего
+        выданного), а не обрывается. Работает и с reverse=True. FloodWait длиннее max_wait
+        пробрасывается наружу.
+        """
+        yielded = 0
+        last_id = None
+        while limit is None or yielded < limit:
+            request_kwargs = dict(kwargs)
+            if last_id is not None:
+                # Позицию уже задаёт последнее сообщение — offset_date больше не нужен
+                request_kwargs["offset_id"] = last_id
+                request_kwargs.pop("offset_date", None)
+            remaining = None if limit is None else limit - yielded
+            iterator = client.iter_messages(entity, limit=remaining, wait_time=0, **request_kwargs)
+            in_page = 0
+            try:
+                while True:
+                    if in_page % HISTORY_PAGE_SIZE == 0:
+                        await self.acquire(kind, max_wait)
+                    try:
+                        message = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    in_page += 1
+                    yielded += 1
+                    last_id = message.id
+                    yield message
+            except FloodWaitError as e:
+                self.pause(kind, e.seconds)
+                if max_wait is not None and e.seconds > max_wait:
+                    raise
+
+    def stats(self):
+        return {
+            "requests": dict(self.requests),
+            "flood_waits": dict(self.flood_waits),
+            "flood_wait_seconds": dict(self.flood_wait_seconds),
+        }
+
+
+def get_scheduler(key, rates=None):
+    """Общий на процесс планировщик для ключа (аккаунт, телефон входа и т.п.)."""
+    with _registry_lock:
+        scheduler = _registry.get(key)
+        if scheduler is None:
+            scheduler = _registry[key] = RequestScheduler(rates)
+        return scheduler
@@ -0,0 +1,196 @@
+"""
+Быстрый путь чтения истории: сырые страницы messages.GetHistory вместо client.iter_messages.
+Нужные поля берутся прямо из TL-объектов одним проходом по странице, без _finish_init
+и свойств telethon Message, а следующая страница запрашивается, пока разбирается текущая.
+Записи совпадают с теми, что scraper.message_record собирает из telethon Message.
+"""
+import asyncio
+import math
+
+from telethon.tl.functions.messages import GetHistoryRequest
+from telethon.tl.types import (
+    Document,
+    DocumentAttributeAudio,
+    DocumentAttributeVideo,
+    MessageActionChatEditPhoto,
+    MessageEmpty,
+    MessageMediaDocument,
+    MessageMediaPhoto,
+    MessageMediaPoll,
+    MessageMediaWebPage,
+    Photo,
+    WebPage,
+)
+from telethon.tl.types.messages import Messages
+
+from rate_limit import HISTORY_PAGE_SIZE
+
+# Сколько раз отдать управление циклу после запуска запроса следующей страницы:
+# задача запроса → очередь MTProtoSender → очередь соединения → сокет
+SEND_YIELDS = 3
+
+
+def media_type(message):
+    """То же, что scraper.get_media_type, но по полям TL-объекта, без свойств telethon Message."""
+    media = message.media
+    if isinstance(media, MessageMediaPhoto):
+        return "photo" if isinstance(media.photo, Photo) else "none"
+    if isinstance(media, MessageMediaDocument):
+        document = media.document
+    elif isinstance(media, MessageMediaWebPage):
+        webpage = media.webpage
+        if not isinstance(webpage, WebPage):
+            return "none"
+        if isinstance(webpage.photo, Photo):
+            return "photo"
+        document = webpage.document
+    elif isinstance(media, MessageMediaPoll):
+        return "poll"
+    else:
+        return "photo" if isinstance(message.action, MessageActionChatEditPhoto) else "none"
+    if not isinstance(document, Document):
+        return "none"
+    # Как у telethon: видео — по первому атрибуту видео, голосовое — по первому атрибуту аудио,
+    # любой другой документ (аудио, стикер, GIF без атрибута видео) — "document"
+    for attribute in document.attributes:
+        if isinstance(attribute, DocumentAttributeVideo):
+            return "video"
+    for attribute in document.attributes:
+        if isinstance(attribute, DocumentAttributeAudio):
+            return "voice" if attribute.voice else "document"
+    return "document"
+
+
+def reaction_counts(reactions):
+    """То же, что scraper.parse_reactions, по полю reactions TL-объекта."""
+    results = getattr(reactions, "results", None) if reactions else None
+    if not results:
+        return []
+    return [
+        {"emoji": getattr(result.reaction, "emoticon", None) or str(result.reaction), "count": result.count or 0}
+        for result in results
+        if result.reaction
+    ]
+
+
+def page_records(page, parse_mode=None):
+    """
+    Записи страницы одним проходом, в формате scraper.message_record:
+    (id, date, text, views, forwards, media_type, reactions, reply_to_msg_id, replies).
+    parse_mode — client.parse_mode: текст форматируется так же, как Message.text.
+    """
+    records = []
+    append = records.append
+    for message in page:
+        try:
+            text = message.message
+            if text and parse_mode:
+                text = parse_mode.unparse(text, message.entities)
+            reply_to = message.reply_to
+            replies = message.replies
+            append((
+                message.id,
+                message.date,
+                text or "",
+                message.views,
+                message.forwards,
+                media_type(message),
+                reaction_counts(message.reactions),
+                getattr(reply_to, "reply_to_msg_id", None) if reply_to else None,
+                replies.replies if replies is not None and replies.comments else None,
+            ))
+        except Exception:
+            continue
+    return records
+
+
+async def iter_history_pages(client, entity, scheduler, limit=None, offset_id=0, min_id=0, max_id=0,
+                             offset_date=None, reverse=False, kind="history", max_wait=None):
+    """
+    Страницы истории (списки TL-сообщений в порядке обхода) с теми же границами, порядком
+    и смещениями, что у client.iter_messages. Запрос следующей страницы уходит сразу после
+    ответа на текущую, до того как вызывающий её разберёт. Темп и FloodWait — через
+    scheduler.call: класс ставится на паузу и тот же запрос повторяется; FloodWait дольше
+    max_wait пробрасывается наружу.
+    """
+    if reverse:
+        offset_id = max(offset_id, min_id)
+        if offset_id and max_id and max_id - offset_id <= 1:
+            return
+        max_id = max_id or math.inf
+        if offset_id:
+            offset_id += 1
+        elif not offset_date:
+            offset_id = 1
+    else:
+        offset_id = max(offset_id, max_id)
+        if offset_id and min_id and offset_id - min_id <= 1:
+            return
+    left = math.inf if limit is None else limit
+    last_id = 0 if reverse else math.inf
+
+    def fetch(page_limit, offset_id, offset_date):
+        request = GetHistoryRequest(
+            peer=entity,
+            offset_id=offset_id,
+            offset_date=offset_date,
+            add_offset=-page_limit if reverse else 0,
+            limit=page_limit,
+            max_id=0,
+            min_id=0,
+            hash=0,
+        )
+        return asyncio.ensure_future(scheduler.call(kind, client, request, max_wait=max_wait))
+
+    if left <= 0:
+        return
+    page_limit = min(left, HISTORY_PAGE_SIZE)
+    pending = fetch(page_limit, offset_id, offset_date)
+    try:
+        while pending is not None:
+            response = await pending
+            pending = None
+            page = []
+            out_of_range = False
+            for message in reversed(response.messages) if reverse else response.messages:
+                if isinstance(message, MessageEmpty):
+                    continue
+                if reverse:
+                    out_of_range = message.id <= last_id or message.id >= max_id
+                else:
+                    out_of_range = message.id >= last_id or message.id <= min_id
+                if out_of_range or len(page) >= left:
+                    break
+                last_id = message.id
+                page.append(message)
+            left -= len(page)
+            finished = (
+                out_of_range
+                or not page
+                or left <= 0
+                or isinstance(response, Messages)
+                or response.messages[0].id <= page_limit
+            )
+            if not finished:
+                last = page[-1]
+                page_limit = min(left, HISTORY_PAGE_SIZE)
+                pending = fetch(page_limit, last.id + 1 if reverse else last.id, last.date)
+                for _ in range(SEND_YIELDS):
+                    await asyncio.sleep(0)
+            if page:
+                yield page
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def iter_raw_records(client, entity, scheduler, limit=None, max_wait=None, **kwargs):
+    """Записи сообщений (см. page_records) по страницам iter_history_pages; kwargs — как у iter_messages."""
+    parse_mode = getattr(client, "parse_mode", None)
+    pages = iter_history_pages(client, entity, scheduler, limit=limit, max_wait=max_wait, **kwargs)
+    try:
+        async for page in pages:
+            for record in page_records(page, parse_mode):
+                yield record
+    finally:
+        await pages.aclose()
@@ -0,0 +1,323 @@
+"""
+Адаптивное обновление большого каталога каналов.
+Вместо пересбора всего каталога по таймеру планировщик оценивает по прошлым
+результатам (колонка date_unixtime), как часто пишет каждый канал, держит очередь
+каналов по времени следующей проверки и тратит часовой бюджет запросов сначала
+на активные каналы; канал, где новых сообщений нет, проверяется всё реже.
+Каждый раунд — обычный run_scraping в инкрементальном режиме.
+
+Запуск из командной строки:
+    python cli.py catalogue.txt --refresh --budget 600 --format json --output data/refresh
+"""
+import asyncio
+import heapq
+import math
+import os
+import sqlite3
+import time
+
+from checkpoints import DATA_DIR
+from message_buffer import NULL
+from metrics import ScrapeMetrics
+from scraper import dedupe_links, run_scraping
+
+DEFAULT_REFRESH_PATH = os.path.join(DATA_DIR, "refresh.sqlite3")
+# Запросов к API в час на весь каталог
+DEFAULT_BUDGET = 600
+# Границы интервала проверки одного канала, секунды
+DEFAULT_MIN_INTERVAL = 5 * 60
+DEFAULT_MAX_INTERVAL = 7 * 24 * 3600
+# Каналов в одном раунде (один run_scraping)
+ROUND_SIZE = 200
+# Вес нового наблюдения в скользящей оценке частоты постов
+RATE_ALPHA = 0.3
+# Частота, пока о канале ничего не известно и нижняя граница оценки: пост в неделю, постов в секунду
+PRIOR_RATE = 1 / (7 * 24 * 3600)
+# Сколько пустых проверок подряд ещё удваивают интервал
+MAX_BACKOFF_STEPS = 8
+# Раз в сколько секунд планировщик просыпается проверить stop, даже если ждать дольше
+IDLE_POLL = 60
+
+
+class RefreshStore:
+    """
+    Состояние каталога по нормализованной ссылке канала: rate — оценка частоты постов
+    (сообщений в секунду), cost — запросов на одну проверку, checked_at — время последней
+    проверки, empty_streak — проверок подряд без новых сообщений, failures — неудач подряд.
+    Частота — свойство канала, а не аккаунта, поэтому scope здесь не нужен.
+    """
+
+    def __init__(self, path=DEFAULT_REFRESH_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS channels (
+                link TEXT PRIMARY KEY,
+                rate REAL,
+                cost REAL NOT NULL DEFAULT 1,
+                checked_at REAL,
+                empty_streak INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+
+    def _fetch(self, sql, ids, *params):
+        """Строки запроса sql с IN ({}) по списку ids — частями, чтобы не упереться в лимит параметров."""
+        rows = []
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            rows.extend(self._conn.execute(sql.format(", ".join("?" * len(part))), (*params, *part)))
+        return rows
+
+    def load(self, links):
+        """Известные каналы из links: ссылка → dict(rate, cost, checked_at, empty_streak, failures)."""
+        return {
+            link: {"rate": rate, "cost": cost, "checked_at": checked_at, "empty_streak": empty, "failures": failures}
+            for link, rate, cost, checked_at, empty, failures in self._fetch(
+                "SELECT link, rate, cost, checked_at, empty_streak, failures FROM channels WHERE link IN ({})",
+                list(links),
+            )
+        }
+
+    def save(self, states):
+        """Сохраняет состояния каналов (ссылка → dict как у load) одной транзакцией."""
+        self._conn.executemany(
+            """
+            INSERT INTO channels (link, rate, cost, checked_at, empty_streak, failures) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (link) DO UPDATE SET
+                rate = excluded.rate,
+                cost = excluded.cost,
+                checked_at = excluded.checked_at,
+                empty_streak = excluded.empty_streak,
+                failures = excluded.failures
+            """,
+            [
+                (link, state["rate"], state["cost"], state["checked_at"], state["empty_streak"], state["failures"])
+                for link, state in states.items()
+            ],
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def observed_rate(messages, new_messages, since, now):
+    """
+    Частота постов по результату проверки, сообщений в секунду. После прошлой проверки
+    (since) — новые сообщения за прошедшее время; при первой — по разбросу дат
+    собранных сообщений (messages — MessageBuffer). None, если оценить не по чему.
+    """
+    if since is not None:
+        return new_messages / max(now - since, 1.0)
+    dates = [d for d in messages.date_unixtime if d != NULL]
+    if len(dates) < 2:
+        return None
+    return (len(dates) - 1) / max(max(dates) - min(dates), 60)
+
+
+class RefreshPlanner:
+    """
+    Очередь каналов по времени следующей проверки (heapq) и часовой бюджет запросов.
+    Бюджет делится пропорционально корню из частоты постов: так при фиксированном
+    числе запросов меньше всего новых сообщений ждёт сбора по всему каталогу.
+    Каждая пустая проверка подряд удваивает интервал канала, неудача — тоже.
+    """
+
+    def __init__(self, store, links, budget=DEFAULT_BUDGET, min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL):
+        self.store = store
+        self.budget = budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.links = dedupe_links(links)
+        known = store.load(self.links)
+        empty = {"rate": None, "cost": 1.0, "checked_at": None, "empty_streak": 0, "failures": 0}
+        self.states = {link: known.get(link, dict(empty)) for link in self.links}
+        # Запросы, доступные прямо сейчас (ведро на час бюджета), и когда оно пополнялось
+        self.tokens = float(budget)
+        self._refilled = time.monotonic()
+        self._rebuild()
+
+    def _rate(self, state):
+        return max(state["rate"] or PRIOR_RATE, PRIOR_RATE)
+
+    def _rebuild(self):
+        """
+        Подбирает множитель интервалов так, чтобы проверки всех каналов укладывались
+        в бюджет, и пересобирает очередь. Запросы, которые не нужны каналам
+        на отступе или на границе интервала, достаются остальным (бисекция по множителю).
+        """
+        requests_per_second = self.budget / 3600
+        # (цена проверки, корень частоты, множитель отступа) — то же, что в interval
+        terms = []
+        for state in self.states.values():
+            steps = min(state["empty_streak"] + state["failures"], MAX_BACKOFF_STEPS)
+            terms.append((state["cost"], math.sqrt(self._rate(state)), 2 ** steps))
+        min_interval, max_interval = self.min_interval, self.max_interval
+
+        def spent(scale):
+            return sum(
+                cost / min(max(1 / (scale * root), min_interval) * backoff, max_interval)
+                for cost, root, backoff in terms
+            )
+
+        low, high = 1e-9, 1e9
+        for _ in range(40):
+            middle = math.sqrt(low * high)
+            if spent(middle) > requests_per_second:
+                high = middle
+            else:
+                low = middle
+        self._scale = low
+        self._queue = [(self.next_due(link), link) for link in self.links]
+        heapq.heapify(self._queue)
+
+    def interval(self, link):
+        """Интервал проверки канала с учётом бюджета и отступа за пустые проверки, секунды."""
+        state = self.states[link]
+        interval = 1 / (self._scale * math.sqrt(self._rate(state)))
+        steps = min(state["empty_streak"] + state["failures"], MAX_BACKOFF_STEPS)
+        return min(max(interval, self.min_interval) * 2 ** steps, self.max_interval)
+
+    def next_due(self, link):
+        """Когда канал пора проверить (unixtime); ни разу не проверенный — сразу."""
+        checked_at = self.states[link]["checked_at"]
+        return 0.0 if checked_at is None else checked_at + self.interval(link)
+
+    def urgency(self, link, now):
+        """Сколько новых сообщений канала ждёт сбора; о неизвестном канале считаем — одно."""
+        state = self.states[link]
+        if state["checked_at"] is None:
+            return 1.0
+        return self._rate(state) * (now - state["checked_at"])
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.budget, self.tokens + (now - self._refilled) * self.budget / 3600)
+        self._refilled = now
+
+    def due(self, now=None, limit=ROUND_SIZE):
+        """
+        Каналы для следующего раунда: из тех, кому пора, — сначала те, где ждёт больше
+        всего новых сообщений; не больше, чем позволяет бюджет. Остальные остаются в очереди.
+        """
+        now = time.time() if now is None else now
+        self.refill()
+        ready = []
+        while self._queue and self._queue[0][0] <= now:
+            ready.append(heapq.heappop(self._queue)[1])
+        affordable = 0
+        spent = 0.0
+        ready.sort(key=lambda link: self.urgency(link, now), reverse=True)
+        for link in ready[:limit]:
+            spent += self.states[link]["cost"]
+            if spent > self.tokens:
+                break
+            affordable += 1
+        chosen, rest = ready[:affordable], ready[affordable:]
+        for link in rest:
+            heapq.heappush(self._queue, (self.next_due(link), link))
+        return chosen
+
+    def wait_time(self, now=None):
+        """Сколько секунд ждать до следующего раунда: до ближайшего канала и до пополнения бюджета."""
+        now = time.time() if now is None else now
+        if not self._queue:
+            return IDLE_POLL
+        until_due = self._queue[0][0] - now
+        cost = self.states[self._queue[0][1]]["cost"]
+        until_budget = max(cost - self.tokens, 0) * 3600 / self.budget
+        return max(until_due, until_budget, 0.0)
+
+    def record(self, links, results, metrics, now=None):
+        """
+        Учитывает раунд: частота постов и цена проверки каждого канала, отступ пустых
+        и неудачных, списание запросов из бюджета. Возвращает число новых сообщений.
+        """
+        now = time.time() if now is None else now
+        by_link = {result["channel"]: result for result in results or []}
+        summary = metrics.summary()
+        self.tokens -= sum(summary["api_requests"].values())
+        new_total = 0
+        for link in links:
+            state = self.states[link]
+            result = by_link.get(link)
+            if result is None:
+                state["failures"] += 1
+            else:
+                new_messages = result["total_messages"]
+                new_total += new_messages
+                since = state["checked_at"] if result["incremental_since_id"] is not None else None
+                rate = observed_rate(result["messages"], new_messages, since, now)
+                if rate is not None:
+                    state["rate"] = rate if state["rate"] is None else (
+                        RATE_ALPHA * rate + (1 - RATE_ALPHA) * state["rate"]
+                    )
+                pages = summary["per_channel"].get(link, {}).get("pages")
+                if pages:
+                    state["cost"] = RATE_ALPHA * pages + (1 - RATE_ALPHA) * state["cost"]
+                state["empty_streak"] = 0 if new_messages else state["empty_streak"] + 1
+                state["failures"] = 0
+                state["checked_at"] = now
+        self.store.save({link: self.states[link] for link in links})
+        # Частоты изменились — бюджет между каналами делится заново
+        self._rebuild()
+        return new_total
+
+
+async def run_refresh(api_id, api_hash, session_string, links, options, log_callback, on_round=None, stop=None,
+                      client_manager=None):
+    """
+    Обновляет каталог links раундами, пока не установлен stop (asyncio.Event) или
+    задачу не отменят. Раунд — run_scraping по каналам, которым пора, с incremental=True;
+    on_round(results) получает результаты раунда с новыми сообщениями (например, для записи в файл).
+    options["refresh_budget"] — запросов в час, options["refresh_min_interval"] /
+    ["refresh_max_interval"] — границы интервала канала, секунды. С client_manager раунды
+    берут один и тот же подключённый клиент, а не подключаются заново.
+    """
+    stop = stop or asyncio.Event()
+    store = RefreshStore(options.get("refresh_path") or DEFAULT_REFRESH_PATH)
+    try:
+        planner = RefreshPlanner(
+            store,
+            links,
+            options.get("refresh_budget") or DEFAULT_BUDGET,
+            options.get("refresh_min_interval") or DEFAULT_MIN_INTERVAL,
+            options.get("refresh_max_interval") or DEFAULT_MAX_INTERVAL,
+        )
+        log_callback(f"🗓 Каталог: {len(planner.links)} каналов, бюджет {planner.budget} запросов в час")
+        round_options = {**options, "incremental": True}
+        rounds = 0
+        while not stop.is_set():
+            batch = planner.due()
+            if not batch:
+                wait = min(planner.wait_time(), IDLE_POLL)
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            rounds += 1
+            metrics = ScrapeMetrics()
+            results = await run_scraping(
+                api_id, api_hash, session_string, batch, round_options, None, log_callback, None, metrics,
+                client_manager,
+            )
+            new_total = planner.record(batch, results, metrics)
+            if results and new_total and on_round:
+                on_round(results)
+            log_callback(
+                f"🔁 Раунд {rounds}: каналов {len(batch)}, новых сообщений {new_total}, "
+                f"запросов {sum(metrics.api_requests.values())}, в бюджете осталось {max(planner.tokens, 0):.0f}"
+            )
+        return rounds
+    finally:
+        store.close()
@@ -0,0 +1,185 @@
+"""
+Результаты задач в памяти сервера с общим бюджетом на все сессии Streamlit.
+Полный результат держится в памяти, только пока он нужен и помещается в бюджет:
+давно не открывавшийся или вытесненный по LRU результат выгружается —
+его копия уже лежит на диске сжатым файлом задачи (jobs.load_results) и подгружается
+обратно при следующем обращении. Предпросмотр (первые строки каналов) остаётся в памяти всегда.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from jobs import load_results
+
+# Общий бюджет памяти под результаты, МБ (переменная окружения RESULTS_MEMORY_MB)
+DEFAULT_MEMORY_MB = 512
+# Результат, к которому не обращались дольше этого, выгружается, секунды
+IDLE_TTL = 15 * 60
+# Сколько первых сообщений канала хранится для предпросмотра
+PREVIEW_ROWS = 10
+# Сколько результатов помнит хранилище (с предпросмотром); самые давние забываются целиком
+MAX_ENTRIES = 1000
+# Накладные расходы Python на одну строку текста сверх её байтов, примерно
+STR_OVERHEAD = 56
+
+
+def results_nbytes(results):
+    """Примерный объём результата в памяти: колонки сообщений и комментариев с текстами."""
+    size = 0
+    for ch in results:
+        for buffer in (ch.get("messages"), ch.get("comments")):
+            if buffer is not None:
+                size += buffer.nbytes() + STR_OVERHEAD * len(buffer.texts)
+    return size
+
+
+def results_preview(results, rows=PREVIEW_ROWS):
+    """Копия результата с первыми rows сообщениями каналов и без комментариев."""
+    return [
+        {
+            **ch,
+            "messages": ch["messages"].slice(0, rows) if ch.get("messages") is not None else None,
+            "comments": None,
+        }
+        for ch in results
+    ]
+
+
+class _Entry:
+    __slots__ = ("owner", "path", "preview", "results", "nbytes", "last_used", "loading")
+
+    def __init__(self, owner, path):
+        self.owner = owner
+        self.path = path
+        self.preview = None
+        self.results = None
+        self.nbytes = 0
+        self.last_used = time.monotonic()
+        # Параллельные обращения к выгруженному результату читают файл один раз
+        self.loading = threading.Lock()
+
+
+class ResultStore:
+    """
+    Результаты по ключу (id задачи), общие для всех сессий процесса. open() регистрирует
+    файл результата, results() отдаёт полный результат (при необходимости читая его с диска),
+    preview() — облегчённую копию для таблиц вкладки результатов. Потокобезопасен:
+    сессии Streamlit выполняются в разных потоках.
+    """
+
+    def __init__(self, budget_bytes=None, idle_ttl=IDLE_TTL):
+        if budget_bytes is None:
+            budget_bytes = int(float(os.getenv("RESULTS_MEMORY_MB", DEFAULT_MEMORY_MB)) * 2 ** 20)
+        self.budget = budget_bytes
+        self.idle_ttl = idle_ttl
+        self.stats = {"loads": 0, "hits": 0, "spills": 0}
+        self._entries = OrderedDict()
+        self._resident = 0
+        self._lock = threading.Lock()
+
+    def open(self, key, owner, path):
+        """Регистрирует результат key из файла path; возвращает предпросмотр."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.path != path:
+                if entry is not None:
+                    self._spill(entry)
+                entry = self._entries[key] = _Entry(owner, path)
+            self._entries.move_to_end(key)
+            while len(self._entries) > MAX_ENTRIES:
+                _, oldest = self._entries.popitem(last=False)
+                self._spill(oldest)
+        if entry.preview is None:
+            self.results(key)
+        return entry.preview
+
+    def preview(self, key):
+        """Предпросмотр результата key или None, если результат не открыт."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.preview is None:
+            self.results(key)
+        return entry.preview
+
+    def results(self, key):
+        """
+        Полный результат key. Выгруженный результат читается с диска и остаётся в памяти
+        в счёт бюджета: под него вытесняются давние результаты (LRU), но не он сам — см. _enforce.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                raise KeyError(key)
+            self._entries.move_to_end(key)
+            entry.last_used = time.monotonic()
+            results = entry.results
+        if results is not None:
+            self.stats["hits"] += 1
+            return results
+        with entry.loading:
+            results = entry.results
+            if results is not None:
+                self.stats["hits"] += 1
+                return results
+            results = load_results(entry.path)
+            nbytes = results_nbytes(results)
+            self.stats["loads"] += 1
+            with self._lock:
+                if entry.preview is None:
+                    entry.preview = results_preview(results)
+                if self._entries.get(key) is entry:
+                    entry.results = results
+                    entry.nbytes = nbytes
+                    self._resident += nbytes
+                self._enforce()
+        return results
+
+    def _spill(self, entry):
+        """Выгружает полный результат из памяти (файл задачи на диске остаётся)."""
+        if entry.results is not None:
+            self._resident -= entry.nbytes
+            entry.results = None
+            entry.nbytes = 0
+            self.stats["spills"] += 1
+
+    def _enforce(self, now=None):
+        """
+        Выгружает простаивающие дольше idle_ttl и самые давние результаты сверх бюджета.
+        Последний открытый результат ради бюджета не выгружается, даже если он больше всего бюджета:
+        иначе каждое обращение к нему читало бы файл заново. Его вытеснит следующий результат или TTL.
+        """
+        now = time.monotonic() if now is None else now
+        for entry in self._entries.values():
+            if entry.results is not None and now - entry.last_used > self.idle_ttl:
+                self._spill(entry)
+        newest = next(reversed(self._entries.values()), None)
+        for entry in self._entries.values():
+            if self._resident <= self.budget:
+                break
+            if entry is not newest:
+                self._spill(entry)
+
+    def spill_idle(self, now=None):
+        """Выгружает простаивающие результаты (вызывается и сам при каждом чтении с диска)."""
+        with self._lock:
+            self._enforce(now)
+
+    def usage(self):
+        """Сколько памяти занимают результаты: всего, по владельцам и сколько результатов в памяти."""
+        with self._lock:
+            self._enforce()
+            owners = {}
+            for entry in self._entries.values():
+                owner = owners.setdefault(entry.owner, {"bytes": 0, "resident": 0, "spilled": 0})
+                owner["bytes"] += entry.nbytes
+                owner["resident" if entry.results is not None else "spilled"] += 1
+            return {
+                "budget": self.budget,
+                "bytes": self._resident,
+                "results": len(self._entries),
+                "resident": sum(1 for entry in self._entries.values() if entry.results is not None),
+                "owners": owners,
+                **self.stats,
+            }
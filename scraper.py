@@ -0,0 +1,804 @@
+"""
+Ядро скрапинга Telegram каналов (без зависимостей от Streamlit).
+Используется веб-интерфейсом app.py и бенчмарками.
+"""
+import asyncio
+import re
+import time
+from datetime import datetime, time as dt_time, timedelta, timezone
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+from telethon.errors import ChannelInvalidError, ChannelPrivateError, FloodWaitError, UnauthorizedError
+from checkpoints import DEFAULT_CHECKPOINT_PATH, CheckpointStore
+from comments import DEFAULT_COMMENTS_PATH, CommentStore
+from dedup import CHUNK_SIZE as DEDUP_CHUNK_SIZE, DEFAULT_DEDUP_PATH, DuplicateIndex
+from entity_cache import DEFAULT_ENTITY_CACHE_PATH, EntityCache, ResolvedEntity
+from export import STREAM_CHUNK_SIZE, open_sink, path_size
+from media import DEFAULT_MEDIA_DB, MEDIA_DIR, MediaDownloader, MediaStore
+from message_buffer import CommentBuffer, MessageBuffer
+from raw_history import iter_raw_records
+from rate_limit import HISTORY_PAGE_SIZE, RequestScheduler, get_scheduler
+
+# Сколько каналов обрабатывается одновременно на одном клиенте по умолчанию
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 20
+# Как часто (в сообщениях) сообщать о прогрессе канала
+PROGRESS_EVERY = 200
+# При потоковой записи: как часто (в сообщениях) выгрузка сбрасывается на диск и сдвигается
+# контрольная точка (реже, чем прогресс: каждый сброс Parquet закрывает очередной part-N.parquet канала)
+CHECKPOINT_EVERY = 10_000
+# Сколько сообщений канала остаётся в памяти для предпросмотра при потоковой записи
+PREVIEW_SIZE = 10
+# Разрешение ссылок: не больше RESOLVE_CONCURRENCY запросов сразу (темп задаёт планировщик)
+RESOLVE_CONCURRENCY = 3
+# Если FloodWait на разрешение длиннее — ссылка считается неразрешённой, а не ждём часами
+RESOLVE_MAX_FLOOD_WAIT = 300
+# Так Telegram отвергает запрос по устаревшему access_hash из кэша (канал пересоздан, хэш сменился)
+STALE_PEER_ERRORS = (ChannelInvalidError, ChannelPrivateError, ValueError)
+# Сколько тредов комментариев одного канала запрашивается одновременно (темп задаёт планировщик)
+DEFAULT_COMMENTS_CONCURRENCY = 8
+MAX_COMMENTS_CONCURRENCY = 32
+
+
+def get_media_type(message):
+    if message.photo:
+        return "photo"
+    elif message.video:
+        return "video"
+    elif message.voice:
+        return "voice"
+    elif message.document:
+        return "document"
+    elif message.audio:
+        return "audio"
+    elif message.sticker:
+        return "sticker"
+    elif message.gif:
+        return "gif"
+    elif message.poll:
+        return "poll"
+    return "none"
+
+
+def parse_reactions(message):
+    reactions = []
+    if message.reactions and hasattr(message.reactions, "results") and message.reactions.results:
+        for reaction in message.reactions.results:
+            try:
+                if reaction.reaction:
+                    emoji = getattr(reaction.reaction, "emoticon", None) or str(reaction.reaction)
+                    count = getattr(reaction, "count", 0) or 0
+                    if emoji:
+                        reactions.append({"emoji": emoji, "count": count})
+            except Exception:
+                continue
+    return reactions
+
+
+def reply_count(message):
+    """Число комментариев к посту или None, если у канала нет обсуждения."""
+    replies = getattr(message, "replies", None)
+    return replies.replies if replies is not None and replies.comments else None
+
+
+def message_record(message):
+    """Поля telethon Message в порядке MessageBuffer.append (дата — datetime, а не unixtime)."""
+    return (
+        message.id,
+        message.date,
+        message.text or "",
+        getattr(message, "views", None),
+        getattr(message, "forwards", None),
+        get_media_type(message),
+        parse_reactions(message),
+        getattr(message, "reply_to_msg_id", None),
+        reply_count(message),
+    )
+
+
+async def iter_message_records(history):
+    """Записи message_record по сообщениям history; сообщение, которое не разобралось, пропускается."""
+    async for message in history:
+        try:
+            yield message_record(message)
+        except Exception:
+            continue
+
+
+def build_message_url(channel_username: str, message_id: int) -> str:
+    username = channel_username.lstrip("@")
+    return f"https://t.me/{username}/{message_id}"
+
+
+def normalize_channel_link(link: str) -> str:
+    link = link.strip()
+    if link.startswith("https://t.me/"):
+        link = link[len("https://t.me/"):]
+    elif link.startswith("http://t.me/"):
+        link = link[len("http://t.me/"):]
+    elif link.startswith("t.me/"):
+        link = link[len("t.me/"):]
+    if link.startswith("@"):
+        link = link[1:]
+    return link.strip()
+
+
+def dedupe_links(links):
+    """Нормализованные ссылки без повторов (без учёта регистра), в исходном порядке."""
+    seen = set()
+    unique = []
+    for link in links:
+        normalized = normalize_channel_link(link)
+        key = normalized.lower()
+        if normalized and key not in seen:
+            seen.add(key)
+            unique.append(normalized)
+    return unique
+
+
+def is_valid_channel_link(line: str) -> bool:
+    """Проверяет, похожа ли строка на ссылку/username канала."""
+    s = line.strip()
+    if not s:
+        return False
+    # @channel, t.me/channel, https://t.me/channel, или просто username (латиница/цифры/подчёркивание)
+    if s.startswith("@"):
+        return len(s) > 1 and re.match(r"^@[a-zA-Z0-9_]{5,}$", s)
+    if "t.me/" in s:
+        return True
+    if re.match(r"^[a-zA-Z0-9_]{5,32}$", s):
+        return True
+    return False
+
+
+def validate_channel_links(text: str) -> tuple[list[str], list[str]]:
+    """Возвращает (валидные ссылки, невалидные строки)."""
+    lines = [line.strip() for line in text.strip().split("\n") if line.strip()]
+    valid, invalid = [], []
+    for line in lines:
+        if is_valid_channel_link(line):
+            valid.append(line.strip())
+        else:
+            invalid.append(line)
+    return valid, invalid
+
+
+async def resolve_links(client, links, cache=None, log_callback=None, scheduler=None):
+    """
+    Разрешает ссылки до начала скрапинга.
+    Кэш-попадания не трогают API, промахи разрешаются через get_entity с ограничением
+    параллельности, темп и FloodWait — через scheduler ("resolve"). Возвращает
+    (dict нормализованная ссылка → ResolvedEntity, список (ссылка, причина) для неразрешённых).
+    """
+    log = log_callback or (lambda msg: None)
+    resolved = {}
+    unresolved = []
+    misses = []
+    for link in dedupe_links(links):
+        cached = cache.get(link) if cache else None
+        if cached:
+            resolved[link] = cached
+        else:
+            misses.append(link)
+    if cache and resolved:
+        log(f"🗂 Из кэша: {len(resolved)} каналов, разрешаем {len(misses)}")
+
+    scheduler = scheduler or RequestScheduler()
+    semaphore = asyncio.Semaphore(RESOLVE_CONCURRENCY)
+
+    async def resolve(link):
+        async with semaphore:
+            try:
+                entity = await scheduler.call("resolve", client.get_entity, link, max_wait=RESOLVE_MAX_FLOOD_WAIT)
+            except FloodWaitError as e:
+                unresolved.append((link, f"FloodWait {e.seconds} с"))
+                return
+            except Exception as e:
+                unresolved.append((link, str(e) or type(e).__name__))
+                return
+            entity_resolved = ResolvedEntity.from_entity(entity, link)
+            resolved[link] = entity_resolved
+            if cache:
+                cache.put(link, entity_resolved)
+
+    await asyncio.gather(*(resolve(link) for link in misses))
+    return resolved, unresolved
+
+
+def date_window(options):
+    """
+    Окно режима by_date в UTC: (начало from_date 00:00, конец — начало дня после to_date).
+    Границы без даты — None.
+    """
+    from_date = options.get("from_date")
+    to_date = options.get("to_date")
+    start = datetime.combine(from_date, dt_time.min, timezone.utc) if from_date else None
+    end = datetime.combine(to_date + timedelta(days=1), dt_time.min, timezone.utc) if to_date else None
+    return start, end
+
+
+def estimate_channel_progress(options, fetched, total_words=0, message_date=None):
+    """
+    Доля выполнения канала (0..1) или None, если оценить нельзя.
+    В режиме by_date — по тому, насколько дата сообщения продвинулась к началу окна.
+    """
+    mode = options.get("mode", "by_count")
+    if mode == "by_words":
+        word_limit = options.get("word_limit", 100_000)
+        return min(total_words / word_limit, 1.0) if word_limit else None
+    if mode in ("by_count", "from_start"):
+        message_limit = options.get("message_limit", 1000)
+        return min(fetched / message_limit, 1.0) if message_limit else None
+    if mode == "by_date" and message_date:
+        start, end = date_window(options)
+        end = end or datetime.now(timezone.utc)
+        if start and end > start:
+            return min(max((end - message_date) / (end - start), 0.0), 1.0)
+    return None
+
+
+def plan_history_phases(checkpoint, options=None):
+    """
+    Фазы обхода истории с учётом контрольной точки:
+    "full" — обычный проход от новых к старым (точки нет);
+    "new" — только сообщения новее max_id;
+    "backfill" — продолжение прерванного прохода вглубь от min_id;
+    "forward" — от старых к новым (reverse=True) после max_id, для режима from_start:
+    прерванный или упёршийся в лимит проход продолжается со следующего сообщения.
+    В режиме by_date с конечной датой запросы сразу начинаются с конца окна (offset_date),
+    более новые страницы не загружаются.
+    """
+    options = options or {}
+    mode = options.get("mode", "by_count")
+    if mode == "from_start":
+        if checkpoint is None:
+            return [("forward", {"reverse": True})]
+        phases = []
+        if not checkpoint["backfill_done"]:
+            phases.append(("backfill", {"offset_id": checkpoint["min_id"]}))
+        phases.append(("forward", {"reverse": True, "offset_id": checkpoint["max_id"]}))
+        return phases
+    window_end = date_window(options)[1] if mode == "by_date" else None
+    seek = {"offset_date": window_end} if window_end else {}
+    if checkpoint is None:
+        return [("full", seek)]
+    phases = [("new", {"min_id": checkpoint["max_id"], **seek})]
+    if not checkpoint["backfill_done"]:
+        phases.append(("backfill", {"offset_id": checkpoint["min_id"]}))
+    return phases
+
+
+async def scrape_comments(client, entity, channel_id, channel_username, posts, store, scheduler, options=None,
+                          max_wait=None):
+    """
+    Комментарии к постам posts — списку (post_id, число комментариев) — в CommentBuffer.
+    Треды запрашиваются параллельно, не больше options["comments_concurrency"] сразу, через
+    класс "history" планировщика. Тред, где число комментариев не изменилось с прошлого сбора,
+    берётся из store (comments.CommentStore) без запросов; изменившийся докачивается только
+    новыми комментариями (min_id). Возвращает (CommentBuffer, сколько тредов запрошено).
+    """
+    options = options or {}
+    concurrency = max(
+        1, min(int(options.get("comments_concurrency") or DEFAULT_COMMENTS_CONCURRENCY), MAX_COMMENTS_CONCURRENCY)
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    known = store.threads(channel_id, [post_id for post_id, _ in posts])
+    changed = [(post_id, replies) for post_id, replies in posts if known.get(post_id, (None, 0))[0] != replies]
+
+    async def fetch(post_id, replies):
+        min_id = known[post_id][1] if post_id in known else 0
+        records = []
+        async with semaphore:
+            history = scheduler.iter_messages(client, entity, reply_to=post_id, min_id=min_id, max_wait=max_wait)
+            async for message_id, message_date, text, views, forwards, media_type, reactions, reply_to, _ in (
+                iter_message_records(history)
+            ):
+                date_unixtime = int(message_date.timestamp()) if message_date else None
+                records.append((message_id, date_unixtime, text, views, forwards, media_type, reactions, reply_to))
+        store.save(channel_id, post_id, replies, records)
+
+    outcomes = await asyncio.gather(*(fetch(*post) for post in changed), return_exceptions=True)
+    for outcome in outcomes:
+        # Долгий FloodWait — как у истории канала: решает вызывающий (пул отдаёт канал другой сессии).
+        # Тред с другой ошибкой не сохраняется и будет запрошен в следующий раз
+        if isinstance(outcome, FloodWaitError):
+            raise outcome
+    comments = CommentBuffer(channel_username)
+    for post_id, *fields in store.load(channel_id, [post_id for post_id, _ in posts]):
+        comments.add(post_id, *fields)
+    return comments, len(changed)
+
+
+async def scrape_channel(
+    client,
+    channel_link,
+    options,
+    on_progress=None,
+    checkpoints=None,
+    sink=None,
+    resolved=None,
+    scheduler=None,
+    max_flood_wait=None,
+    metrics=None,
+    duplicates=None,
+    media=None,
+    comments=None,
+    entity_cache=None,
+):
+    """
+    Собирает сообщения одного канала.
+    on_progress(fetched, fraction) вызывается каждые PROGRESS_EVERY сообщений.
+    checkpoints (CheckpointStore) включает инкрементальный режим: собираются только
+    сообщения новее прошлого запуска, а прерванный проход вглубь истории продолжается.
+    Точка сохраняется, только когда собранное уже на диске: при потоковой записи — после
+    sink.flush(); без неё канал отдаёт диапазон в "pending_checkpoint", и его сохраняет
+    save_checkpoints, когда весь запуск завершён (прерванный сбор точку не двигает).
+    by_date собирает окно [from_date, to_date] (to_date необязательна), from_start читает
+    историю от старых к новым — см. plan_history_phases.
+    sink (export.JsonlSink / CsvSink) включает потоковый режим: сообщения пишутся на диск
+    пачками по STREAM_CHUNK_SIZE, а в результате остаются только первые PREVIEW_SIZE.
+    Сообщения в результате ("messages") — MessageBuffer, а не список dict.
+    resolved (ResolvedEntity) — заранее разрешённый канал: get_entity не вызывается.
+    scheduler (RequestScheduler) задаёт темп запросов; после FloodWait история
+    продолжается с того же сообщения, канал не теряется.
+    max_flood_wait задают, когда вызывающий сам перераспределяет каналы (пул сессий):
+    FloodWait дольше max_flood_wait и ошибки авторизации сессии пробрасываются наружу.
+    metrics (metrics.ScrapeMetrics) получает время, сообщения и страницы канала.
+    options["raw_history"] включает быстрый путь raw_history: сырые страницы GetHistory
+    с предзагрузкой следующей страницы; записи те же.
+    duplicates (dedup.DuplicateIndex) ищет повторы и репосты по мере сбора, пачками;
+    options["drop_duplicates"] убирает их из результата и потоковой выгрузки.
+    media (media.MediaDownloader) получает сообщения с медиа нужных типов и качает их
+    в фоне; сбор текста скачивания не ждёт.
+    comments (comments.CommentStore) включает сбор комментариев к постам после истории
+    канала (см. scrape_comments): в результате — CommentBuffer в "comments", при потоковой
+    записи комментарии пишутся в файл после постов канала.
+    entity_cache (EntityCache) — кэш, из которого взят resolved. Если Telegram отвергает
+    его access_hash (STALE_PEER_ERRORS) до первого сообщения, запись кэша сбрасывается,
+    канал разрешается заново через get_entity (свежая запись — снова в кэш) и сбор повторяется один раз.
+    """
+    scheduler = scheduler or RequestScheduler(options.get("rate_limits"))
+    started = time.perf_counter()
+    from_cache = resolved is not None and entity_cache is not None
+    fetched = 0
+    try:
+        channel_link = normalize_channel_link(channel_link)
+        if resolved is None:
+            entity = await scheduler.call("resolve", client.get_entity, channel_link, max_wait=max_flood_wait)
+            resolved = ResolvedEntity.from_entity(entity, channel_link)
+            if entity_cache is not None:
+                entity_cache.put(channel_link, resolved)
+        entity = resolved.input_peer()
+        channel_username = resolved.username or channel_link
+        mode = options.get("mode", "by_count")
+        message_limit = options.get("message_limit", 1000)
+        from_date = options.get("from_date")
+        to_date = options.get("to_date")
+        word_limit = options.get("word_limit", 100_000)
+        channel_title = resolved.title
+        messages_data = MessageBuffer(channel_username)
+        preview = MessageBuffer(channel_username)
+        total_words = 0
+        stop_reason = None
+        checkpoint = checkpoints.get(resolved.id) if checkpoints else None
+        # Собранный диапазон (max_id, min_id, backfill_done): в checkpoints он попадает через save_progress
+        progress = (checkpoint["max_id"], checkpoint["min_id"], checkpoint["backfill_done"]) if checkpoint else None
+        saved_progress = progress
+        limit_reached = False
+        pages = 0
+        sink_seconds = 0.0
+        drop_duplicates = duplicates is not None and bool(options.get("drop_duplicates"))
+        # Сколько сообщений messages_data уже проверено на повторы и номера найденных повторов
+        dedup_checked = 0
+        duplicate_rows = []
+        duplicates_found = 0
+        duplicate_sources = {}
+        # Посты с комментариями: (id, число комментариев)
+        thread_posts = []
+        if media is not None:
+            media.resume(client, scheduler, entity, resolved.id)
+
+        def check_duplicates():
+            nonlocal dedup_checked, duplicates_found
+            sources = duplicates.add_buffer(resolved.id, channel_username, messages_data, dedup_checked)
+            for offset, source in enumerate(sources):
+                if source is not None:
+                    duplicate_rows.append(dedup_checked + offset)
+                    duplicate_sources[source[0]] = duplicate_sources.get(source[0], 0) + 1
+            duplicates_found += sum(source is not None for source in sources)
+            dedup_checked = len(messages_data)
+
+        def without_duplicates():
+            """messages_data без найденных повторов."""
+            skip = set(duplicate_rows)
+            return messages_data.take(i for i in range(len(messages_data)) if i not in skip)
+
+        def save_progress():
+            """Сохраняет собранный диапазон: вызывается, только когда сообщения уже на диске."""
+            nonlocal saved_progress
+            if checkpoints and progress is not None and progress != saved_progress:
+                checkpoints.save(resolved.id, *progress)
+                saved_progress = progress
+
+        def flush_to_sink():
+            nonlocal messages_data, sink_seconds, dedup_checked
+            if duplicates is not None:
+                check_duplicates()
+                if drop_duplicates and duplicate_rows:
+                    messages_data = without_duplicates()
+                duplicate_rows.clear()
+                dedup_checked = 0
+            if media is not None:
+                media.store.attach(resolved.id, messages_data)
+            if len(preview) < PREVIEW_SIZE:
+                preview.extend(messages_data, 0, PREVIEW_SIZE - len(preview))
+            write_started = time.perf_counter()
+            sink.write(channel_link, channel_title, messages_data)
+            sink_seconds += time.perf_counter() - write_started
+            messages_data = MessageBuffer(channel_username)
+
+        for phase, phase_kwargs in plan_history_phases(checkpoint, options):
+            remaining = message_limit - fetched
+            if remaining <= 0:
+                break
+            phase_newest = None
+            phase_oldest = None
+            phase_count = 0
+            if options.get("raw_history"):
+                records = iter_raw_records(
+                    client, entity, scheduler, limit=remaining, max_wait=max_flood_wait, **phase_kwargs
+                )
+            else:
+                records = iter_message_records(
+                    scheduler.iter_messages(client, entity, limit=remaining, max_wait=max_flood_wait, **phase_kwargs)
+                )
+            async for message_id, message_date, text, views, forwards, media_type, reactions, reply_to, replies in records:
+                try:
+                    if mode == "by_date" and message_date:
+                        msg_date = message_date.date() if hasattr(message_date, "date") else message_date
+                        if from_date and msg_date < from_date:
+                            stop_reason = "date"
+                            break
+                        if to_date and msg_date > to_date:
+                            continue
+                    if mode == "by_words":
+                        total_words += len(text.split())
+                        if total_words >= word_limit:
+                            stop_reason = "words"
+                    date_unixtime = int(message_date.timestamp()) if message_date else None
+                    messages_data.append(
+                        message_id, date_unixtime, text, views, forwards, media_type, reactions, reply_to, replies
+                    )
+                    fetched += 1
+                    phase_count += 1
+                    if media is not None and media.wants(media_type):
+                        media.add(client, scheduler, entity, resolved.id, message_id)
+                    if comments is not None and replies:
+                        thread_posts.append((message_id, replies))
+                    if sink and len(messages_data) >= STREAM_CHUNK_SIZE:
+                        flush_to_sink()
+                    elif duplicates is not None and not sink and len(messages_data) - dedup_checked >= DEDUP_CHUNK_SIZE:
+                        check_duplicates()
+                    phase_newest = message_id if phase_newest is None else max(phase_newest, message_id)
+                    phase_oldest = message_id if phase_oldest is None else min(phase_oldest, message_id)
+                    if checkpoints and phase_count == 1 and phase == "full":
+                        progress = (message_id, message_id, False)
+                    elif checkpoints and phase_count == 1 and phase == "forward" and checkpoint is None:
+                        # Проход с самого начала истории: старее первого сообщения ничего нет
+                        progress = (message_id, message_id, True)
+                    if fetched % PROGRESS_EVERY == 0:
+                        if on_progress:
+                            on_progress(fetched, estimate_channel_progress(options, fetched, total_words, message_date))
+                        # Сдвигаем границу по ходу прохода: после сбоя потоковой записи продолжим отсюда
+                        if checkpoints and phase in ("full", "backfill", "forward"):
+                            if phase == "forward":
+                                progress = (phase_newest, progress[1], progress[2])
+                            else:
+                                progress = (progress[0], phase_oldest, False)
+                            # Точка не должна обгонять то, что уже записано на диск
+                            if sink and fetched % CHECKPOINT_EVERY == 0:
+                                flush_to_sink()
+                                sink.flush(channel_link)
+                                save_progress()
+                    if mode == "by_words" and stop_reason == "words":
+                        break
+                except Exception:
+                    continue
+            await records.aclose()
+            limit_reached = phase_count >= remaining
+            # Страниц по HISTORY_PAGE_SIZE, плюс последний запрос, вернувший неполную страницу
+            pages += phase_count // HISTORY_PAGE_SIZE + (0 if limit_reached else 1)
+
+            if checkpoints and phase_newest is not None:
+                if phase == "new" and (stop_reason or limit_reached):
+                    # Новых сообщений больше, чем просили: старый диапазон уже не смыкается с новым
+                    progress = (phase_newest, phase_oldest, True)
+                elif phase in ("new", "forward"):
+                    progress = (phase_newest, progress[1], progress[2])
+                else:
+                    progress = (progress[0], phase_oldest, True)
+            elif checkpoints and phase == "backfill":
+                progress = (progress[0], progress[1], True)
+            if stop_reason or limit_reached:
+                break
+
+        if media is not None:
+            media.flush(resolved.id)
+        comment_buffer = None
+        threads_fetched = 0
+        if comments is not None and thread_posts:
+            comment_buffer, threads_fetched = await scrape_comments(
+                client, entity, resolved.id, channel_username, thread_posts, comments, scheduler, options,
+                max_flood_wait,
+            )
+        if sink:
+            flush_to_sink()
+            sink.flush(channel_link)
+            save_progress()
+            messages_data = preview
+            if comment_buffer is not None:
+                write_started = time.perf_counter()
+                sink.write(channel_link, channel_title, comment_buffer)
+                sink_seconds += time.perf_counter() - write_started
+        elif duplicates is not None:
+            check_duplicates()
+            if drop_duplicates and duplicate_rows:
+                messages_data = without_duplicates()
+        if metrics:
+            metrics.record_channel(channel_link, fetched, pages, time.perf_counter() - started, sink_seconds)
+
+        return {
+            "channel": channel_link,
+            "channel_id": resolved.id,
+            "channel_title": channel_title,
+            "messages": messages_data,
+            "total_messages": fetched - duplicates_found if drop_duplicates else fetched,
+            "streamed": sink is not None,
+            "total_words": total_words if mode == "by_words" else None,
+            "stop_reason": stop_reason,
+            "incremental_since_id": checkpoint["max_id"] if checkpoint else None,
+            # Повторы: сколько найдено и из каких каналов (по самому раннему источнику)
+            "duplicates": duplicates_found if duplicates is not None else None,
+            "duplicate_sources": duplicate_sources,
+            "duplicates_dropped": drop_duplicates,
+            # Комментарии к постам (при потоковой записи — только в файле)
+            "comments": comment_buffer if not sink else None,
+            "total_comments": len(comment_buffer) if comment_buffer is not None else 0,
+            "comment_threads_fetched": threads_fetched,
+            # Диапазон, собранный только в память: сохраняется после завершения запуска (save_checkpoints)
+            "pending_checkpoint": progress if not sink and progress != saved_progress else None,
+        }
+    except (FloodWaitError, UnauthorizedError):
+        if max_flood_wait is not None:
+            raise
+        if metrics:
+            metrics.record_failed_channel()
+        return None
+    except STALE_PEER_ERRORS:
+        if not from_cache or fetched:
+            if metrics:
+                metrics.record_failed_channel()
+            return None
+        entity_cache.invalidate(channel_link)
+    except Exception:
+        if metrics:
+            metrics.record_failed_channel()
+        return None
+    # Сюда доходит только отказ по access_hash из кэша: повтор со свежим get_entity
+    return await scrape_channel(
+        client, channel_link, options, on_progress, checkpoints, sink, None, scheduler, max_flood_wait, metrics,
+        duplicates, media, comments, entity_cache,
+    )
+
+
+async def scrape_channels(
+    client,
+    links,
+    options,
+    log_callback=None,
+    progress_bar=None,
+    channel_progress=None,
+    checkpoints=None,
+    sink=None,
+    resolved=None,
+    scheduler=None,
+    metrics=None,
+    duplicates=None,
+    media=None,
+    comments=None,
+    entity_cache=None,
+):
+    """
+    Параллельно собирает каналы на одном клиенте, не более options["concurrency"] одновременно.
+    Результаты возвращаются в порядке links (каналы с ошибкой пропускаются).
+    resolved — результат resolve_links: для найденных в нём ссылок get_entity не вызывается.
+    entity_cache — кэш resolve_links: устаревшая запись сбрасывается и разрешается заново (см. scrape_channel).
+    scheduler — общий для всех каналов RequestScheduler (по умолчанию создаётся из options["rate_limits"]).
+    channel_progress(idx, link, status, fetched, fraction), status: "queued" / "running" / "done" / "failed".
+    """
+    log = log_callback or (lambda msg: None)
+    scheduler = scheduler or RequestScheduler(options.get("rate_limits"))
+    concurrency = max(1, min(int(options.get("concurrency", DEFAULT_CONCURRENCY)), MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(concurrency)
+    total = len(links)
+    finished = 0
+
+    def report(idx, link, status, fetched=0, fraction=None):
+        if channel_progress:
+            channel_progress(idx, link, status, fetched, fraction)
+
+    for idx, link in enumerate(links):
+        report(idx, link, "queued")
+
+    async def worker(idx, link):
+        nonlocal finished
+        async with semaphore:
+            log(f"🔄 Обработка {idx + 1}/{total}: {link}")
+            report(idx, link, "running")
+            result = await scrape_channel(
+                client,
+                link,
+                options,
+                on_progress=lambda fetched, fraction: report(idx, link, "running", fetched, fraction),
+                checkpoints=checkpoints,
+                sink=sink,
+                resolved=(resolved or {}).get(normalize_channel_link(link)),
+                scheduler=scheduler,
+                metrics=metrics,
+                duplicates=duplicates,
+                media=media,
+                comments=comments,
+                entity_cache=entity_cache,
+            )
+        finished += 1
+        if result:
+            report(idx, link, "done", result["total_messages"], 1.0)
+            if result["total_comments"]:
+                log(f"✅ {result['total_messages']} сообщений, {result['total_comments']} комментариев: {link}")
+            else:
+                log(f"✅ {result['total_messages']} сообщений: {link}")
+        else:
+            report(idx, link, "failed")
+            log(f"⚠️ Не удалось собрать: {link}")
+        if progress_bar:
+            progress_bar.progress(finished / total)
+        return result
+
+    results = await asyncio.gather(*(worker(idx, link) for idx, link in enumerate(links)))
+    return [r for r in results if r]
+
+
+def save_checkpoints(checkpoints, results):
+    """
+    Сохраняет контрольные точки каналов, собранных в память (results — итог scrape_channels),
+    когда запуск завершён. Ключ pending_checkpoint из результатов убирается — в выгрузку он не попадает.
+    """
+    for result in results:
+        progress = result.pop("pending_checkpoint", None)
+        if checkpoints and progress is not None:
+            checkpoints.save(result["channel_id"], *progress)
+
+
+async def run_scraping(api_id, api_hash, session_string, links, options, progress_bar, log_callback,
+                       channel_progress=None, metrics=None, client_manager=None):
+    """
+    Подключается и собирает каналы links. metrics (metrics.ScrapeMetrics) получает время
+    этапов connect / resolve / scrape / export, запросы к API, FloodWait и объём потоковой выгрузки.
+    client_manager (client_manager.ClientManager) даёт уже подключённый клиент сессии и
+    забирает его обратно после сбора; корутина тогда должна идти на loop менеджера.
+    """
+    client = None
+    checkpoints = None
+    entity_cache = None
+    duplicates = None
+    media = None
+    comments = None
+    sink = None
+    scheduler = None
+    scheduler_before = None
+    phase_started = time.perf_counter()
+
+    def end_phase(name):
+        nonlocal phase_started
+        now = time.perf_counter()
+        if metrics:
+            metrics.add_phase(name, now - phase_started)
+        phase_started = now
+
+    try:
+        api_id = int(api_id.strip())
+        if client_manager is not None:
+            client = await client_manager.acquire(api_id, api_hash, session_string)
+        else:
+            client = TelegramClient(
+                StringSession(session_string.strip()),
+                api_id,
+                api_hash.strip(),
+            )
+            await client.connect()
+        if not await client.is_user_authorized():
+            log_callback("❌ Сессия не авторизована.")
+            return None
+        # Контрольные точки, access_hash и лимиты запросов — отдельно для каждого аккаунта
+        me = await client.get_me()
+        # FloodWait любой длины отдаём планировщику, а не спящему внутри Telethon запросу
+        client.flood_sleep_threshold = 0
+        scheduler = get_scheduler(f"user:{me.id}", options.get("rate_limits"))
+        scheduler_before = scheduler.stats()
+        end_phase("connect")
+        if options.get("incremental"):
+            checkpoints = CheckpointStore(options.get("checkpoint_path") or DEFAULT_CHECKPOINT_PATH, scope=me.id)
+        if options.get("entity_cache", True):
+            entity_cache = EntityCache(options.get("entity_cache_path") or DEFAULT_ENTITY_CACHE_PATH, scope=me.id)
+        if options.get("dedup") or options.get("drop_duplicates"):
+            duplicates = DuplicateIndex(options.get("dedup_path") or DEFAULT_DEDUP_PATH, scope=me.id)
+        if options.get("comments"):
+            comments = CommentStore(options.get("comments_path") or DEFAULT_COMMENTS_PATH)
+        if options.get("media"):
+            media = MediaDownloader(
+                MediaStore(options.get("media_db_path") or DEFAULT_MEDIA_DB, options.get("media_dir") or MEDIA_DIR),
+                options,
+                log_callback,
+            )
+
+        # Разрешаем все ссылки заранее: дубликаты отбрасываются, ненайденные каналы видны до начала сбора
+        log_callback(f"🔎 Разрешение ссылок: {len(links)}")
+        resolved, unresolved = await resolve_links(client, links, entity_cache, log_callback, scheduler)
+        for link, reason in unresolved:
+            log_callback(f"❌ Канал не найден: {link} ({reason})")
+        links = [link for link in dedupe_links(links) if link in resolved]
+        end_phase("resolve")
+        if not links:
+            log_callback("❌ Ни одна ссылка не разрешилась.")
+            return None
+        if options.get("stream_format"):
+            # Потоковый режим: сообщения сразу пишутся в файл options["stream_path"]
+            # (повторная попытка задачи дописывает к уже выгруженному — stream_append)
+            sink = open_sink(options["stream_format"], options["stream_path"], options.get("stream_append", False))
+        if progress_bar:
+            progress_bar.progress(0.0)
+        all_results = await scrape_channels(
+            client, links, options, log_callback, progress_bar, channel_progress, checkpoints, sink, resolved, scheduler,
+            metrics, duplicates, media, comments, entity_cache,
+        )
+        end_phase("scrape")
+        if media:
+            await media.finish(all_results)
+            end_phase("media")
+            if metrics:
+                metrics.media = dict(media.stats)
+        save_checkpoints(checkpoints, all_results)
+        if progress_bar:
+            progress_bar.progress(1.0)
+        log_callback(f"✅ Готово. Каналов: {len(all_results)}.")
+        return all_results
+    except ValueError:
+        log_callback("❌ API_ID должен быть числом.")
+        return None
+    except Exception as e:
+        log_callback(f"❌ Ошибка: {e}")
+        return None
+    finally:
+        if sink:
+            sink.close()
+            end_phase("export")
+            if metrics:
+                metrics.export_bytes += path_size(options["stream_path"])
+        if metrics and scheduler:
+            metrics.add_scheduler_stats(scheduler_before, scheduler.stats())
+        if checkpoints:
+            checkpoints.close()
+        if entity_cache:
+            entity_cache.close()
+        if duplicates:
+            duplicates.close()
+        if comments:
+            comments.close()
+        if media:
+            # Недокачанное остаётся в очереди хранилища и продолжится при следующем запуске
+            await media.cancel()
+            media.store.close()
+        if client and client_manager is not None:
+            client_manager.release(client)
+        elif client:
+            await client.disconnect()
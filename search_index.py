@@ -0,0 +1,272 @@
+"""
+Поисковый индекс результата (SQLite FTS5) для браузера сообщений на вкладке результатов.
+Строится один раз на результат из колонок MessageBuffer или Parquet-датасета потоковой
+выгрузки; дальше поиск, фильтры и сортировка идут запросами к файлу индекса,
+а в интерфейс попадает только видимая страница.
+"""
+import os
+import re
+import sqlite3
+from pathlib import Path
+
+from analytics import channel_columns, channel_labels, reactions_per_message
+from checkpoints import DATA_DIR
+from message_buffer import MEDIA_TYPES, NULL
+
+INDEX_DIR = os.path.join(DATA_DIR, "index")
+# Сообщений на странице браузера
+PAGE_SIZE = 50
+# Совпадения считаются до этого числа, дальше — «больше N» (точный count по миллионам строк дорогой)
+COUNT_LIMIT = 10_000
+# По сколько сообщений канала вставляется в индекс за раз
+INSERT_BATCH = 50_000
+# Сортировка: ключ → (подпись, ORDER BY); у каждой колонки сортировки свой индекс
+SORT_ORDERS = {
+    "date": ("Сначала новые", "m.date DESC, m.id DESC"),
+    "date_asc": ("Сначала старые", "m.date ASC, m.id ASC"),
+    "views": ("По просмотрам", "m.views DESC, m.id DESC"),
+    "interactions": ("По пересылкам и реакциям", "m.interactions DESC, m.id DESC"),
+    "engagement": ("По вовлечённости", "m.engagement DESC, m.id DESC"),
+}
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+SCHEMA = """
+CREATE TABLE channels (
+    id INTEGER PRIMARY KEY,
+    label TEXT NOT NULL,
+    username TEXT NOT NULL
+);
+CREATE TABLE messages (
+    id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    date INTEGER,
+    text TEXT NOT NULL,
+    views INTEGER,
+    forwards INTEGER,
+    reactions INTEGER NOT NULL,
+    interactions INTEGER NOT NULL,
+    engagement REAL,
+    media INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE messages_fts USING fts5(
+    text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+"""
+# Индексы создаются после вставки: так сборка быстрее, чем с обновлением индексов на каждую строку
+INDEXES = """
+CREATE INDEX messages_date ON messages (date);
+CREATE INDEX messages_channel_date ON messages (channel_id, date);
+CREATE INDEX messages_media_date ON messages (media, date);
+CREATE INDEX messages_views ON messages (views);
+CREATE INDEX messages_interactions ON messages (interactions);
+CREATE INDEX messages_engagement ON messages (engagement);
+"""
+
+
+def index_path(key, directory=INDEX_DIR):
+    """Где лежит (или будет лежать) индекс результата key."""
+    return os.path.join(directory, f"result_{key}.sqlite3")
+
+
+def _nullable(values):
+    """Массив int64 → список с None вместо NULL."""
+    column = values.astype(object)
+    column[values == NULL] = None
+    return column.tolist()
+
+
+def channel_rows(channel_id, columns, start, stop):
+    """Строки таблицы messages для сообщений канала [start:stop]."""
+    import numpy as np
+
+    views = columns["views"][start:stop]
+    forwards = columns["forwards"][start:stop]
+    offsets = columns["reaction_offsets"][start:stop + 1]
+    reactions = reactions_per_message({"reaction_counts": columns["reaction_counts"], "reaction_offsets": offsets})
+    interactions = np.where(forwards != NULL, forwards, 0) + reactions
+    # Вовлечённость — как в analytics.channel_summary: (пересылки + реакции) / просмотры
+    engagement = np.full(len(views), None, dtype=object)
+    has_views = views > 0
+    engagement[has_views] = (interactions[has_views] / views[has_views]).tolist()
+    return zip(
+        [channel_id] * len(views),
+        columns["ids"][start:stop].tolist(),
+        _nullable(columns["date"][start:stop]),
+        columns["texts"][start:stop],
+        _nullable(views),
+        _nullable(forwards),
+        reactions.tolist(),
+        interactions.tolist(),
+        engagement.tolist(),
+        columns["media"][start:stop].tolist(),
+    )
+
+
+def build_index(results, path, stream_path=None):
+    """
+    Пишет индекс результата в файл path. При потоковой Parquet-выгрузке сообщения
+    берутся из датасета stream_path. Возвращает число проиндексированных сообщений.
+    """
+    conn = sqlite3.connect(path)
+    total = 0
+    try:
+        # Файл собирается целиком и подменяется атомарно — журнал и fsync не нужны
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.executescript(SCHEMA)
+        for channel_id, (label, ch) in enumerate(zip(channel_labels(results), results)):
+            columns = channel_columns(ch, stream_path)
+            if columns is None:
+                continue
+            conn.execute(
+                "INSERT INTO channels (id, label, username) VALUES (?, ?, ?)",
+                (channel_id, label, ch["messages"].channel_username),
+            )
+            count = len(columns["ids"])
+            for start in range(0, count, INSERT_BATCH):
+                conn.executemany(
+                    "INSERT INTO messages (channel_id, message_id, date, text, views, forwards, reactions,"
+                    " interactions, engagement, media) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    channel_rows(channel_id, columns, start, min(start + INSERT_BATCH, count)),
+                )
+            total += count
+        conn.executescript(INDEXES)
+        conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    return total
+
+
+def cached_index(results, key, stream_path=None, directory=INDEX_DIR):
+    """
+    Файл индекса результата key (например, id задачи). Строится только при первом
+    запросе и дальше берётся с диска; запись атомарная.
+    """
+    path = index_path(key, directory)
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            build_index(results, tmp_path, stream_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return path
+
+
+def fts_query(text):
+    """
+    Запрос FTS5 из строки поиска: все слова должны встретиться (регистр не важен).
+    Кавычки и операторы FTS5 из ввода не пробрасываются.
+    """
+    tokens = _TOKEN_PATTERN.findall(text or "")
+    return " ".join(f'"{token}"' for token in tokens) or None
+
+
+class MessageIndex:
+    """Поиск по готовому файлу индекса (только чтение)."""
+
+    def __init__(self, path):
+        self.path = path
+        uri = Path(path).absolute().as_uri() + "?mode=ro"
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    def channels(self):
+        """Подписи каналов в порядке результата."""
+        return [row[0] for row in self._conn.execute("SELECT label FROM channels ORDER BY id")]
+
+    def date_range(self):
+        """(первая, последняя) дата сообщений, unixtime; (None, None) для пустого индекса."""
+        return self._conn.execute("SELECT min(date), max(date) FROM messages").fetchone()
+
+    def _filters(self, channels=(), date_from=None, date_to=None, media_types=(), min_views=0):
+        """
+        Условия фильтров (без поиска по тексту) и параметры. date_from / date_to — unixtime,
+        date_to не включается; channels — подписи каналов, media_types — имена из MEDIA_TYPES.
+        """
+        clauses = []
+        params = []
+        if channels:
+            # id каналов подставляются сразу: так планировщик может взять индекс (channel_id, date)
+            channel_ids = dict(self._conn.execute("SELECT label, id FROM channels"))
+            clauses.append(f"m.channel_id IN ({', '.join('?' * len(channels))})")
+            params.extend(channel_ids.get(label, -1) for label in channels)
+        if date_from is not None:
+            clauses.append("m.date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append("m.date < ?")
+            params.append(date_to)
+        if media_types:
+            clauses.append(f"m.media IN ({', '.join('?' * len(media_types))})")
+            params.extend(MEDIA_TYPES.index(name) for name in media_types)
+        if min_views:
+            clauses.append("m.views >= ?")
+            params.append(min_views)
+        return clauses, params
+
+    def count(self, query=None, limit=COUNT_LIMIT, **filters):
+        """Число совпадений, но не больше limit + 1 (limit + 1 значит «больше limit»)."""
+        clauses, params = self._filters(**filters)
+        match = fts_query(query)
+        if match:
+            # Совпадения идут из FTS по порядку, остальные условия проверяются по первичному ключу
+            source = "messages_fts f JOIN messages m ON m.id = f.rowid"
+            clauses.insert(0, "messages_fts MATCH ?")
+            params.insert(0, match)
+        else:
+            source = "messages m"
+        return self._conn.execute(
+            f"SELECT count(*) FROM (SELECT 1 FROM {source} WHERE {' AND '.join(clauses) or '1'} LIMIT ?)",
+            [*params, limit + 1],
+        ).fetchone()[0]
+
+    def search(self, query=None, order="date", page=0, page_size=PAGE_SIZE, matches=None, **filters):
+        """
+        Страница совпадений (номер page с нуля) таблицей для st.dataframe; filters — как у count.
+        matches — уже посчитанный count, от него зависит план запроса.
+        """
+        import pandas as pd
+
+        if matches is None:
+            matches = self.count(query, **filters)
+        clauses, params = self._filters(**filters)
+        match = fts_query(query)
+        if match:
+            if matches <= COUNT_LIMIT:
+                # Совпадений немного: берём их из FTS и сортируем целиком
+                clauses.insert(0, "m.id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+            else:
+                # Совпадений много: идём по индексу сортировки и проверяем слово для каждой строки,
+                # пока не наберётся страница, — без сортировки миллионов совпадений
+                clauses.insert(0, "EXISTS (SELECT 1 FROM messages_fts f WHERE messages_fts MATCH ? AND f.rowid = m.id)")
+            params.insert(0, match)
+        rows = self._conn.execute(
+            f"""
+            SELECT c.label, m.date, m.text, m.views, m.forwards, m.reactions, m.engagement, m.media,
+                   'https://t.me/' || c.username || '/' || m.message_id
+            FROM messages m JOIN channels c ON c.id = m.channel_id
+            WHERE {' AND '.join(clauses) or '1'}
+            ORDER BY {SORT_ORDERS[order][1]}
+            LIMIT ? OFFSET ?
+            """,
+            [*params, page_size, page * page_size],
+        ).fetchall()
+        frame = pd.DataFrame(
+            rows,
+            columns=["Канал", "Дата", "Текст", "Просмотры", "Пересылки", "Реакции", "Вовлечённость, %", "Медиа", "Ссылка"],
+        )
+        frame["Дата"] = pd.to_datetime(frame["Дата"], unit="s", utc=True).dt.strftime("%Y-%m-%d %H:%M")
+        frame["Просмотры"] = frame["Просмотры"].astype("Int64")
+        frame["Пересылки"] = frame["Пересылки"].astype("Int64")
+        frame["Вовлечённость, %"] = (100 * frame["Вовлечённость, %"].astype(float)).round(2)
+        frame["Медиа"] = [MEDIA_TYPES[code] for code in frame["Медиа"]]
+        return frame
+
+    def close(self):
+        self._conn.close()
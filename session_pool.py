@@ -0,0 +1,330 @@
+"""
+Пул сессий: каналы распределяются между несколькими аккаунтами с перехватом работы
+(work stealing). Сессия с долгим FloodWait или потерявшая авторизацию выводится из ротации,
+а её каналы достаются остальным.
+"""
+import asyncio
+import time
+from collections import deque
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError, UnauthorizedError
+from telethon.sessions import StringSession
+
+from checkpoints import DEFAULT_CHECKPOINT_PATH, CheckpointStore
+from comments import DEFAULT_COMMENTS_PATH, CommentStore
+from dedup import DEFAULT_DEDUP_PATH, DuplicateIndex
+from entity_cache import DEFAULT_ENTITY_CACHE_PATH, EntityCache, ResolvedEntity
+from export import open_sink, path_size
+from media import DEFAULT_MEDIA_DB, MEDIA_DIR, MediaDownloader, MediaStore
+from rate_limit import get_scheduler
+from scraper import DEFAULT_CONCURRENCY, MAX_CONCURRENCY, dedupe_links, save_checkpoints, scrape_channel
+
+# FloodWait дольше этого выводит сессию из ротации: её каналы быстрее соберут другие
+POOL_MAX_FLOOD_WAIT = 120
+
+
+def pool_scope(api_id, pool_id=None):
+    """
+    scope контрольных точек и индекса повторов пула. Не зависит от состава сессий:
+    добавленная или выведенная сессия не обнуляет точки и кластеры. По умолчанию —
+    API_ID (все сессии пула работают с ним); pool_id (options["pool_id"]) разделяет пулы одного API_ID.
+    """
+    return f"pool:{pool_id}" if pool_id else f"pool:api:{api_id}"
+
+
+class PoolMember:
+    """Одна сессия пула: клиент, планировщик и кэши её аккаунта."""
+
+    def __init__(self, name, client, me, options, client_manager=None):
+        self.name = name
+        self.client = client
+        self.client_manager = client_manager
+        self.me = me
+        self.scheduler = get_scheduler(f"user:{me.id}", options.get("rate_limits"))
+        self.entity_cache = None
+        if options.get("entity_cache", True):
+            self.entity_cache = EntityCache(options.get("entity_cache_path") or DEFAULT_ENTITY_CACHE_PATH, scope=me.id)
+        self.queue = deque()
+        self.active = True
+        self.done = 0
+
+    async def resolve(self, link):
+        """ResolvedEntity для этого аккаунта (access_hash у каждого аккаунта свой)."""
+        cached = self.entity_cache.get(link) if self.entity_cache else None
+        if cached:
+            return cached
+        entity = await self.scheduler.call("resolve", self.client.get_entity, link, max_wait=POOL_MAX_FLOOD_WAIT)
+        resolved = ResolvedEntity.from_entity(entity, link)
+        if self.entity_cache:
+            self.entity_cache.put(link, resolved)
+        return resolved
+
+    async def close(self):
+        if self.entity_cache:
+            self.entity_cache.close()
+        await release_client(self.client, self.client_manager)
+
+
+async def release_client(client, client_manager=None):
+    """Отдаёт клиента менеджеру (client_manager.ClientManager) или отключает."""
+    if client_manager is not None:
+        client_manager.release(client)
+    else:
+        await client.disconnect()
+
+
+async def connect_members(api_id, api_hash, session_strings, options, log_callback, client_manager=None):
+    """
+    Подключает сессии; неавторизованные и повторяющиеся аккаунты пропускаются.
+    client_manager — как у scraper.run_scraping: клиенты берутся уже подключёнными.
+    """
+    members = []
+    seen_accounts = set()
+    for number, session_string in enumerate(session_strings, start=1):
+        client = None
+        try:
+            if client_manager is not None:
+                client = await client_manager.acquire(api_id, api_hash, session_string)
+            else:
+                client = TelegramClient(StringSession(session_string.strip()), api_id, api_hash.strip())
+                await client.connect()
+            if not await client.is_user_authorized():
+                log_callback(f"⚠️ Сессия #{number} не авторизована — пропущена.")
+                await release_client(client, client_manager)
+                continue
+            me = await client.get_me()
+        except Exception as e:
+            log_callback(f"⚠️ Сессия #{number} недоступна: {e}")
+            if client is not None:
+                await release_client(client, client_manager)
+            continue
+        if me.id in seen_accounts:
+            log_callback(f"⚠️ Сессия #{number} — тот же аккаунт, что и раньше, пропущена.")
+            await release_client(client, client_manager)
+            continue
+        seen_accounts.add(me.id)
+        client.flood_sleep_threshold = 0
+        members.append(
+            PoolMember(f"#{number} ({getattr(me, 'username', None) or me.id})", client, me, options, client_manager)
+        )
+    return members
+
+
+async def scrape_with_pool(members, links, options, log_callback, progress_bar=None, channel_progress=None,
+                           checkpoints=None, sink=None, metrics=None, duplicates=None, media=None,
+                           comments=None):
+    """
+    Каналы раздаются по очередям сессий по кругу. Освободившийся воркер берёт канал
+    из своей очереди, затем из общей очереди «осиротевших» каналов, затем крадёт
+    с хвоста самой длинной очереди другой сессии. Результаты — в порядке links.
+    В потоковом режиме канал, переданный другой сессии, собирается заново,
+    поэтому в файле возможны повторы его первых сообщений.
+    """
+    total = len(links)
+    results = [None] * total
+    orphans = deque()
+    finished = 0
+    in_flight = 0
+    concurrency = max(1, min(int(options.get("concurrency", DEFAULT_CONCURRENCY)), MAX_CONCURRENCY))
+
+    def report(idx, link, status, fetched=0, fraction=None):
+        if channel_progress:
+            channel_progress(idx, link, status, fetched, fraction)
+
+    for position, (idx, link) in enumerate(enumerate(links)):
+        members[position % len(members)].queue.append((idx, link))
+        report(idx, link, "queued")
+
+    def next_task(member):
+        if member.queue:
+            return member.queue.popleft()
+        if orphans:
+            return orphans.popleft()
+        victims = [m for m in members if m is not member and m.queue]
+        if victims:
+            return max(victims, key=lambda m: len(m.queue)).queue.pop()
+        return None
+
+    def retire(member, reason):
+        if not member.active:
+            return
+        member.active = False
+        log_callback(f"⛔ Сессия {member.name} выведена из ротации: {reason}. Каналов передано другим: {len(member.queue)}")
+        orphans.extend(member.queue)
+        member.queue.clear()
+
+    def finish(idx, link, result):
+        nonlocal finished
+        finished += 1
+        if result:
+            results[idx] = result
+            report(idx, link, "done", result["total_messages"], 1.0)
+            log_callback(f"✅ {result['total_messages']} сообщений: {link}")
+        else:
+            report(idx, link, "failed")
+            log_callback(f"⚠️ Не удалось собрать: {link}")
+        if progress_bar:
+            progress_bar.progress(finished / total)
+
+    async def worker(member):
+        nonlocal in_flight
+        while member.active:
+            task = next_task(member)
+            if task is None:
+                # Очереди пусты, но чужой канал ещё может вернуться в orphans
+                if in_flight == 0:
+                    return
+                await asyncio.sleep(0.1)
+                continue
+            idx, link = task
+            in_flight += 1
+            try:
+                result = await run_task(member, idx, link)
+            finally:
+                in_flight -= 1
+            if result is False:
+                return
+
+    async def run_task(member, idx, link):
+        """Собирает один канал; False — сессия выведена из ротации."""
+        report(idx, link, "running")
+        log_callback(f"🔄 {member.name}: {link}")
+        try:
+            try:
+                resolved = await member.resolve(link)
+            except (FloodWaitError, UnauthorizedError):
+                raise
+            except Exception as e:
+                log_callback(f"❌ Канал не найден: {link} ({e})")
+                finish(idx, link, None)
+                return None
+            result = await scrape_channel(
+                member.client,
+                link,
+                options,
+                on_progress=lambda fetched, fraction: report(idx, link, "running", fetched, fraction),
+                checkpoints=checkpoints,
+                sink=sink,
+                resolved=resolved,
+                scheduler=member.scheduler,
+                max_flood_wait=POOL_MAX_FLOOD_WAIT,
+                metrics=metrics,
+                duplicates=duplicates,
+                media=media,
+                comments=comments,
+                entity_cache=member.entity_cache,
+            )
+        except FloodWaitError as e:
+            orphans.appendleft((idx, link))
+            report(idx, link, "queued")
+            retire(member, f"FloodWait {e.seconds} с")
+            return False
+        except UnauthorizedError as e:
+            orphans.appendleft((idx, link))
+            report(idx, link, "queued")
+            retire(member, f"сессия не авторизована ({type(e).__name__})")
+            return False
+        member.done += 1
+        finish(idx, link, result)
+        return result
+
+    await asyncio.gather(*(worker(member) for member in members for _ in range(concurrency)))
+
+    # Если из ротации выпали все сессии, оставшиеся каналы собрать некому
+    for idx, link in orphans:
+        finish(idx, link, None)
+    for member in members:
+        log_callback(f"👤 Сессия {member.name}: каналов {member.done}{'' if member.active else ' (выведена из ротации)'}")
+    return [r for r in results if r]
+
+
+async def run_scraping_pool(api_id, api_hash, session_strings, links, options, progress_bar, log_callback,
+                            channel_progress=None, metrics=None, client_manager=None):
+    """Как scraper.run_scraping, но каналы собирают все сессии из session_strings."""
+    members = []
+    checkpoints = None
+    duplicates = None
+    media = None
+    comments = None
+    sink = None
+    scheduler_before = {}
+    phase_started = time.perf_counter()
+
+    def end_phase(name):
+        nonlocal phase_started
+        now = time.perf_counter()
+        if metrics:
+            metrics.add_phase(name, now - phase_started)
+        phase_started = now
+
+    try:
+        api_id = int(api_id.strip())
+        members = await connect_members(api_id, api_hash, session_strings, options, log_callback, client_manager)
+        end_phase("connect")
+        if not members:
+            log_callback("❌ Ни одна сессия пула не авторизована.")
+            return None
+        scheduler_before = {member.name: member.scheduler.stats() for member in members}
+        log_callback(f"👥 Сессий в пуле: {len(members)}")
+        # id каналов общие для всех аккаунтов: точки и повторы пула не зависят от того, какая сессия собирала канал
+        scope = pool_scope(api_id, (options.get("pool_id") or "").strip())
+        if options.get("incremental"):
+            checkpoints = CheckpointStore(options.get("checkpoint_path") or DEFAULT_CHECKPOINT_PATH, scope=scope)
+        if options.get("dedup") or options.get("drop_duplicates"):
+            duplicates = DuplicateIndex(options.get("dedup_path") or DEFAULT_DEDUP_PATH, scope=scope)
+        if options.get("comments"):
+            comments = CommentStore(options.get("comments_path") or DEFAULT_COMMENTS_PATH)
+        if options.get("media"):
+            media = MediaDownloader(
+                MediaStore(options.get("media_db_path") or DEFAULT_MEDIA_DB, options.get("media_dir") or MEDIA_DIR),
+                options,
+                log_callback,
+            )
+        if options.get("stream_format"):
+            sink = open_sink(options["stream_format"], options["stream_path"], options.get("stream_append", False))
+        if progress_bar:
+            progress_bar.progress(0.0)
+        all_results = await scrape_with_pool(
+            members, dedupe_links(links), options, log_callback, progress_bar, channel_progress, checkpoints, sink,
+            metrics, duplicates, media, comments,
+        )
+        end_phase("scrape")
+        if media:
+            # Файлы качает клиент той сессии, что собирала канал: ждём их до отключения сессий
+            await media.finish(all_results)
+            end_phase("media")
+            if metrics:
+                metrics.media = dict(media.stats)
+        save_checkpoints(checkpoints, all_results)
+        if progress_bar:
+            progress_bar.progress(1.0)
+        log_callback(f"✅ Готово. Каналов: {len(all_results)}.")
+        return all_results
+    except ValueError:
+        log_callback("❌ API_ID должен быть числом.")
+        return None
+    except Exception as e:
+        log_callback(f"❌ Ошибка: {e}")
+        return None
+    finally:
+        if sink:
+            sink.close()
+            end_phase("export")
+            if metrics:
+                metrics.export_bytes += path_size(options["stream_path"])
+        if metrics:
+            for member in members:
+                if member.name in scheduler_before:
+                    metrics.add_scheduler_stats(scheduler_before[member.name], member.scheduler.stats())
+        if checkpoints:
+            checkpoints.close()
+        if duplicates:
+            duplicates.close()
+        if comments:
+            comments.close()
+        if media:
+            await media.cancel()
+            media.store.close()
+        for member in members:
+            await member.close()
@@ -0,0 +1,37 @@
+"""Общие фикстуры тестов: модули проекта лежат в корне репозитория, клиент — benchmarks.fake_client."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_client import FakeClient  # noqa: E402
+
+
+class CrashingClient(FakeClient):
+    """FakeClient, который обрывает историю после crash_after сообщений — как упавший процесс."""
+
+    def __init__(self, messages_per_channel, crash_after):
+        super().__init__(messages_per_channel, page_latency=0, resolve_latency=0)
+        self.crash_after = crash_after
+
+    async def _iter_fake_messages(self, entity, *args):
+        count = 0
+        async for message in super()._iter_fake_messages(entity, *args):
+            count += 1
+            if count > self.crash_after:
+                raise RuntimeError("обрыв соединения")
+            yield message
+
+
+@pytest.fixture
+def fake_client():
+    """Фабрика FakeClient без задержек: fake_client(n) или fake_client(n, crash_after=k)."""
+
+    def make(messages_per_channel, crash_after=None):
+        if crash_after is not None:
+            return CrashingClient(messages_per_channel, crash_after)
+        return FakeClient(messages_per_channel, page_latency=0, resolve_latency=0)
+
+    return make
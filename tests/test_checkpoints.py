@@ -0,0 +1,40 @@
+import asyncio
+
+from checkpoints import CheckpointStore
+from scraper import save_checkpoints, scrape_channel
+
+OPTIONS = {"mode": "by_count", "message_limit": 10 ** 6, "rate_limits": {"history": None, "resolve": None}}
+
+
+def test_save_get_reset_by_scope(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite3")
+    store = CheckpointStore(path, scope=1)
+    other = CheckpointStore(path, scope=2)
+    store.save(10, 500, 1, True)
+    assert store.get(10)["max_id"] == 500
+    assert store.get(10)["backfill_done"] is True
+    assert other.get(10) is None
+    store.save(10, 700, 1, False)
+    assert store.get(10)["max_id"] == 700
+    store.reset(10)
+    assert store.get(10) is None
+
+
+def test_incremental_run_fetches_only_new_messages(tmp_path, fake_client):
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite3"), scope=1)
+    first = asyncio.run(scrape_channel(fake_client(1000), "chan", OPTIONS, checkpoints=store))
+    # Без потоковой записи точка сохраняется только после всего запуска
+    assert store.get(first["channel_id"]) is None
+    save_checkpoints(store, [first])
+    assert "pending_checkpoint" not in first
+    second = asyncio.run(scrape_channel(fake_client(1200), "chan", OPTIONS, checkpoints=store))
+    assert second["total_messages"] == 200
+    save_checkpoints(store, [second])
+    assert store.get(second["channel_id"])["max_id"] == 1200
+
+
+def test_in_memory_crash_saves_no_checkpoint(tmp_path, fake_client):
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite3"), scope=1)
+    result = asyncio.run(scrape_channel(fake_client(25_000, crash_after=15_500), "chan", OPTIONS, checkpoints=store))
+    assert result is None
+    assert store._conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0] == 0
@@ -0,0 +1,64 @@
+import asyncio
+import dataclasses
+
+from telethon.errors import ChannelInvalidError
+
+from benchmarks.fake_client import FakeClient
+from entity_cache import EntityCache, ResolvedEntity
+from scraper import resolve_links, scrape_channels
+
+OPTIONS = {"mode": "by_count", "message_limit": 300, "rate_limits": {"history": None, "resolve": None}}
+
+
+class StrictClient(FakeClient):
+    """FakeClient, который, как Telegram, отвергает историю по неверному access_hash."""
+
+    async def _iter_fake_messages(self, entity, *args):
+        if entity.access_hash != entity.channel_id * 31:
+            raise ChannelInvalidError(request=None)
+        async for message in super()._iter_fake_messages(entity, *args):
+            yield message
+
+
+def resolved_entity(client, link):
+    return ResolvedEntity.from_entity(asyncio.run(client.get_entity(link)), link)
+
+
+def test_put_get_invalidate_by_scope(tmp_path, fake_client):
+    path = str(tmp_path / "entities.sqlite3")
+    cache = EntityCache(path, scope=1)
+    entity = resolved_entity(fake_client(10), "chan")
+    cache.put("Chan", entity)
+    assert cache.get("chan") == entity
+    assert EntityCache(path, scope=2).get("chan") is None
+    assert EntityCache(path, scope=1, ttl=-1).get("chan") is None
+    cache.invalidate("CHAN")
+    assert cache.get("chan") is None
+
+
+def test_cache_hit_skips_get_entity(tmp_path, fake_client):
+    cache = EntityCache(str(tmp_path / "entities.sqlite3"), scope=1)
+    client = fake_client(10)
+    asyncio.run(resolve_links(client, ["chan"], cache))
+    resolved, unresolved = asyncio.run(resolve_links(client, ["chan"], cache))
+    assert client.resolve_calls == 1
+    assert list(resolved) == ["chan"] and not unresolved
+
+
+def test_stale_access_hash_is_resolved_again(tmp_path):
+    cache = EntityCache(str(tmp_path / "entities.sqlite3"), scope=1)
+    client = StrictClient(500, page_latency=0, resolve_latency=0)
+    fresh = resolved_entity(client, "chan")
+    cache.put("chan", dataclasses.replace(fresh, access_hash=123))
+
+    async def run():
+        resolved, _ = await resolve_links(client, ["chan"], cache)
+        return await scrape_channels(client, ["chan"], OPTIONS, resolved=resolved, entity_cache=cache)
+
+    (result,) = asyncio.run(run())
+    assert result["total_messages"] == 300
+    assert cache.get("chan") == fresh
+    assert client.resolve_calls == 2
+    # Следующий запуск берёт уже свежую запись и не разрешает канал заново
+    asyncio.run(run())
+    assert client.resolve_calls == 2
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import jobs
+from checkpoints import CheckpointStore
+from export import open_sink
+from jobs import CredentialVault, JobStore, dump_results, load_results
+from scraper import CHECKPOINT_EVERY, scrape_channel
+
+CREDENTIALS = {"api_id": 1, "api_hash": "secret-hash", "sessions": ["secret-session"]}
+
+
+class SlowPickle:
+    """Объект, который сериализуется долго: запись результата дольше пульса воркера."""
+
+    def __reduce__(self):
+        time.sleep(0.3)
+        return SlowPickle, ()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"), vault=CredentialVault())
+    yield store
+    store.close()
+
+
+def submit(store, **options):
+    return store.submit("owner", {**CREDENTIALS, "links": ["chan"], "options": options})
+
+
+def test_credentials_stay_out_of_database(store):
+    job_id = submit(store)
+    (params,) = store._conn.execute("SELECT params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    assert b"secret-hash" not in params and b"secret-session" not in params
+    assert store.credentials(job_id) == CREDENTIALS
+    store.finish(job_id, "failed", error="x")
+    assert store.credentials(job_id) is None
+
+
+def test_submit_requires_vault(tmp_path):
+    with pytest.raises(RuntimeError):
+        submit(JobStore(str(tmp_path / "jobs.sqlite3")))
+
+
+def test_cancel_queued_job_discards_credentials(store):
+    job_id = submit(store)
+    store.request_cancel(job_id)
+    assert store.get(job_id)["status"] == "cancelled"
+    assert store.credentials(job_id) is None
+
+
+def test_retry_of_requeued_job_appends_stream(store):
+    job_id = submit(store, stream_path="x.jsonl")
+    assert store.claim("worker-1") == (job_id, {"links": ["chan"], "options": {"stream_path": "x.jsonl"}})
+    assert store.claim("worker-2") is None
+    store._conn.execute("UPDATE jobs SET heartbeat_at = 0 WHERE id = ?", (job_id,))
+    assert store.requeue_stale() == 1
+    claimed_id, params = store.claim("worker-2")
+    assert claimed_id == job_id
+    assert params["options"]["stream_append"] is True
+
+
+def test_requeued_job_keeps_streamed_messages(store, tmp_path, fake_client):
+    """Повтор задачи после падения воркера не стирает то, что записала первая попытка."""
+    checkpoints = CheckpointStore(str(tmp_path / "checkpoints.sqlite3"), scope=1)
+    stream_path = str(tmp_path / "stream.jsonl")
+    options = {
+        "mode": "from_start",
+        "message_limit": 10 ** 6,
+        "rate_limits": {"history": None, "resolve": None},
+        "stream_format": "jsonl",
+        "stream_path": stream_path,
+    }
+    submit(store, **options)
+
+    async def attempt(client, options):
+        sink = open_sink(options["stream_format"], options["stream_path"], options.get("stream_append", False))
+        try:
+            return await scrape_channel(client, "chan", options, checkpoints=checkpoints, sink=sink)
+        finally:
+            sink.close()
+
+    _, params = store.claim("worker-1")
+    assert asyncio.run(attempt(fake_client(25_000, crash_after=15_500), params["options"])) is None
+    store._conn.execute("UPDATE jobs SET heartbeat_at = 0")
+    store.requeue_stale()
+    _, params = store.claim("worker-2")
+    result = asyncio.run(attempt(fake_client(25_000), params["options"]))
+    assert result["total_messages"] == 25_000 - CHECKPOINT_EVERY
+    with open(stream_path, encoding="utf-8") as f:
+        ids = {json.loads(line)["id"] for line in f}
+    assert ids == set(range(1, 25_001))
+
+
+def test_dump_results_sends_heartbeats(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "HEARTBEAT_INTERVAL", 0.05)
+    job_id = submit(store)
+    store.claim("worker-1")
+    store._conn.execute("UPDATE jobs SET heartbeat_at = 0 WHERE id = ?", (job_id,))
+    path = str(tmp_path / f"{job_id}.pkl.gz")
+    dump_results(store, job_id, [{"channel": "chan", "slow": SlowPickle()}], path)
+    assert store.requeue_stale(stale_after=60) == 0
+    assert load_results(path)[0]["channel"] == "chan"
+    assert not (tmp_path / f"{job_id}.pkl.gz.tmp").exists()
@@ -0,0 +1,44 @@
+import multiprocessing
+
+import media
+from media import MediaStore
+
+MESSAGES = list(range(1, 2001))
+
+
+def queue_in_process(args):
+    path, directory = args
+    store = MediaStore(path, directory)
+    try:
+        return store.queue(7, MESSAGES)
+    finally:
+        store.close()
+
+
+def test_queue_returns_only_new_messages(tmp_path):
+    store = MediaStore(str(tmp_path / "media.sqlite3"), str(tmp_path))
+    assert store.queue(7, [1, 2, 2, 3]) == [1, 2, 3]
+    assert store.queue(7, [3, 4]) == [4]
+    assert store.queue(8, [3]) == [3]
+    assert store.pending(7) == [1, 2, 3, 4]
+
+
+def test_concurrent_queue_gives_each_message_to_one_process(tmp_path):
+    path = str(tmp_path / "media.sqlite3")
+    MediaStore(path, str(tmp_path)).close()
+    with multiprocessing.Pool(4) as pool:
+        queued = pool.map(queue_in_process, [(path, str(tmp_path))] * 4)
+    ids = [message_id for part in queued for message_id in part]
+    assert sorted(ids) == MESSAGES
+
+
+def test_claim_is_exclusive_until_released_or_stale(tmp_path, monkeypatch):
+    store = MediaStore(str(tmp_path / "media.sqlite3"), str(tmp_path))
+    assert store.claim("file", "a")
+    assert store.claim("file", "a")
+    assert not store.claim("file", "b")
+    store.release("file", "a")
+    assert store.claim("file", "b")
+    # Отметка владельца, который давно не обновлял её, перехватывается
+    monkeypatch.setattr(media, "CLAIM_STALE", -1)
+    assert store.claim("file", "a")
@@ -0,0 +1,67 @@
+import gzip
+import pickle
+
+import pytest
+
+from benchmarks.bench_suite import build_results
+from result_store import PREVIEW_ROWS, ResultStore, results_nbytes
+
+
+@pytest.fixture
+def result_files(tmp_path):
+    """Файлы результатов задач, как их пишет jobs.dump_results: два небольших и один большой."""
+    paths = {}
+    for key, size in (("a", 2000), ("b", 2000), ("big", 20_000)):
+        paths[key] = str(tmp_path / f"{key}.pkl.gz")
+        with gzip.open(paths[key], "wb") as f:
+            pickle.dump(build_results(size, 1), f)
+    return paths
+
+
+def test_preview_and_hits(result_files):
+    store = ResultStore(budget_bytes=10 * 2 ** 20)
+    preview = store.open("a", "owner", result_files["a"])
+    assert len(preview[0]["messages"]) == PREVIEW_ROWS
+    assert len(store.results("a")[0]["messages"]) == 2000
+    store.results("a")
+    usage = store.usage()
+    assert (usage["loads"], usage["hits"]) == (1, 2)
+    assert usage["owners"]["owner"]["resident"] == 1
+
+
+def test_lru_spill_under_budget(result_files):
+    small = results_nbytes(build_results(2000, 1))
+    store = ResultStore(budget_bytes=int(small * 1.5))
+    store.open("a", "owner", result_files["a"])
+    store.open("b", "owner", result_files["b"])
+    usage = store.usage()
+    assert usage["resident"] == 1 and usage["bytes"] <= usage["budget"]
+    # Выгруженный результат читается с диска заново, предпросмотр остаётся в памяти
+    assert len(store.preview("a")[0]["messages"]) == PREVIEW_ROWS
+    assert len(store.results("a")[0]["messages"]) == 2000
+    assert store.usage()["loads"] == 3
+
+
+def test_large_result_stays_resident(result_files):
+    small = results_nbytes(build_results(2000, 1))
+    store = ResultStore(budget_bytes=int(small * 2.5))
+    store.open("a", "owner", result_files["a"])
+    store.open("b", "owner", result_files["b"])
+    store.open("big", "owner", result_files["big"])
+    store.results("big")
+    store.results("big")
+    usage = store.usage()
+    assert usage["loads"] == 3
+    assert usage["resident"] == 1 and usage["bytes"] > usage["budget"]
+    # Следующий результат вытесняет большой, и бюджет снова соблюдается
+    store.results("a")
+    usage = store.usage()
+    assert usage["resident"] == 1 and usage["bytes"] <= usage["budget"]
+
+
+def test_idle_results_are_spilled(result_files):
+    store = ResultStore(budget_bytes=10 * 2 ** 20, idle_ttl=60)
+    store.open("a", "owner", result_files["a"])
+    store.spill_idle(now=10 ** 12)
+    usage = store.usage()
+    assert (usage["resident"], usage["bytes"], usage["spills"]) == (0, 0, 1)
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import export
+from analytics import channel_columns
+from benchmarks.bench_suite import build_results
+from checkpoints import CheckpointStore
+from export import open_sink, partition_dir, partition_parts
+from scraper import CHECKPOINT_EVERY, scrape_channel
+
+OPTIONS = {"mode": "from_start", "message_limit": 10 ** 6, "rate_limits": {"history": None, "resolve": None}}
+EXTENSIONS = {"jsonl": "jsonl", "csv": "csv", "parquet": "parquet"}
+
+
+def stream_ids(stream_format, path):
+    """id сообщений потоковой выгрузки в порядке записи."""
+    if stream_format == "jsonl":
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line)["id"] for line in f]
+    if stream_format == "csv":
+        return pd.read_csv(path, encoding="utf-8-sig")["message_id"].tolist()
+    return channel_columns({"channel": "chan"}, path)["ids"].tolist()
+
+
+async def scrape(client, stream_format, path, store, append=False, close=True):
+    """Собирает канал в поток; close=False — процесс «упал», не закрыв выгрузку."""
+    sink = open_sink(stream_format, path, append)
+    try:
+        return await scrape_channel(client, "chan", OPTIONS, checkpoints=store, sink=sink)
+    finally:
+        if close:
+            sink.close()
+
+
+@pytest.mark.parametrize("stream_format", ["jsonl", "csv", "parquet"])
+def test_crash_then_resume_has_no_gaps(tmp_path, fake_client, stream_format):
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite3"), scope=1)
+    path = str(tmp_path / f"stream.{EXTENSIONS[stream_format]}")
+    crashed = asyncio.run(scrape(fake_client(25_000, crash_after=15_500), stream_format, path, store, close=False))
+    assert crashed is None
+    # Точка не обгоняет то, что уже на диске: последний сброс — на CHECKPOINT_EVERY сообщениях
+    (checkpoint,) = store._conn.execute("SELECT max_id, min_id FROM checkpoints").fetchall()
+    assert checkpoint == (CHECKPOINT_EVERY, 1)
+    assert set(range(1, CHECKPOINT_EVERY + 1)) <= set(stream_ids(stream_format, path))
+
+    resumed = asyncio.run(scrape(fake_client(25_000), stream_format, path, store, append=True))
+    assert resumed["total_messages"] == 25_000 - CHECKPOINT_EVERY
+    assert set(stream_ids(stream_format, path)) == set(range(1, 25_001))
+
+
+def test_csv_append_writes_header_once(tmp_path):
+    path = str(tmp_path / "stream.csv")
+    messages = build_results(5, 1)[0]["messages"]
+    for append in (False, True):
+        sink = open_sink("csv", path, append)
+        sink.write("chan", "Chan", messages)
+        sink.close()
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    assert text.count("\ufeff") == 1
+    assert text.count("message_id") == 1
+    assert len(pd.read_csv(path, encoding="utf-8-sig")) == 10
+
+
+def test_parquet_crash_before_close_leaves_readable_dataset(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "PARQUET_ROW_GROUP_SIZE", 100)
+    path = str(tmp_path / "stream.parquet")
+    messages = build_results(150, 1)[0]["messages"]
+    sink = open_sink("parquet", path)
+    sink.write("chan", "Chan", messages.slice(0, 50))
+    sink.flush("chan")
+    sink.write("chan", "Chan", messages.slice(50, 150))
+    # Процесс упал: второй файл не закрыт, у него нет футера
+    target = partition_dir(path, "chan")
+    assert sorted(os.listdir(target)) == ["_part-1.tmp", "part-0.parquet"]
+    assert pq.read_table(path).num_rows == 50
+
+    sink = open_sink("parquet", path, append=True)
+    sink.write("chan", "Chan", messages.slice(50, 150))
+    sink.close()
+    assert sorted(os.listdir(target)) == ["part-0.parquet", "part-1.parquet"]
+    assert [pq.read_metadata(part).num_rows for part in partition_parts(path, "chan")] == [50, 100]
+    assert pq.read_table(path).num_rows == 150
+
+
+def test_parquet_without_append_replaces_channel_files(tmp_path):
+    path = str(tmp_path / "stream.parquet")
+    messages = build_results(30, 1)[0]["messages"]
+    for append in (False, True, False):
+        sink = open_sink("parquet", path, append)
+        sink.write("chan", "Chan", messages)
+        sink.close()
+    assert [os.path.basename(part) for part in partition_parts(path, "chan")] == ["part-0.parquet"]